@@ -108,6 +108,55 @@ CFG_DATABASE_USER = "invenio"
 # CFG_FLASK_CACHE_TYPE has been deprecated.
 CACHE_TYPE = "redis"
 
+# CFG_DATACACHER_BACKGROUND_CACHES -- names of the DataCacher classes whose
+# content is recreated in a background thread when it gets outdated while
+# serving a request.  The outdated content is served until the new one is
+# ready, so that requests do not wait for the cache to be filled.
+CFG_DATACACHER_BACKGROUND_CACHES = ['CollectionRecListDataCacher']
+
+# CFG_DATACACHER_SHARED_CACHES -- names of the DataCacher classes whose
+# content is filled once per host and stored in a memory-mapped file under
+# CFG_CACHEDIR shared by all the worker processes instead of being kept in
+# every process.  Numpy arrays are used in place from the file, big or
+# nested dictionaries are searched in place and intbitsets are copied
+# without decompression, so that the caches made of them take little
+# memory in every process: CollectionRecListDataCacher,
+# CitationDictsDataCacher, BibSortDataCacher and FacetIndexDataCacher
+# (SynonymDataCacher is always shared).  Small caches of SQL rows do not
+# benefit from it.
+# Shared caches are always filled again instead of being patched.
+CFG_DATACACHER_SHARED_CACHES = []
+
+# CFG_DATACACHER_SHARED_LOADED_VALUES -- how many intbitsets and other
+# deserialized values of a shared cache each worker process keeps, the
+# most recently used ones.  Other values are read from the memory-mapped
+# file on access; arrays and dictionaries are views of it.
+CFG_DATACACHER_SHARED_LOADED_VALUES = 16
+
+# CFG_DATACACHER_TABLE_CHECK_INTERVAL -- how often (in seconds) the update
+# times of all the database tables watched by data cachers are read from
+# the database, using a single query.  In between, the cache freshness
+# checks use the update times known from the previous check.
+CFG_DATACACHER_TABLE_CHECK_INTERVAL = 5
+
+# CFG_BIBRANK_WORD_POSTING_CACHE_SIZE -- how many term postings of the
+# word similarity ranking each process keeps in memory, the most recently
+# used ones.  A posting is read again from the database when the word
+# table is updated.  Set to 0 to read the postings at every query.
+CFG_BIBRANK_WORD_POSTING_CACHE_SIZE = 1000
+
+# CFG_BIBRANK_CITATION_LOG_MAX_CHANGES -- how many citation changes logged
+# into rnkCITATIONLOG are at most applied to the cached citation
+# dictionaries when the citation method is updated.  With more changes,
+# the cache is filled again from the database instead.
+CFG_BIBRANK_CITATION_LOG_MAX_CHANGES = 100000
+
+# CFG_WEBSEARCH_VISIBILITY_CACHE_SIZE -- how many bitsets of the records
+# hidden from, or displayable to, users with given permitted restricted
+# collections each process keeps.  They are dropped all at once when the
+# limit is reached or when the collection caches change.
+CFG_WEBSEARCH_VISIBILITY_CACHE_SIZE = 1000
+
 REQUIREJS_CONFIG = "js/build.js"
 
 # DO NOT EDIT THIS FILE!  IT WAS AUTOMATICALLY GENERATED
@@ -276,10 +276,8 @@ def create_wsgi_app(*args, **kwargs):
         # FIXME: move to invenio.modules.ranker.views when its created
         try:
             from invenio.legacy.bibrank.citation_searcher import \
-                get_citedby_hitset, \
-                get_refersto_hitset
-            get_citedby_hitset(None)
-            get_refersto_hitset(None)
+                get_citation_dict
+            get_citation_dict('citations_graph')
         except Exception:
             pass
 
@@ -72,6 +72,15 @@ This signal is sent right after webcoll runs reclist cache update.
 It passes all updated collections.
 """
 
+tables_updated = _signals.signal('tables-updated')
+"""
+This signal is sent right after a tool such as bibindex has modified some
+database tables.  It passes the names of the modified tables as `tables`
+so that data caches of the sending process watching them are refreshed
+without waiting for the next table timestamp check.  Other processes are
+not notified; they notice the modification at their next periodic check.
+"""
+
 pre_command = _signals.signal('pre-command')
 """
 This signal is sent right before any inveniomanage command is executed.
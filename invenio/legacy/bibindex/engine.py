@@ -30,6 +30,8 @@ __revision__ = "$Id$"
 import re
 import sys
 import time
+import signal
+import multiprocessing
 import fnmatch
 import inspect
 from datetime import datetime
@@ -45,7 +47,10 @@ from invenio.legacy.bibindex.engine_config import CFG_MAX_MYSQL_THREADS, \
      CFG_BIBINDEX_UPDATE_MODE, \
      CFG_BIBINDEX_TOKENIZER_TYPE, \
      CFG_BIBINDEX_WASH_INDEX_TERMS, \
-     CFG_BIBINDEX_SPECIAL_TAGS
+     CFG_BIBINDEX_SPECIAL_TAGS, \
+     CFG_BIBINDEX_FLUSH_BATCH_SIZE, \
+     CFG_BIBINDEX_FLUSH_MAX_STATEMENT_SIZE, \
+     CFG_BIBINDEX_WORKERS
 from invenio.legacy.bibauthority.config import \
      CFG_BIBAUTHORITY_CONTROLLED_FIELDS_BIBLIOGRAPHIC
 from invenio.legacy.bibauthority.engine import get_index_strings_by_control_no,\
@@ -53,8 +58,8 @@ from invenio.legacy.bibauthority.engine import get_index_strings_by_control_no,\
 from invenio.legacy.search_engine import perform_request_search, \
      get_synonym_terms, \
      search_pattern
-from invenio.legacy.dbquery import run_sql, DatabaseError, serialize_via_marshal, \
-     deserialize_via_marshal, wash_table_column_name
+from invenio.legacy.dbquery import run_sql, run_sql_many, DatabaseError, \
+     serialize_via_marshal, deserialize_via_marshal, wash_table_column_name
 from invenio.legacy.bibindex.engine_washer import wash_index_term
 from invenio.legacy.bibsched.bibtask import task_init, write_message, get_datetime, \
     task_set_option, task_get_option, task_get_task_param, \
@@ -114,6 +119,7 @@ nb_char_in_line = 50  # for verbose pretty printing
 chunksize = 1000 # default size of chunks that the records will be treated by
 base_process_size = 4500 # process base size
 _last_word_table = None
+_worker_word_table = None
 
 
 _TOKENIZERS = load_tokenizers()
@@ -465,6 +471,8 @@ def update_index_last_updated(indexes, starting_time=None):
                       (starting_time, index_name), verbose=9)
         run_sql("UPDATE idxINDEX SET last_updated=%s WHERE name=%s",
                 (starting_time, index_name))
+    from invenio.base.signals import tables_updated
+    tables_updated.send('bibindex', tables=['idxINDEX'])
 
 
 def get_percentage_completed(num_done, num_total):
@@ -603,6 +611,90 @@ def chunk_generator(rng):
             current_low += chunksize
 
 
+def split_recID_ranges(recIDs, opt_flush, size=None):
+    """Splits the recIDs range list into the chunks of records treated
+    between two flushes of the word table.  Yields lists of [low, high]
+    ranges of at most SIZE records, each list holding at most OPT_FLUSH
+    records, i.e. the records flushed together by add_recIDs().
+    """
+    if size is None:
+        size = chunksize
+    chunks = []
+    flush_count = 0
+    for arange in recIDs:
+        i_low = arange[0]
+        while i_low <= arange[1]:
+            i_high = min(i_low + min(size, opt_flush - flush_count) - 1,
+                         arange[1])
+            chunks.append([i_low, i_high])
+            flush_count += i_high - i_low + 1
+            if flush_count >= opt_flush:
+                yield chunks
+                chunks = []
+                flush_count = 0
+            i_low = i_high + 1
+    if chunks:
+        yield chunks
+
+
+def split_rows_by_size(rows, max_size=None):
+    """Splits ROWS (tuples of strings and numbers) into lists of rows
+    whose strings sum up to about MAX_SIZE bytes, so that multi-row
+    statements stay below max_allowed_packet."""
+    if max_size is None:
+        max_size = CFG_BIBINDEX_FLUSH_MAX_STATEMENT_SIZE
+    chunks = [[]]
+    chunk_size = 0
+    for row in rows:
+        if chunk_size > max_size:
+            chunks.append([])
+            chunk_size = 0
+        chunks[-1].append(row)
+        chunk_size += sum(len(value) for value in row
+                          if isinstance(value, basestring))
+    return chunks
+
+
+def _close_sqlalchemy_connections():
+    """Releases the SQLAlchemy session and pooled connections of this
+    process, so that no MySQL connection is shared across a fork.  The
+    connections of run_sql() are already opened per process."""
+    from invenio.ext.sqlalchemy import db
+    db.session.remove()
+    db.engine.dispose()
+
+
+def _init_word_table_worker(word_table):
+    """Initializes a worker process of the parallel indexing: stores the
+    (forked) word table, closes the inherited SQLAlchemy connections and
+    restores the default signal handlers, so that the bibsched handlers of
+    the parent do not run in the workers."""
+    global _worker_word_table
+    _close_sqlalchemy_connections()
+    for signum in (signal.SIGTERM, signal.SIGQUIT, signal.SIGABRT,
+                   signal.SIGUSR2, signal.SIGTSTP):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_word_table = word_table
+
+
+def _collect_recID_range(recID_range):
+    """Tokenizes the records of RECID_RANGE in a worker process.
+
+    Returns the range, the partial term -> {recID: sign} map of the range
+    and the number of records processed.  The reverse index table rows of
+    the records are written by the worker, the word table is flushed by the
+    parent process.
+    """
+    word_table = _worker_word_table
+    word_table.value = {}
+    word_table.recIDs_in_mem = []
+    low, high = recID_range
+    word_table.del_recID_range(low, high)
+    done = word_table.add_recID_range(low, high)
+    return low, high, word_table.value, done
+
+
 class AbstractIndexTable(object):
     """
         This class represents an index table in database.
@@ -661,10 +753,19 @@ class AbstractIndexTable(object):
         nb_words_total = len(self.value)
         nb_words_report = int(nb_words_total / 10.0)
         nb_words_done = 0
-        for word in self.value.keys():
-            self.put_word_into_db(word)
-            nb_words_done += 1
-            if nb_words_report != 0 and ((nb_words_done % nb_words_report) == 0):
+        batch_size = max(CFG_BIBINDEX_FLUSH_BATCH_SIZE, 1)
+        words = self.value.keys()
+        flush_start = time.time()
+        for i in range(0, nb_words_total, batch_size):
+            batch = words[i:i + batch_size]
+            if CFG_BIBINDEX_FLUSH_BATCH_SIZE > 0:
+                self.put_words_into_db(batch)
+            else:
+                self.put_word_into_db(batch[0])
+            nb_words_done_before = nb_words_done
+            nb_words_done += len(batch)
+            if nb_words_report != 0 and (nb_words_done // nb_words_report !=
+                                         nb_words_done_before // nb_words_report):
                 write_message('......processed %d/%d words' % \
                               (nb_words_done, nb_words_total))
                 percentage_display = get_percentage_completed(nb_words_done, nb_words_total)
@@ -672,9 +773,13 @@ class AbstractIndexTable(object):
                                      (tab_name, self.index_name,
                                       nb_words_done, nb_words_total,
                                       percentage_display))
+        flush_time = time.time() - flush_start
 
         write_message('...updating %d words into %s ended' % \
                       (nb_words_total, tab_name))
+        if flush_time > 0:
+            write_message('...flushed %.1f words per second into %s' % \
+                          (nb_words_total / flush_time, self.table_name))
 
         write_message('...updating reverse table %s started' % tab_name)
         if mode == "normal":
@@ -739,6 +844,78 @@ class AbstractIndexTable(object):
         if not set: # never store empty words
             run_sql("DELETE FROM %s WHERE term=%%s" % wash_table_column_name(self.table_name), (word,)) # kwalitee: disable=sql
 
+    def put_words_into_db(self, words):
+        """Flush a batch of words to the database.
+
+           Existing hitlists of all the words are fetched by one query,
+           merged in memory and written back by one executemany UPDATE,
+           one multi-row INSERT and one DELETE.  Words whose row cannot be
+           matched unambiguously (e.g. terms differing only by case, which
+           the table collation considers equal) are flushed one by one.
+        """
+        table_name = wash_table_column_name(self.table_name)
+        placeholders = ', '.join(['%s'] * len(words))
+        res = run_sql("SELECT term, hitlist FROM %s WHERE term IN (%s)" % \
+                      (table_name, placeholders), tuple(words)) # kwalitee: disable=sql
+        old_hitlists = {}
+        ambiguous_rows = False
+        batch = dict.fromkeys(words)
+        for term, hitlist in res:
+            if term in batch and term not in old_hitlists:
+                old_hitlists[term] = hitlist
+            else:
+                ambiguous_rows = True
+
+        updates = []
+        deletes = []
+        new_words = {}
+        single_words = []
+        for word in words:
+            if word in old_hitlists:
+                hitset = intbitset(old_hitlists[word])
+                hitlist_was_changed = self.merge_with_old_recIDs(word, hitset)
+                if not hitset: # never store empty words
+                    deletes.append(word)
+                elif hitlist_was_changed:
+                    updates.append((hitset.fastdump(), word))
+            elif ambiguous_rows:
+                single_words.append(word)
+            else:
+                new_words.setdefault(word.lower(), []).append(word)
+
+        inserts = []
+        for same_words in new_words.values():
+            if len(same_words) > 1:
+                single_words.extend(same_words)
+                continue
+            word = same_words[0]
+            hitset = intbitset(self.value[word].keys())
+            if hitset:
+                inserts.append((word, hitset.fastdump()))
+
+        if updates:
+            write_message("......... updating %d hitlists" % len(updates),
+                          verbose=9)
+            run_sql_many("UPDATE %s SET hitlist=%%s WHERE term=%%s" % \
+                         table_name, updates) # kwalitee: disable=sql
+        if inserts:
+            write_message("......... inserting %d hitlists" % len(inserts),
+                          verbose=9)
+            for chunk in split_rows_by_size(inserts):
+                try:
+                    run_sql("INSERT INTO %s (term, hitlist) VALUES %s" % \
+                            (table_name, ', '.join(['(%s, %s)'] * len(chunk))),
+                            tuple(param for row in chunk for param in row)) # kwalitee: disable=sql
+                except DatabaseError:
+                    # e.g. a term equal to another one for the table collation
+                    single_words.extend(word for word, dummy in chunk)
+        if deletes:
+            run_sql("DELETE FROM %s WHERE term IN (%s)" % \
+                    (table_name, ', '.join(['%s'] * len(deletes))),
+                    tuple(deletes)) # kwalitee: disable=sql
+        for word in single_words:
+            self.put_word_into_db(word)
+
     def put(self, recID, word, sign):
         """Keeps track of changes done during indexing
            and stores these changes in memory for further use.
@@ -1358,12 +1535,16 @@ class WordTable(AbstractIndexTable):
             write_message("The word '%s' does not exist in the word file."\
                               % word)
 
-    def add_recIDs(self, recIDs, opt_flush):
+    def add_recIDs(self, recIDs, opt_flush, workers=1):
         """Fetches records which id in the recIDs range list and adds
         them to the wordTable.  The recIDs range list is of the form:
         [[i1_low,i1_high],[i2_low,i2_high], ..., [iN_low,iN_high]].
+        When WORKERS is greater than 1, the records are tokenized in
+        parallel, see add_recIDs_in_parallel().
         """
         global chunksize, _last_word_table
+        if workers > 1:
+            return self.add_recIDs_in_parallel(recIDs, opt_flush, workers)
         flush_count = 0
         records_done = 0
         records_to_go = 0
@@ -1421,6 +1602,65 @@ class WordTable(AbstractIndexTable):
             self.log_progress(time_started, records_done, records_to_go)
         self.notify_virtual_indexes(recIDs)
 
+    def add_recIDs_in_parallel(self, recIDs, opt_flush, workers):
+        """Adds the records of the recIDs range list to the wordTable like
+        add_recIDs(), but tokenizes them in a pool of WORKERS processes.
+
+        Every worker treats one chunk of records at a time and sends back
+        the partial term -> {recID: sign} map of the chunk.  As the chunks
+        are disjoint, this process merges the maps into self.value and is
+        the only one flushing the word table, every opt_flush records.
+        """
+        records_done = 0
+        records_to_go = 0
+        for arange in recIDs:
+            records_to_go = records_to_go + arange[1] - arange[0] + 1
+
+        write_message("%s tokenizing records with %d workers" % \
+                (self.table_name, workers))
+        time_started = time.time() # will measure profile time
+        # the workers must not inherit the connections of this process
+        _close_sqlalchemy_connections()
+        pool = multiprocessing.Pool(workers, _init_word_table_worker, (self,))
+        try:
+            for chunks in split_recID_ranges(recIDs, opt_flush):
+                task_sleep_now_if_required()
+                try:
+                    for i_low, i_high in chunks:
+                        self.chk_recID_range(i_low, i_high)
+                except StandardError:
+                    if self.index_name == 'fulltext' and CFG_SOLR_URL:
+                        solr_commit()
+                    raise
+                if CFG_CHECK_MYSQL_THREADS:
+                    kill_sleepy_mysql_threads()
+                percentage_display = get_percentage_completed(records_done, records_to_go)
+                task_update_progress("(%s:%s) adding recs %d-%d %s" % (self.table_name, self.index_name, chunks[0][0], chunks[-1][1], percentage_display))
+                for i_low, i_high, value, just_processed in \
+                        pool.imap(_collect_recID_range, chunks):
+                    self.recIDs_in_mem.append([i_low, i_high])
+                    for word, signs in iteritems(value):
+                        if word in self.value:
+                            self.value[word].update(signs)
+                        else:
+                            self.value[word] = signs
+                    records_done = records_done + just_processed
+                    write_message(CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR % \
+                            (self.table_name, i_low, i_high))
+                self.put_into_db()
+                self.clean()
+                if self.index_name == 'fulltext' and CFG_SOLR_URL:
+                    solr_commit()
+                write_message("%s backing up" % (self.table_name))
+                self.log_progress(time_started, records_done, records_to_go)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        self.notify_virtual_indexes(recIDs)
+
     def add_recID_range(self, recID1, recID2):
         """Add records from RECID1 to RECID2."""
         wlist = {}
@@ -1470,23 +1710,16 @@ class WordTable(AbstractIndexTable):
 
         # were there some words for these recIDs found?
         recIDs = wlist.keys()
+        deleted_recIDs = self.get_deleted_recIDs(recID1, recID2)
         for recID in recIDs:
             # was this record marked as deleted?
-            if "DELETED" in self.get_field(recID, "980__c"):
+            if recID in deleted_recIDs:
                 wlist[recID] = []
                 write_message("... record %d was declared deleted, removing its word list" % recID, verbose=9)
             write_message("... record %d, termlist: %s" % (recID, wlist[recID]), verbose=9)
 
         if len(wlist) == 0: return 0
-        # put words into reverse index table with FUTURE status:
-        for recID in recIDs:
-            run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'FUTURE')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal(wlist[recID]))) # kwalitee: disable=sql
-            # ... and, for new records, enter the CURRENT status as empty:
-            try:
-                run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES (%%s,%%s,'CURRENT')" % wash_table_column_name(self.table_name[:-1]), (recID, serialize_via_marshal([]))) # kwalitee: disable=sql
-            except DatabaseError:
-                # okay, it's an already existing record, no problem
-                pass
+        self.put_termlists_into_db(wlist)
 
         # put words into memory word list:
         put = self.put
@@ -1495,6 +1728,34 @@ class WordTable(AbstractIndexTable):
                 put(recID, w, 1)
         return len(recIDs)
 
+    def get_deleted_recIDs(self, recID1, recID2):
+        """Returns the intbitset of records from RECID1 to RECID2 that are
+           declared deleted (980__c:DELETED)."""
+        query = """SELECT bb.id_bibrec, b.value FROM bib98x AS b,
+                   bibrec_bib98x AS bb WHERE bb.id_bibrec BETWEEN %s AND %s
+                   AND bb.id_bibxxx=b.id AND b.tag LIKE '980__c'"""
+        res = run_sql(query, (recID1, recID2))
+        return intbitset([recID for recID, value in res if value == "DELETED"])
+
+    def put_termlists_into_db(self, wlist):
+        """Puts the termlists of WLIST (recID -> words) into the reverse
+           index table with FUTURE status and, for new records, enters the
+           CURRENT status as empty.  Rows are written by multi-row
+           statements."""
+        table_name = wash_table_column_name(self.table_name[:-1])
+        recIDs = sorted(wlist.keys())
+        rows = [(recID, serialize_via_marshal(wlist[recID])) for recID in recIDs]
+        for chunk in split_rows_by_size(rows):
+            run_sql("INSERT INTO %sR (id_bibrec,termlist,type) VALUES %s" % \
+                    (table_name, ', '.join(["(%s,%s,'FUTURE')"] * len(chunk))),
+                    tuple(param for row in chunk for param in row)) # kwalitee: disable=sql
+        # already existing records keep their CURRENT termlist:
+        empty_termlist = serialize_via_marshal([])
+        for chunk in split_rows_by_size([(recID, empty_termlist) for recID in recIDs]):
+            run_sql("INSERT IGNORE INTO %sR (id_bibrec,termlist,type) VALUES %s" % \
+                    (table_name, ', '.join(["(%s,%s,'CURRENT')"] * len(chunk))),
+                    tuple(param for row in chunk for param in row)) # kwalitee: disable=sql
+
     def find_nonmarc_records(self, recID1, recID2):
         """Divides recID range into two different tables,
            first one contains only recIDs of the records that
@@ -1788,10 +2049,11 @@ def main():
   -w, --windex=w1[,w2]\tword/phrase indexes to consider (all)
   -M, --maxmem=XXX\tmaximum memory usage in kB (no limit)
   -f, --flush=NNN\t\tfull consistent table flush after NNN records (10000)
+  --workers=NNN\t\ttokenize records in NNN parallel processes (%d)
   --force\t\tforce indexing of all records for provided indexes
   -Z, --remove-dependent-index=w  name of an index for removing from virtual index
   -l --all-virtual\t\t set of all virtual indexes; the same as: -w virtual_ind1, virtual_ind2, ...
-""",
+""" % CFG_BIBINDEX_WORKERS,
             version=__revision__,
             specific_params=("adi:m:c:w:krRM:f:oZ:l", [
                 "add",
@@ -1805,6 +2067,7 @@ def main():
                 "reindex",
                 "maxmem=",
                 "flush=",
+                "workers=",
                 "force",
                 "remove-dependent-index=",
                 "all-virtual"
@@ -1860,6 +2123,10 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args):
                 (base_process_size + 1000))
     elif key in ("-f", "--flush"):
         task_set_option("flush", int(value))
+    elif key in ("--workers",):
+        task_set_option("workers", int(value))
+        if task_get_option("workers") < 1:
+            raise StandardError("Number of workers should be at least 1")
     elif key in ("-o", "--force"):
         task_set_option("force", True)
     elif key in ("-Z", "--remove-dependent-index",):
@@ -2215,7 +2482,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", CFG_BIBINDEX_WORKERS))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2254,7 +2522,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", CFG_BIBINDEX_WORKERS))
                 task_sleep_now_if_required(can_stop_too=True)
             elif task_get_option("cmd") == "repair":
                 wordTable.repair(task_get_option("flush"))
@@ -2293,7 +2562,8 @@ def task_run_core():
                     raise StandardError(error_message)
             elif task_get_option("cmd") == "add":
                 final_recIDs = beautify_range_list(create_range_list(recIDs_for_index[index_name]))
-                wordTable.add_recIDs(final_recIDs, task_get_option("flush"))
+                wordTable.add_recIDs(final_recIDs, task_get_option("flush"),
+                                     task_get_option("workers", CFG_BIBINDEX_WORKERS))
                 if not task_get_option("id") and not task_get_option("collection"):
                     update_index_last_updated([index_name], task_get_task_param('task_starting_time'))
                 task_sleep_now_if_required(can_stop_too=True)
@@ -52,6 +52,20 @@ CFG_BIBINDEX_WASH_INDEX_TERMS = { 'Words': 50,
                                   'Pairs': 100,
                                   'Phrases': 0}
 
+# number of words flushed together to the index tables: their hitlists are
+# read by one query and written back by multi-row statements (0 flushes
+# the words one by one)
+CFG_BIBINDEX_FLUSH_BATCH_SIZE = 1000
+
+# approximate maximal size (in bytes) of the terms and hitlists inserted by
+# one multi-row statement while flushing, to stay below max_allowed_packet
+CFG_BIBINDEX_FLUSH_MAX_STATEMENT_SIZE = 4 * 1024 * 1024
+
+# number of worker processes tokenizing records in parallel while adding
+# records (the --workers option of bibindex overrides it; 1 means the
+# records are tokenized by the bibindex process itself)
+CFG_BIBINDEX_WORKERS = 1
+
 CFG_BIBINDEX_ADDING_RECORDS_STARTED_STR = "%s adding records #%d-#%d started"
 
 CFG_BIBINDEX_UPDATE_MESSAGE = "Searching for records which should be reindexed..."
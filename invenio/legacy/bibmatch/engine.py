@@ -32,6 +32,7 @@ import os
 import getopt
 import re
 import getpass
+from itertools import chain
 from six import iteritems
 from tempfile import mkstemp
 from time import sleep
@@ -47,7 +48,7 @@ from invenio.legacy.bibmatch.config import CFG_BIBMATCH_LOGGER, \
                                     CFG_LOGFILE
 from invenio_client import InvenioConnector, \
                                       InvenioConnectorAuthError
-from invenio.legacy.bibrecord import create_records, \
+from invenio.legacy.bibrecord import create_records, iter_records, \
     record_get_field_values, record_xml_output, record_modify_controlfield, \
     record_has_field, record_add_field
 from invenio.legacy.bibconvert import api as bibconvert
@@ -691,8 +692,8 @@ def match_records(records, qrystrs=None, search_mode=None, operator="and", \
     records matching are appended to each record tuple:
     (record, status_code, list_of_errors, result)
 
-    @param records: records to analyze
-    @type records: list of records
+    @param records: records to analyze, read as they are matched
+    @type records: list or iterator of records
 
     @param qrystrs: list of tuples (field, querystring)
     @type qrystrs: list
@@ -747,7 +748,7 @@ def match_records(records, qrystrs=None, search_mode=None, operator="and", \
     matchedrecs = []
     ambiguousrecs = []
     fuzzyrecs = []
-    CFG_BIBMATCH_LOGGER.info("-- BibMatch starting match of %d records --" % (len(records),))
+    CFG_BIBMATCH_LOGGER.info("-- BibMatch starting match --")
     try:
         server = InvenioConnector(server_url, user=user, password=password,
                                   insecure_login=insecure_login)
@@ -1143,6 +1144,20 @@ def transform_input_to_marcxml(filename=None, file_input=""):
         sys.stdout = old_stdout
     return new_stdout.getvalue()
 
+class BibMatchParseError(Exception):
+    """Raised when an input record could not be parsed."""
+
+def iter_parsed_records(bibrecs):
+    """
+    Iterate over parsed BibRec objects, like the output of
+    bibrecord.iter_records(), raising BibMatchParseError when reaching a
+    badly parsed record.
+    """
+    for bibrec in bibrecs:
+        if bibrec[1] == 0:
+            raise BibMatchParseError(bibrec[2])
+        yield bibrec
+
 def bibrecs_has_errors(bibrecs):
     """
     Utility function to check a list of parsed BibRec objects, directly
@@ -1289,35 +1304,71 @@ def main():
     if verbose:
         sys.stderr.write("\nBibMatch: Parsing input file %s..." % (f_input,))
 
-    read_list = []
+    file_read = None
+    records = None
+    marc_file = None
     if not f_input:
-        for line_in in sys.stdin:
-            read_list.append(line_in)
+        file_read = "".join(sys.stdin)
     else:
-        f = open(f_input)
-        for line_in in f:
-            read_list.append(line_in)
-        f.close()
-    file_read = "".join(read_list)
+        marc_file = open(f_input)
+        if marc_file.read(4096).strip().startswith('<'):
+            # MARCXML input file, parse it as it is matched
+            marc_file.seek(0)
+            records = iter_records(marc_file)
+        else:
+            marc_file.seek(0)
+            file_read = marc_file.read()
+            marc_file.close()
+            marc_file = None
 
-    # Detect input type
-    if not file_read.strip().startswith('<'):
-        # Not xml, assume type textmarc
-        file_read = transform_input_to_marcxml(f_input, file_read)
+    if records is None:
+        # Detect input type
+        if not file_read.strip().startswith('<'):
+            # Not xml, assume type textmarc
+            file_read = transform_input_to_marcxml(f_input, file_read)
 
-    records = create_records(file_read)
+        records = iter(create_records(file_read))
 
-    if len(records) == 0:
+    first_record = next(records, None)
+    if first_record is None:
         if verbose:
             sys.stderr.write("\nBibMatch: Input file contains no records.\n")
         sys.exit(1)
+    records = chain([first_record], records)
+
+    if verbose:
+        sys.stderr.write("\nBibMatch: Matching ...")
+
+    if not validate:
+        if verbose:
+            sys.stderr.write("\nWARNING: Skipping match validation.\n")
 
-    # Check for any parsing errors in records
-    if bibrecs_has_errors(records):
-        # Errors found. Let's try to remove any XML entities
+    match_options = dict(qrystrs=qrystrs,
+                         search_mode=search_mode,
+                         operator=operator,
+                         verbose=verbose,
+                         server_url=server_url,
+                         modify=modify,
+                         sleeptime=sleeptime,
+                         clean=clean,
+                         collections=collections,
+                         user=user,
+                         password=password,
+                         fuzzy=fuzzy,
+                         validate=validate,
+                         ascii_mode=ascii_mode)
+    try:
+        match_results = match_records(records=iter_parsed_records(records),
+                                      **match_options)
+    except BibMatchParseError:
+        # Errors found. Let's try to remove any XML entities and match all
+        # the records again
         if verbose > 8:
             sys.stderr.write("\nBibMatch: Parsing error. Trying removal of XML entities..\n")
 
+        if file_read is None:
+            marc_file.seek(0)
+            file_read = marc_file.read()
         file_read = xml_entities_to_utf8(file_read)
         records = create_records(file_read)
         if bibrecs_has_errors(records):
@@ -1328,30 +1379,10 @@ def main():
                 sys.stderr.write("\nBibMatch: Errors during record parsing:\n%s\n" % \
                                  (errors,))
             sys.exit(1)
-
-    if verbose:
-        sys.stderr.write("read %d records" % (len(records),))
-        sys.stderr.write("\nBibMatch: Matching ...")
-
-    if not validate:
-        if verbose:
-            sys.stderr.write("\nWARNING: Skipping match validation.\n")
-
-    match_results = match_records(records=records,
-                                  qrystrs=qrystrs,
-                                  search_mode=search_mode,
-                                  operator=operator,
-                                  verbose=verbose,
-                                  server_url=server_url,
-                                  modify=modify,
-                                  sleeptime=sleeptime,
-                                  clean=clean,
-                                  collections=collections,
-                                  user=user,
-                                  password=password,
-                                  fuzzy=fuzzy,
-                                  validate=validate,
-                                  ascii_mode=ascii_mode)
+        match_results = match_records(records=records, **match_options)
+    finally:
+        if marc_file is not None:
+            marc_file.close()
 
     # set the output according to print..
     # 0-newrecs 1-matchedrecs 2-ambiguousrecs 3-fuzzyrecs
@@ -1365,7 +1396,8 @@ def main():
         sys.stderr.write("\n Ambiguous records   : %d" % (len(match_results[2]),))
         sys.stderr.write("\n Fuzzy records       : %d\n" % (len(match_results[3]),))
         sys.stderr.write("=" * 35)
-        sys.stderr.write("\n Total records       : %d\n" % (len(records),))
+        sys.stderr.write("\n Total records       : %d\n" % \
+                         (sum([len(result) for result in match_results]),))
         sys.stderr.write("\n See detailed log at %s\n" % (CFG_LOGFILE,))
 
     if not noprocess and recs_out:
@@ -20,6 +20,7 @@
 __revision__ = "$Id$"
 
 import re
+import time
 
 from invenio.legacy.dbquery import run_sql
 from intbitset import intbitset
@@ -27,46 +28,259 @@ from invenio.legacy.miscutil.data_cacher import DataCacher
 from invenio.ext.cache import cache
 from invenio.legacy.dbquery import deserialize_via_marshal
 from operator import itemgetter
-from six import iteritems
+from numpy import append, arange, argsort, array, bincount, cumsum, diff, \
+    flatnonzero, fromiter, in1d, insert, ones, repeat, searchsorted, unique, \
+    zeros
+from six import iteritems, iterkeys, itervalues
+
+
+class CitationGraph(object):
+    """
+    Compact adjacency lists of the citation graph, stored in both
+    directions: the records referenced by a record X are
+    ``citees[citer_ptr[X]:citer_ptr[X + 1]]`` and the records citing X
+    are ``citers[citee_ptr[X]:citee_ptr[X + 1]]``.
+    """
+    def __init__(self, citers, citees):
+        """
+        @param citers, citees: arrays of the citing and the cited record
+                of every citation
+        """
+        size = int(max(citers.max(), citees.max())) + 1 if len(citers) else 0
+        self.citer_ptr, self.citees = self._adjacency(citers, citees, size)
+        self.citee_ptr, self.citers = self._adjacency(citees, citers, size)
+
+    @staticmethod
+    def _adjacency(sources, targets, size):
+        """Return the row pointers and the targets sorted by source."""
+        ptr = zeros(size + 1, dtype='int64')
+        if size:
+            ptr[1:] = cumsum(bincount(sources, minlength=size))
+        return ptr, targets[argsort(sources, kind='mergesort')]
+
+    @staticmethod
+    def _neighbours(ptr, targets, recids):
+        """Return the array of the targets of all given records."""
+        recids = fromiter(recids, dtype='int64')
+        recids = recids[(recids >= 0) & (recids < len(ptr) - 1)]
+        starts = ptr[recids]
+        lengths = ptr[recids + 1] - starts
+        ends = cumsum(lengths)
+        positions = repeat(starts - ends + lengths, lengths) + arange(ends[-1] if len(ends) else 0)
+        return targets[positions]
+
+    def get_refers_to(self, recids):
+        """Return the records referenced by some of the given records."""
+        return intbitset(self._neighbours(self.citer_ptr, self.citees, recids).tolist())
+
+    def get_cited_by(self, recids):
+        """Return the records citing some of the given records."""
+        return intbitset(self._neighbours(self.citee_ptr, self.citers, recids).tolist())
+
+    def get_refers_to_list(self, recids):
+        """Return the list of (recid, set of records it references)."""
+        return [(recid, set(self._neighbours(self.citer_ptr, self.citees, (recid,)).tolist()))
+                for recid in recids]
+
+    def get_cited_by_list(self, recids):
+        """Return the list of (recid, set of records citing it)."""
+        return [(recid, set(self._neighbours(self.citee_ptr, self.citers, (recid,)).tolist()))
+                for recid in recids]
+
+    def get_co_cited_with_counts(self, recid):
+        """Return the arrays of the records co-cited with recid and of the
+        number of records citing both."""
+        citers = self._neighbours(self.citee_ptr, self.citers, (recid,))
+        citees = self._neighbours(self.citer_ptr, self.citees, citers)
+        citees = citees[citees != recid]
+        citees.sort()
+        co_cited, first = unique(citees, return_index=True)
+        return co_cited, diff(append(first, len(citees)))
+
+    def has_citation(self, citer, citee):
+        """Check if citer cites citee."""
+        if citer >= len(self.citer_ptr) - 1:
+            return False
+        return citee in self.citees[self.citer_ptr[citer]:self.citer_ptr[citer + 1]]
+
+    def updated(self, changes):
+        """
+        Return the graph patched with the given changes, along with the
+        change of the number of citations of every modified citee.
+
+        @param changes: the citations added or removed, in chronological
+                order, as [(citer, citee, added_p), ...]. Changes that are
+                already reflected by the graph are ignored.
+        @return: (graph, {citee: delta})
+        """
+        final = {}
+        for citer, citee, added_p in changes:
+            final[(citer, citee)] = added_p
+        added = [pair for pair, added_p in iteritems(final)
+                 if added_p and not self.has_citation(*pair)]
+        removed = [pair for pair, added_p in iteritems(final)
+                   if not added_p and self.has_citation(*pair)]
+
+        deltas = {}
+        for dummy, citee in added:
+            deltas[citee] = deltas.get(citee, 0) + 1
+        for dummy, citee in removed:
+            deltas[citee] = deltas.get(citee, 0) - 1
+
+        added = array(added, dtype='int64').reshape(-1, 2)
+        removed = array(removed, dtype='int64').reshape(-1, 2)
+        size = max(len(self.citer_ptr) - 1, int(added.max()) + 1 if len(added) else 0)
+        graph = CitationGraph.__new__(CitationGraph)
+        graph.citer_ptr, graph.citees = self._patch(
+            self.citer_ptr, self.citees, added[:, 0], added[:, 1],
+            removed[:, 0], removed[:, 1], size)
+        graph.citee_ptr, graph.citers = self._patch(
+            self.citee_ptr, self.citers, added[:, 1], added[:, 0],
+            removed[:, 1], removed[:, 0], size)
+        return graph, deltas
+
+    @staticmethod
+    def _patch(ptr, targets, added_sources, added_targets,
+               removed_sources, removed_targets, size):
+        """Return the adjacency arrays with some edges added and removed."""
+        removed_positions = array(
+            [ptr[source] + flatnonzero(targets[ptr[source]:ptr[source + 1]] == target)[0]
+             for source, target in zip(removed_sources, removed_targets)],
+            dtype='int64')
+        removed_positions.sort()
+        keep = ones(len(targets), dtype=bool)
+        keep[removed_positions] = False
+
+        ptr = append(ptr, repeat(ptr[-1], size + 1 - len(ptr)))
+        # new edges go at the end of the list of their source, in the
+        # order of the sources since empty lists share their position
+        order = argsort(added_sources, kind='mergesort')
+        added_sources, added_targets = added_sources[order], added_targets[order]
+        positions = ptr[added_sources + 1]
+        positions -= searchsorted(removed_positions, positions)
+        targets = insert(targets[keep], positions, added_targets)
+
+        if size:
+            ptr[1:] += cumsum(bincount(added_sources, minlength=size) -
+                              bincount(removed_sources, minlength=size))
+        return ptr, targets
+
+
+def load_citation_graph():
+    """Load the citation graph from rnkCITATIONDICT."""
+    rows = run_sql("SELECT citer, citee FROM rnkCITATIONDICT")
+    edges = array(rows, dtype='int64').reshape(-1, 2)
+    return CitationGraph(edges[:, 0], edges[:, 1])
+
+
+def get_citation_log_id():
+    """Return the id of the last change logged into rnkCITATIONLOG."""
+    res = run_sql("SELECT MAX(id) FROM rnkCITATIONLOG")
+    return res and res[0][0] or 0
+
+
+def get_selfcites_last_updated():
+    """Return the last update time of the self-citation counts."""
+    res = run_sql("SELECT last_updated FROM rnkMETHOD WHERE name='selfcites'")
+    return res and str(res[0][0]) or None
+
+
+def get_citation_log(log_id, limit):
+    """
+    Return the citation changes logged after the change log_id, as
+    [(id, citer, citee, added_p), ...], or None if there are more than
+    limit of them.
+    """
+    rows = run_sql("""SELECT id, citer, citee, type FROM rnkCITATIONLOG
+                      WHERE id > %s ORDER BY id LIMIT %s""",
+                   (log_id, limit + 1))
+    if len(rows) > limit:
+        return None
+    return [(row[0], row[1], row[2], row[3] == 'added') for row in rows]
+
+
+def get_citation_counts_arrays(weights):
+    """
+    Return the arrays of recids and of their citation counts, sorted by
+    ascending counts, for weights given as {recid: count}.
+    """
+    recids = fromiter(iterkeys(weights), dtype='int64', count=len(weights))
+    cites = fromiter(itervalues(weights), dtype='int64', count=len(weights))
+    order = argsort(cites, kind='mergesort')
+    return recids[order], cites[order]
+
+
+def update_citation_counts_arrays(arrays, weights, recids):
+    """
+    Return the citation counts arrays with the counts of the given recids
+    updated from weights.
+    """
+    old_recids, old_cites = arrays
+    keep = ~in1d(old_recids, fromiter(recids, dtype='int64'))
+    new = get_citation_counts_arrays(dict((recid, weights[recid])
+                                          for recid in recids
+                                          if recid in weights))
+    positions = searchsorted(old_cites[keep], new[1], 'right')
+    return (insert(old_recids[keep], positions, new[0]),
+            insert(old_cites[keep], positions, new[1]))
+
+
+def get_citation_counts(arrays):
+    """Return the list of (recid, count) sorted by descending counts."""
+    recids, cites = arrays
+    return zip(recids[::-1].tolist(), cites[::-1].tolist())
 
 
 class CitationDictsDataCacher(DataCacher):
     """
     Cache holding all citation dictionaries (citationdict,
     reversedict, selfcitdict, selfcitedbydict).
+
+    When the citation method is updated, the cache is patched with the
+    citation changes logged into rnkCITATIONLOG since it was filled,
+    unless they are too many, see CFG_BIBRANK_CITATION_LOG_MAX_CHANGES,
+    or the self-citation counts were recomputed meanwhile.
     """
     def __init__(self):
 
         def fill():
             alldicts = {}
-            from invenio.legacy.bibrank.tag_based_indexer import fromDB
-            serialized_weights = cache.get('citations_weights')
-            if serialized_weights:
-                weights = deserialize_via_marshal(serialized_weights)
-            else:
-                weights = fromDB('citation')
+            # changes logged while the graph is loaded are applied again
+            # by the next update, which ignores the ones already loaded
+            alldicts['citations_log_id'] = get_citation_log_id()
+
+            # Citation graph for refersto:/citedby: queries
+            graph = load_citation_graph()
+            alldicts['citations_graph'] = graph
 
+            recids = flatnonzero(diff(graph.citee_ptr))
+            weights = dict(zip(recids.tolist(),
+                               diff(graph.citee_ptr)[recids].tolist()))
             alldicts['citations_weights'] = weights
             # for cited:M->N queries, it is interesting to cache also
             # some preprocessed citationdict:
             alldicts['citations_keys'] = intbitset(weights.keys())
 
-            # Citation counts
-            alldicts['citations_counts'] = [t for t in iteritems(weights)]
-            alldicts['citations_counts'].sort(key=itemgetter(1), reverse=True)
-
             # Self-cites
+            from invenio.legacy.bibrank.tag_based_indexer import fromDB
+            alldicts['selfcites_last_updated'] = get_selfcites_last_updated()
             serialized_weights = cache.get('selfcites_weights')
             if serialized_weights:
                 selfcites = deserialize_via_marshal(serialized_weights)
             else:
                 selfcites = fromDB('selfcites')
+            alldicts['selfcites'] = selfcites
             selfcites_weights = {}
-            for recid, counts in alldicts['citations_counts']:
+            for recid, counts in iteritems(weights):
                 selfcites_weights[recid] = counts - selfcites.get(recid, 0)
             alldicts['selfcites_weights'] = selfcites_weights
-            alldicts['selfcites_counts'] = [(recid, selfcites_weights.get(recid, cites)) for recid, cites in alldicts['citations_counts']]
-            alldicts['selfcites_counts'].sort(key=itemgetter(1), reverse=True)
+
+            # Citation counts, also as arrays for answering cited:M->N
+            # queries by bisection
+            for name in ('citations', 'selfcites'):
+                arrays = get_citation_counts_arrays(alldicts[name + '_weights'])
+                alldicts[name + '_counts_arrays'] = arrays
+                alldicts[name + '_counts'] = get_citation_counts(arrays)
 
             return alldicts
 
@@ -86,6 +300,77 @@ class CitationDictsDataCacher(DataCacher):
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+    def update_cache(self):
+        """
+        Patch the cache with the citation changes logged since it was
+        filled.  Return False if the cache has to be filled again
+        instead.
+        """
+        from invenio.base.globals import cfg
+        alldicts = self.cache
+        if self.shared_p or not alldicts or 'citations_log_id' not in alldicts:
+            return False
+        log_id = alldicts['citations_log_id']
+        if get_citation_log_id() < log_id:
+            # the log was purged
+            return False
+        if get_selfcites_last_updated() != \
+                alldicts.get('selfcites_last_updated'):
+            # the self-citation counts were recomputed
+            return False
+        changes = get_citation_log(
+            log_id, cfg.get('CFG_BIBRANK_CITATION_LOG_MAX_CHANGES', 0))
+        if changes is None:
+            return False
+
+        if not changes:
+            self.timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            return True
+
+        alldicts = dict(alldicts)
+        alldicts['citations_log_id'] = changes[-1][0]
+        graph, deltas = alldicts['citations_graph'].updated(
+            [change[1:] for change in changes])
+        alldicts['citations_graph'] = graph
+
+        weights = dict(alldicts['citations_weights'])
+        selfcites_weights = dict(alldicts['selfcites_weights'])
+        citations_keys = intbitset(alldicts['citations_keys'])
+        selfcites = alldicts['selfcites']
+        for recid, delta in iteritems(deltas):
+            counts = weights.get(recid, 0) + delta
+            if counts > 0:
+                weights[recid] = counts
+                selfcites_weights[recid] = counts - selfcites.get(recid, 0)
+                citations_keys.add(recid)
+            else:
+                weights.pop(recid, None)
+                selfcites_weights.pop(recid, None)
+                citations_keys.discard(recid)
+        alldicts['citations_weights'] = weights
+        alldicts['selfcites_weights'] = selfcites_weights
+        alldicts['citations_keys'] = citations_keys
+
+        for name in ('citations', 'selfcites'):
+            arrays = update_citation_counts_arrays(
+                alldicts[name + '_counts_arrays'],
+                alldicts[name + '_weights'], deltas.keys())
+            alldicts[name + '_counts_arrays'] = arrays
+            alldicts[name + '_counts'] = get_citation_counts(arrays)
+
+        self.cache = alldicts
+        self.timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        return True
+
+    def recreate_cache_if_needed(self):
+        """
+        Update the cache if needed, patching it when possible instead of
+        filling it again.
+        """
+        if self.timestamp_verifier() > self.timestamp:
+            if not self.update_cache():
+                self.create_cache()
+
 CACHE_CITATION_DICTS = None
 
 
@@ -96,11 +381,12 @@ def get_citation_dict(dictname):
     used.
 
     @param dictname: the name of the citation dictionary to return. Can
-            be citationdict, reversedict, selfcitdict, selfcitedbydict.
+            be citations_weights, citations_keys, citations_counts,
+            citations_counts_arrays, citations_graph, citations_log_id,
+            selfcites, selfcites_weights, selfcites_counts,
+            selfcites_counts_arrays.
     @type dictname: string
-    @return: a citation dictionary. The structure of the dictionary is
-            { recid -> [list of recids] }.
-    @rtype: dictionary
+    @return: the cached citation data.
     """
     global CACHE_CITATION_DICTS
     if CACHE_CITATION_DICTS is None:
@@ -139,12 +425,17 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
        be 10,0->100 etc
     """
     if exclude_selfcites:
-        cache_cited_by_dictionary_counts = get_citation_dict("selfcites_counts")
+        recids, counts = get_citation_dict("selfcites_counts_arrays")
         citations_keys = intbitset(get_citation_dict("selfcites_weights").keys())
     else:
-        cache_cited_by_dictionary_counts = get_citation_dict("citations_counts")
+        recids, counts = get_citation_dict("citations_counts_arrays")
         citations_keys = get_citation_dict("citations_keys")
 
+    def get_records_with_cites_between(first, sec):
+        """Return the records cited at least first and at most sec times."""
+        return intbitset(recids[searchsorted(counts, first, 'left'):
+                                searchsorted(counts, sec, 'right')].tolist())
+
     matches = intbitset()
     #once again, check that the parameter is a string
     if type(numstr) != type("thisisastring"):
@@ -161,9 +452,7 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
             #we return recids that are not in keys
             return allrecs - citations_keys
         else:
-            return intbitset([recid for recid, cit_count
-                        in cache_cited_by_dictionary_counts
-                        if cit_count == num])
+            return get_records_with_cites_between(num, num)
 
     # Try to get 1->10 or such
     firstsec = re.findall("(\d+)->(\d+)", numstr)
@@ -174,18 +463,14 @@ def get_records_with_num_cites(numstr, allrecs=intbitset([]),
             # Start with those that have no cites..
     	    matches = allrecs - citations_keys
         if first <= sec:
-            matches += intbitset([recid for recid, cit_count
-                             in cache_cited_by_dictionary_counts
-                             if first <= cit_count <= sec])
+            matches += get_records_with_cites_between(first, sec)
         return matches
 
     # Try to get 10+
     firstsec = re.findall("(\d+)\+", numstr)
     if firstsec:
         first = int(firstsec[0])
-        matches = intbitset([recid for recid, cit_count
-                         in cache_cited_by_dictionary_counts \
-                         if cit_count > first])
+        matches = get_records_with_cites_between(first + 1, counts[-1] if len(counts) else 0)
 
     return matches
 
@@ -207,15 +492,7 @@ def get_cited_by_list(recids, record_limit=None):
     else:
         limited_recids = recids
 
-    in_sql = ','.join('%s' for dummy in limited_recids)
-    rows = run_sql("""SELECT citer, citee FROM rnkCITATIONDICT
-                       WHERE citee IN (%s)""" % in_sql, limited_recids)
-
-    cites = {}
-    for citer, citee in rows:
-        cites.setdefault(citee, set()).add(citer)
-
-    return [(recid, cites.get(recid, set())) for recid in limited_recids]
+    return get_citation_dict("citations_graph").get_cited_by_list(limited_recids)
 
 
 def get_refers_to_list(recids, record_limit=None):
@@ -235,15 +512,7 @@ def get_refers_to_list(recids, record_limit=None):
     else:
         limited_recids = recids
 
-    in_sql = ','.join('%s' for dummy in limited_recids)
-    rows = run_sql("""SELECT citee, citer FROM rnkCITATIONDICT
-                       WHERE citer IN (%s)""" % in_sql, limited_recids)
-
-    refs = {}
-    for citee, citer in rows:
-        refs.setdefault(citer, set()).add(citee)
-
-    return [(recid, refs.get(recid, set())) for recid in limited_recids]
+    return get_citation_dict("citations_graph").get_refers_to_list(limited_recids)
 
 
 def get_refersto_hitset(ahitset, record_limit=None):
@@ -270,10 +539,7 @@ def get_refersto_hitset(ahitset, record_limit=None):
             else:
                 limited_ahitset = ahitset
 
-            in_sql = ','.join('%s' for dummy in limited_ahitset)
-            rows = run_sql("""SELECT citer FROM rnkCITATIONDICT
-                              WHERE citee IN (%s)""" % in_sql, limited_ahitset)
-            out = intbitset(rows)
+            out = get_citation_dict("citations_graph").get_cited_by(limited_ahitset)
     return out
 
 
@@ -321,10 +587,7 @@ def get_citedby_hitset(ahitset, record_limit=None):
             else:
                 limited_ahitset = ahitset
 
-            in_sql = ','.join('%s' for dummy in limited_ahitset)
-            rows = run_sql("""SELECT citee FROM rnkCITATIONDICT
-                              WHERE citer IN (%s)""" % in_sql, limited_ahitset)
-            out = intbitset(rows)
+            out = get_citation_dict("citations_graph").get_refers_to(limited_ahitset)
     return out
 
 
@@ -353,18 +616,8 @@ def calculate_co_cited_with_list(record_id, sort_order="d"):
        that are co-cited with RECORD_ID.  The resulting recids is sorted by
        ascending/descending citation weights depending or SORT_ORDER.
     """
-    result = []
-    result_intermediate = {}
-
-    for cit_id in get_cited_by(record_id):
-        for ref_id in get_refers_to(cit_id):
-            if ref_id not in result_intermediate:
-                result_intermediate[ref_id] = 1
-            else:
-                result_intermediate[ref_id] += 1
-    for key, value in iteritems(result_intermediate):
-        if key != record_id:
-            result.append([key, value])
+    co_cited, counts = get_citation_dict("citations_graph").get_co_cited_with_counts(record_id)
+    result = [list(item) for item in zip(co_cited.tolist(), counts.tolist())]
     reverse = sort_order == "d"
     result.sort(key=itemgetter(1), reverse=reverse)
     return result
@@ -33,10 +33,15 @@ import time
 import re
 import sys
 try:
-    from numpy import array, ones, zeros, int32, float32, sqrt, dot
+    from numpy import array, ones, zeros, int32, float32, float64, sqrt, \
+        dot, argsort, bincount, concatenate, cumsum, fromiter, flatnonzero
     import_numpy = 1
 except ImportError:
     import_numpy = 0
+try:
+    from scipy.sparse import csr_matrix
+except ImportError:
+    csr_matrix = None
 
 if sys.hexversion < 0x2040000:
     # pylint: disable=W0622
@@ -336,19 +341,63 @@ def get_dates_from_db(dict_of_ids, publication_year_tag, creation_date_tag):
     return dates
 
 
+class SparseMatrix(object):
+    """Square sparse matrix in compressed sparse row (CSR) format.
+
+    The matrix is built from arrays of (row, column, value) coordinates,
+    without duplicates.  Products with vectors are computed by scipy.sparse
+    when it is installed and by numpy otherwise."""
+
+    def __init__(self, rows, columns, values, size):
+        order = argsort(rows, kind='mergesort')
+        self.size = size
+        self.rows = rows[order]
+        self.indices = columns[order]
+        self.data = values[order]
+        self.indptr = concatenate(([0], cumsum(bincount(self.rows,
+                                                        minlength=size))))
+        if csr_matrix is not None:
+            self.matrix = csr_matrix((self.data, self.indices, self.indptr),
+                                     shape=(size, size))
+        else:
+            self.matrix = None
+
+    def __len__(self):
+        """returns the number of non-zero elements"""
+        return len(self.data)
+
+    def dot(self, vector):
+        """returns the product of the matrix with the vector"""
+        if self.matrix is not None:
+            return self.matrix.dot(vector)
+        return bincount(self.rows, weights=self.data * vector[self.indices],
+                        minlength=self.size)
+
+
+def construct_citation_coordinates(cit, dict_of_ids, offset=0):
+    """returns the arrays of (cited, citing) indexes of the citation graph,
+    i.e. the coordinates of the non-zero elements of its matrix"""
+    rows = fromiter((dict_of_ids[item] + offset
+                     for item in cit for dummy in cit[item]), int32)
+    columns = fromiter((dict_of_ids[value] + offset
+                        for item in cit for value in cit[item]), int32)
+    return rows, columns
+
+
+def construct_date_coef_array(date_coef, len_):
+    """returns the time coeficients of the papers as an array"""
+    return fromiter((date_coef[j] for j in range(len_)), float64, len_)
+
+
 def construct_sparse_matrix(cit, ref, dict_of_ids, len_, damping_factor):
     """returns several structures needed in the calculation
     of the PAGERANK method using this structures, we don't need
     to keep the full matrix in the memory"""
-    sparse = {}
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item], dict_of_ids[value])] = \
-                    damping_factor * 1.0/ref[dict_of_ids[value]]
-    semi_sparse = []
-    for j in range(len_):
-        if ref[j] == 0:
-            semi_sparse.append(j)
+    ref = array(ref)
+    rows, columns = construct_citation_coordinates(cit, dict_of_ids)
+    sparse = SparseMatrix(rows, columns,
+                          damping_factor * 1.0 / ref[columns], len_)
+    semi_sparse = flatnonzero(ref[:len_] == 0)
     semi_sparse_coeficient = damping_factor/len_
     #zero_coeficient = (1-damping_factor)/len_
     write_message("Sparse information calculated", verbose=3)
@@ -360,37 +409,27 @@ def construct_sparse_matrix_ext(cit, ref, ext_links, dict_of_ids, alpha, beta):
     returns several structures needed in the calculation
     of the PAGERANK_EXT method"""
     len_ = len(dict_of_ids)
-    sparse = {}
-    semi_sparse = {}
-    sparse[0, 0] = 1.0 - alpha
-    for j in range(len_):
-        sparse[j+1, 0] = alpha/(len_)
-        if j not in ext_links:
-            sparse[0, j+1] = beta/(len_ + beta)
-        else:
-            if ext_links[j] == 0:
-                sparse[0, j+1] = beta/(len_ + beta)
-            else:
-                aux = beta * ext_links[j]
-                if ref[j] == 0:
-                    sparse[0, j+1] = aux/(aux + len_)
-                else:
-                    sparse[0, j+1] = aux/(aux + ref[j])
-        if ref[j] == 0:
-            semi_sparse[j+1] = (1.0 - sparse[0, j + 1])/len_
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item] + 1, dict_of_ids[value] + 1)] = \
-               (1.0 - sparse[0, dict_of_ids[value] + 1])/ref[dict_of_ids[value]]
-    #for i in range(len_ + 1):
-    #    a = ""
-    #    for j in range (len_ + 1):
-    #        if (i,j) in sparse:
-    #            a += str(sparse[(i,j)]) + "\t"
-    #        else:
-    #            a += "0\t"
-    #    print a
-    #print semi_sparse
+    ref = array(ref[:len_], float64)
+    # external links of each paper and the weight of the link from the
+    # paper to the "external" node 0:
+    ext = fromiter((ext_links.get(j, 0) for j in range(len_)), float64, len_)
+    aux = beta * ext
+    to_external = beta/(len_ + beta) + zeros(len_, float64)
+    with_ext = ext != 0
+    to_external[with_ext] = aux[with_ext] / \
+        (aux[with_ext] + ref[with_ext] + len_ * (ref[with_ext] == 0))
+    nodes = fromiter(range(1, len_ + 1), int32, len_)
+    rows, columns = construct_citation_coordinates(cit, dict_of_ids, 1)
+    rows = concatenate(([0], nodes, zeros(len_, int32), rows))
+    columns = concatenate(([0], zeros(len_, int32), nodes, columns))
+    values = concatenate(([1.0 - alpha], alpha/(len_) + zeros(len_, float64),
+                          to_external,
+                          (1.0 - to_external[columns[2 * len_ + 1:] - 1]) /
+                          ref[columns[2 * len_ + 1:] - 1]))
+    sparse = SparseMatrix(rows.astype(int32), columns.astype(int32), values,
+                          len_ + 1)
+    leaves_ = flatnonzero(ref == 0)
+    semi_sparse = (leaves_ + 1, (1.0 - to_external[leaves_])/len_)
     write_message("Sparse information calculated", verbose=3)
     return sparse, semi_sparse
 
@@ -401,15 +440,12 @@ def construct_sparse_matrix_time(cit, ref, dict_of_ids, \
     method using this structures,
     we don't need to keep the full matrix in the memory"""
     len_ = len(dict_of_ids)
-    sparse = {}
-    for item in cit:
-        for value in cit[item]:
-            sparse[(dict_of_ids[item], dict_of_ids[value])] = damping_factor * \
-                    date_coef[dict_of_ids[value]]/ref[dict_of_ids[value]]
-    semi_sparse = []
-    for j in range(len_):
-        if ref[j] == 0:
-            semi_sparse.append(j)
+    ref = array(ref)
+    date_coef = construct_date_coef_array(date_coef, len_)
+    rows, columns = construct_citation_coordinates(cit, dict_of_ids)
+    sparse = SparseMatrix(rows, columns, damping_factor * \
+                    date_coef[columns]/ref[columns], len_)
+    semi_sparse = flatnonzero(ref[:len_] == 0)
     semi_sparse_coeficient = damping_factor/len_
     #zero_coeficient = (1-damping_factor)/len_
     write_message("Sparse information calculated", verbose=3)
@@ -418,10 +454,7 @@ def construct_sparse_matrix_time(cit, ref, dict_of_ids, \
 
 def statistics_on_sparse(sparse):
     """returns the number of papers that cite themselves"""
-    count_diag = 0
-    for (i, j) in sparse.keys():
-        if i == j:
-            count_diag += 1
+    count_diag = int((sparse.rows == sparse.indices).sum())
     write_message("The number of papers that cite themselves: %s" % \
         str(count_diag), verbose=3)
     return count_diag
@@ -439,14 +472,10 @@ def pagerank(conv_threshold, check_point, len_, sparse, \
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            semi_total = 0.0
-            for j in semi_sparse:
-                semi_total += weights_old[j]
+            weights_new = sparse.dot(weights_old).astype(float32)
+            semi_total = weights_old[semi_sparse].sum(dtype=float64)
             weights_new = weights_new + semi_sparse_coef * semi_total + \
-                            (1.0/len_ - semi_sparse_coef) * sum(weights_old)
+                (1.0/len_ - semi_sparse_coef) * weights_old.sum(dtype=float64)
             if step == check_point - 1:
                 diff = weights_new - weights_old
                 difference = sqrt(dot(diff, diff))/len_
@@ -473,12 +502,8 @@ def pagerank_ext(conv_threshold, check_point, len_, sparse, semi_sparse):
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            total_sum = 0.0
-            for j in semi_sparse:
-                total_sum += semi_sparse[j]*weights_old[j]
+            weights_new = sparse.dot(weights_old).astype(float32)
+            total_sum = dot(semi_sparse[1], weights_old[semi_sparse[0]])
             weights_new[1:len_] = weights_new[1:len_] + total_sum
             if step == check_point - 1:
                 diff = weights_new - weights_old
@@ -502,23 +527,16 @@ def pagerank_time(conv_threshold, check_point, len_, \
     weights_old = array((), float32)
     weights_old = ones((len_), float32) # initial weights
     weights_new = array((), float32)
+    date_coef = construct_date_coef_array(date_coef, len_)
     converged = False
     nr_of_check_points = 0
     difference = len_
     while not converged:
         nr_of_check_points += 1
         for step in (range(check_point)):
-            weights_new = zeros((len_), float32)
-            for (i, j) in sparse.keys():
-                weights_new[i] += sparse[(i, j)]*weights_old[j]
-            semi_total = 0.0
-            for j in semi_sparse:
-                semi_total += weights_old[j]*date_coef[j]
-            zero_total = 0.0
-            for i in range(len_):
-                zero_total += weights_old[i]*date_coef[i]
-            #dates = array(date_coef.keys())
-            #zero_total = dot(weights_old, dates)
+            weights_new = sparse.dot(weights_old).astype(float32)
+            semi_total = dot(weights_old[semi_sparse], date_coef[semi_sparse])
+            zero_total = dot(weights_old, date_coef)
             weights_new = weights_new + semi_sparse_coeficient * semi_total + \
                     (1.0/len_ - semi_sparse_coeficient) * zero_total
             if step == check_point - 1:
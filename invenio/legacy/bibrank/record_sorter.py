@@ -26,6 +26,8 @@ import ConfigParser
 from operator import itemgetter
 from six import iteritems
 
+from numpy import argsort, fromiter, zeros
+
 from invenio.config import \
      CFG_SITE_LANG, \
      CFG_ETCDIR, \
@@ -42,6 +44,8 @@ from invenio.legacy.bibrank.citation_searcher import get_cited_by, \
                                                      get_cited_by_weight
 from intbitset import intbitset
 from invenio.legacy.bibrank.word_searcher import find_similar
+from invenio.legacy.miscutil.data_cacher import DataCacher, \
+    get_table_version
 # Do not remove these lines
 # it is necessary for func_object = globals().get(function)
 from invenio.legacy.bibrank.word_searcher import word_similarity
@@ -52,6 +56,67 @@ from invenio.modules.ranker.registry import configuration
 METHODS = {}
 
 
+class RankMethodDataCacher(DataCacher):
+    """Provides the relevance data of a rank method as a dense array of
+    rank values indexed by recID, together with the intbitset of ranked
+    recIDs.  The data is reloaded when the last_updated time of the rank
+    method changes.
+
+    This class is not to be used directly; use function
+    get_rank_method_data() instead.
+    """
+
+    def __init__(self, rank_method_code):
+        self.rank_method_code = rank_method_code
+
+        def cache_filler():
+            res = run_sql("""SELECT relevance_data FROM rnkMETHODDATA,rnkMETHOD
+                             WHERE rnkMETHOD.id=id_rnkMETHOD
+                             AND rnkMETHOD.name=%s""", (rank_method_code,))
+            if not res:
+                return None
+            rnkdict = deserialize_via_marshal(res[0][0])
+            recids = intbitset(rnkdict.keys())
+            # keep integer rank values as integers:
+            if all(isinstance(value, (int, long)) for value in rnkdict.itervalues()):
+                dtype = 'int64'
+            else:
+                dtype = 'float64'
+            values = zeros(recids and recids[-1] + 1 or 0, dtype)
+            values[fromiter(rnkdict.iterkeys(), 'int64', len(rnkdict))] = \
+                fromiter(rnkdict.itervalues(), dtype, len(rnkdict))
+            return {'recids': recids, 'values': values}
+
+        def timestamp_verifier():
+            # the update times of the tables are known without a query on
+            # every request, see get_table_version()
+            return max(get_table_version('rnkMETHOD'),
+                       get_table_version('rnkMETHODDATA'))
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+    @property
+    def name(self):
+        """Return name of the cache, including the rank method code."""
+        return '%s-%s' % (self.__class__.__name__, self.rank_method_code)
+
+rank_method_data_caches = {}
+
+
+def get_rank_method_data(rank_method_code):
+    """Returns the relevance data of the rank method, i.e. a dictionary
+    with the intbitset of ranked 'recids' and the array of rank 'values'
+    indexed by recID, or None if the method has no data."""
+    try:
+        cacher = rank_method_data_caches[rank_method_code]
+    except KeyError:
+        cacher = rank_method_data_caches[rank_method_code] = \
+            RankMethodDataCacher(rank_method_code)
+    else:
+        cacher.recreate_cache_if_needed()
+    return cacher.cache
+
+
 def compare_on_val(first, second):
     return cmp(second[1], first[1])
 
@@ -278,7 +343,14 @@ def rank_records(rank_method_code, rank_limit_relevance, hitset, related_to=[],
             result = find_similar(rank_method_code, related_to[0][6:], hitset, rank_limit_relevance, verbose, METHODS)
         elif func_object:
             if function == "word_similarity":
-                result = func_object(rank_method_code, related_to, hitset, rank_limit_relevance, verbose, METHODS)
+                if not rg:
+                    rg = CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS
+                if not jrec:
+                    jrec = 0
+                ranked_result_amount = rg + jrec
+                if verbose > 0:
+                    voutput += "Ranked result amount: %s<br/><br/>" % ranked_result_amount
+                result = func_object(rank_method_code, related_to, hitset, rank_limit_relevance, verbose, METHODS, ranked_result_amount)
             elif function in ("word_similarity_solr", "word_similarity_xapian"):
                 if not rg:
                     rg = CFG_WEBSEARCH_DEF_RECORDS_IN_GROUPS
@@ -373,9 +445,9 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance, verbo
     voutput - contains extra information, content dependent on verbose value"""
 
     voutput = ""
-    rnkdict = run_sql("SELECT relevance_data FROM rnkMETHODDATA,rnkMETHOD where rnkMETHOD.id=id_rnkMETHOD and rnkMETHOD.name=%s", (rank_method_code,))
+    rnkdata = get_rank_method_data(rank_method_code)
 
-    if not rnkdict:
+    if not rnkdata:
         return (None, "Warning: Could not load ranking data for method %s." % rank_method_code, "", voutput)
 
     max_recid = 0
@@ -400,37 +472,29 @@ def rank_by_method(rank_method_code, lwords, hitset, rank_limit_relevance, verbo
             else:
                 return (None, "Warning: Given record IDs are out of range.", "", voutput)
 
-    rnkdict = deserialize_via_marshal(rnkdict[0][0])
     if verbose > 0:
         voutput += "<br />Running rank method: %s, using rank_by_method function in bibrank_record_sorter<br />" % rank_method_code
-        voutput += "Ranking data loaded, size of structure: %s<br />" % len(rnkdict)
-    lrecIDs = list(hitset)
+        voutput += "Ranking data loaded, size of structure: %s<br />" % len(rnkdata['recids'])
+    hitset = intbitset(hitset)
+    if lwords_hitset:
+        hitset &= lwords_hitset
 
     if verbose > 0:
-        voutput += "Number of records to rank: %s<br />" % len(lrecIDs)
-    reclist = []
-    reclist_addend = []
-
-    if not lwords_hitset: #rank all docs, can this be speed up using something else than for loop?
-        for recID in lrecIDs:
-            if recID in rnkdict:
-                reclist.append((recID, rnkdict[recID]))
-                del rnkdict[recID]
-            else:
-                reclist_addend.append((recID, 0))
-    else: #rank docs in hitset, can this be speed up using something else than for loop?
-        for recID in lwords_hitset:
-            if recID in rnkdict and recID in hitset:
-                reclist.append((recID, rnkdict[recID]))
-                del rnkdict[recID]
-            elif recID in hitset:
-                reclist_addend.append((recID, 0))
+        voutput += "Number of records to rank: %s<br />" % len(hitset)
+    ranked = hitset & rnkdata['recids']
+    reclist_addend = [(recID, 0) for recID in hitset - ranked]
+
+    # gather the rank values of the hits and sort them, keeping the
+    # records with equal values in ascending recID order:
+    recIDs = fromiter(ranked, 'int64', len(ranked))
+    values = rnkdata['values'][recIDs]
+    order = argsort(values, kind='mergesort')
+    reclist = zip(recIDs[order].tolist(), values[order].tolist())
 
     if verbose > 0:
         voutput += "Number of records ranked: %s<br />" % len(reclist)
         voutput += "Number of records not ranked: %s<br />" % len(reclist_addend)
 
-    reclist.sort(lambda x, y: cmp(x[1], y[1]))
     return (reclist_addend + reclist, METHODS[rank_method_code]["prefix"], METHODS[rank_method_code]["postfix"], voutput)
 
 
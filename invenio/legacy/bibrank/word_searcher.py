@@ -21,12 +21,23 @@ import time
 import math
 import re
 
+from collections import OrderedDict
 from operator import itemgetter
+from threading import Lock
 from six import iteritems
 
+from intbitset import intbitset
+from numpy import argpartition, argsort, bincount, concatenate, fromiter, \
+    log, searchsorted, unique, zeros
+
+from invenio.base.globals import cfg
 from invenio.legacy.dbquery import run_sql, deserialize_via_marshal
 from invenio.legacy.bibindex.engine_stemmer import stem
 from invenio.legacy.bibindex.engine_stopwords import is_stopword
+from invenio.legacy.miscutil.data_cacher import get_table_version
+
+posting_cache = OrderedDict()
+posting_cache_lock = Lock()
 
 
 def find_similar(rank_method_code, recID, hitset, rank_limit_relevance,verbose, methods):
@@ -170,7 +181,51 @@ def sort_record_relevance_findsimilar(recdict, rec_termcount, hitset, rank_limit
         voutput += "Sort time: %s<br />" % (str(time.time() - startCreate))
     return (reclist, hitset)
 
-def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods):
+def create_term_posting(invidx):
+    """Returns the compact posting of a term, see get_term_posting().
+    invidx - {recid: tf, Gi: norm value} as stored in the rnkWORD tables"""
+    if "Gi" not in invidx: #bibrank should be run with -R
+        return None
+    recids = intbitset([j for j in invidx if j != "Gi"])
+    return {'Gi': invidx["Gi"][1],
+            'recids': recids,
+            'recids_array': fromiter(recids, 'int64', len(recids)),
+            'tf0': fromiter((invidx[j][0] for j in recids), 'float64', len(recids)),
+            'tf1': fromiter((invidx[j][1] for j in recids), 'float64', len(recids))}
+
+def get_term_posting(table, term):
+    """Returns the posting of a term of a rnkWORD table in compact form.
+    The postings of the most recently queried terms are kept in memory
+    until the table changes.
+    output:
+    None if the term is not indexed, otherwise a dictionary with:
+    Gi - the norm value of the term
+    recids - the intbitset of records using the term
+    recids_array, tf0, tf1 - arrays of these recIDs and of the two term
+                             frequency factors of each record"""
+    version = get_table_version(table)
+    key = (table, term)
+    with posting_cache_lock:
+        if key in posting_cache:
+            posting_version, posting = posting_cache.pop(key)
+            if posting_version >= version:
+                posting_cache[key] = (posting_version, posting)
+                return posting
+
+    res = run_sql("""SELECT hitlist FROM %s WHERE term=%%s""" % table, (term,))
+    posting = None
+    if res:
+        posting = create_term_posting(deserialize_via_marshal(res[0][0]))
+
+    cache_size = cfg.get('CFG_BIBRANK_WORD_POSTING_CACHE_SIZE', 0)
+    if cache_size > 0:
+        with posting_cache_lock:
+            posting_cache[key] = (version, posting)
+            while len(posting_cache) > cache_size:
+                posting_cache.popitem(last=False)
+    return posting
+
+def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verbose, methods, ranked_result_amount=None):
     """Ranking a records containing specified words and returns a sorted list.
     input:
     rank_method_code - the code of the method, from the name field in rnkMETHOD
@@ -178,6 +233,8 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
     hitset - a list of hits for the query found by search_engine
     rank_limit_relevance - show only records with a rank value above this
     verbose - verbose value
+    ranked_result_amount - if given, only this amount of best records are
+                           ranked, the others are added as not ranked
     output:
     reclist - a list of sorted records: [[23,34], [344,24], [1,01]]
     prefix - what to show before the rank value
@@ -203,20 +260,24 @@ def word_similarity(rank_method_code, lwords, hitset, rank_limit_relevance, verb
                 if lwords_old[i] != term: #add if stemmed word is different than original word
                     lwords.append((term, methods[rank_method_code]["rnkWORD_table"]))
 
-    (recdict, rec_termcount, lrecIDs_remove) = ({}, {}, {})
-    #For each term, if accepted, get a list of the records using the term
-    #calculate then relevance for each term before sorting the list of records
+    (term_recids, term_values) = ([], [])
+    #For each term, if accepted, get the records of the hitset using the term
+    #and calculate their relevance for the term
     for (term, table) in lwords:
-        term_recs = run_sql("""SELECT term, hitlist FROM %s WHERE term=%%s""" % methods[rank_method_code]["rnkWORD_table"], (term,))
-        if term_recs: #if term exists in database, use for ranking
-            term_recs = deserialize_via_marshal(term_recs[0][1])
-            (recdict, rec_termcount) = calculate_record_relevance((term, int(term_recs["Gi"][1])) , term_recs, hitset, recdict, rec_termcount, verbose, quick=None)
-            del term_recs
+        posting = get_term_posting(methods[rank_method_code]["rnkWORD_table"], term)
+        if posting: #if term exists in database, use for ranking
+            (recids, values) = calculate_record_relevance_from_posting(posting, int(posting["Gi"]), hitset)
+            term_recids.append(recids)
+            term_values.append(values)
 
-    if len(recdict) == 0 or (len(lwords) == 1 and lwords[0] == ""):
+    if not term_recids or (len(lwords) == 1 and lwords[0] == ""):
         return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
-    else: #sort if we got something to sort
-        (reclist, hitset) = sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose)
+    #sum up the relevance of the records for all terms
+    (recids, positions) = unique(concatenate(term_recids), return_inverse=True)
+    if len(recids) == 0:
+        return (None, "Records not ranked. The query is not detailed enough, or not enough records found, for ranking to be possible.", "", voutput)
+    values = bincount(positions, weights=concatenate(term_values)).astype('int64')
+    (reclist, hitset) = sort_record_relevance_top(recids, values, hitset, rank_limit_relevance, ranked_result_amount, verbose)
 
     #Add any documents not ranked to the end of the list
     if hitset:
@@ -269,6 +330,59 @@ def calculate_record_relevance(term, invidx, hitset, recdict, rec_termcount, ver
 
     return (recdict, rec_termcount)
 
+def calculate_record_relevance_from_posting(posting, qtf, hitset):
+    """Calculating the relevance of the records of the hitset for one term,
+    like calculate_record_relevance() does, but on a compact posting.
+    posting - the posting of the term, see get_term_posting()
+    qtf - the query term factor
+    hitset - a hitset with records that are allowed to be ranked
+    output:
+    the arrays of recIDs using the term and of their relevance"""
+    hits = posting["recids"] & hitset
+    positions = searchsorted(posting["recids_array"], fromiter(hits, 'int64', len(hits)))
+    values = ((posting["tf0"][positions] * posting["Gi"]) * posting["tf1"][positions]) * qtf
+    #skip records whose relevance can not be calculated
+    valid = values > 0
+    return (posting["recids_array"][positions][valid], log(values[valid]).astype('int64'))
+
+def sort_record_relevance_top(recids, values, hitset, rank_limit_relevance, ranked_result_amount, verbose):
+    """Returns the best records with a relevance higher than the given value,
+    like sort_record_relevance() does, but on arrays and by a partial sort.
+    recids, values - arrays of the ranked records and of their relevance
+    rank_limit_relevance - a value > 0 usually
+    ranked_result_amount - amount of best records to return, all if None
+    verbose - verbose value
+    output:
+    reclist - the best records sorted by ascending relevance and recID
+    hitset - the records of the hitset not in reclist, except the ones
+             with a relevance below the limit"""
+    #gives each record a score between 0-100
+    divideby = values.max() if len(values) else 0
+    if divideby > 0:
+        scores = values * 100 // divideby
+    else:
+        # no record has any relevance
+        scores = zeros(len(values), dtype='int64')
+    ranked = scores >= rank_limit_relevance
+    below_limit = recids[~ranked]
+    (recids, scores) = (recids[ranked], scores[ranked])
+
+    #sort scores, or only the best ones
+    keys = scores * (int(recids[-1]) + 1 if len(recids) else 1) + recids
+    if ranked_result_amount is not None and ranked_result_amount < len(keys):
+        best = argpartition(keys, len(keys) - ranked_result_amount)[len(keys) - ranked_result_amount:]
+    else:
+        best = slice(None)
+    order = argsort(keys[best])
+    best_recids = recids[best][order]
+    reclist = zip(best_recids.tolist(), scores[best][order].tolist())
+
+    #remove ranked documents so that unranked can be added to the end
+    hitset = intbitset(hitset)
+    hitset -= intbitset(below_limit.tolist())
+    hitset -= intbitset(best_recids.tolist())
+    return (reclist, hitset)
+
 def sort_record_relevance(recdict, rec_termcount, hitset, rank_limit_relevance, verbose):
     """Sorts the dictionary and returns records with a relevance higher than the given value.
     recdict - {recid: value} unsorted
@@ -104,7 +104,7 @@ from invenio.base.wrappers import lazy_import
 from invenio.legacy.bibrecord.bibrecord_config import CFG_MARC21_DTD, \
     CFG_BIBRECORD_WARNING_MSGS, CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL, \
     CFG_BIBRECORD_DEFAULT_CORRECT, CFG_BIBRECORD_PARSERS_AVAILABLE, \
-    InvenioBibRecordParserError, InvenioBibRecordFieldError
+    CFG_BIBRECORD_READ_CHUNK_SIZE, InvenioBibRecordParserError, InvenioBibRecordFieldError
 from invenio.utils.text import encode_for_xml
 
 run_sql = lazy_import("invenio.legacy.dbquery.run_sql")
@@ -170,6 +170,33 @@ def create_records(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
             for record_xml in record_xmls]
 
 
+def iter_records(fileobj, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
+                 correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
+                 keep_singletons=CFG_BIBRECORD_KEEP_SINGLETONS,
+                 chunk_size=CFG_BIBRECORD_READ_CHUNK_SIZE):
+    """
+    Iterate over the records of a MARCXML file without reading it whole.
+
+    The file is read chunk by chunk and every record is created as soon as
+    it has been read, so that the memory used does not depend on the size of
+    the file.
+
+    :param fileobj: a file-like object to read the MARCXML from
+    :returns: an iterator over the same tuples as create_records() returns
+    """
+    for record_xml in _iter_record_xmls(fileobj, chunk_size):
+        yield create_record(record_xml, verbose=verbose, correct=correct,
+                            parser=parser, keep_singletons=keep_singletons)
+
+
+def count_records(fileobj, chunk_size=CFG_BIBRECORD_READ_CHUNK_SIZE):
+    """Return the number of records of a MARCXML file, see iter_records()."""
+    count = 0
+    for dummy in _iter_record_xmls(fileobj, chunk_size):
+        count += 1
+    return count
+
+
 def create_record(marcxml, verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
                   correct=CFG_BIBRECORD_DEFAULT_CORRECT, parser='',
                   sort_fields_by_indicators=False,
@@ -1736,6 +1763,59 @@ def get_fieldvalues(recIDs, tag, repetitive_values=True, sort=True,
     return out
 
 
+def get_fieldvalues_of_records(recIDs, tags, chunk_size=1000):
+    """
+    Return field values of TAGS for all the given records.
+
+    The values are fetched with one query per chunk of CHUNK_SIZE records
+    and per bibXXx table, so that tags stored in the same table are
+    fetched together.  The values of each record come in the same order
+    as get_fieldvalues() returns them.
+
+    @return: {tag: {recID: [values]}}
+    """
+    recIDs = list(recIDs)
+    out = dict((tag, {}) for tag in tags)
+    tags_by_table = {}
+    for tag in out:
+        if tag == "001___":
+            # We have asked for tag 001 (=recID) that is not stored in
+            # bibXXx tables.
+            out[tag] = dict((recID, [str(recID)]) for recID in recIDs)
+            continue
+        try:
+            intdigits = int(tag[0:2])
+            if intdigits < 0 or intdigits > 99:
+                raise ValueError
+        except ValueError:
+            # invalid tag value asked for
+            continue
+        tags_by_table.setdefault(tag[0:2], []).append(tag)
+
+    for digits, table_tags in tags_by_table.iteritems():
+        bx = "bib%sx" % digits
+        bibx = "bibrec_bib%sx" % digits
+        # tags are SQL LIKE patterns, match them the same way in Python
+        # in order to dispatch the values
+        tag_res = [(tag, re.compile(''.join(
+            char == '_' and '.' or char == '%' and '.*' or re.escape(char)
+            for char in tag) + '$', re.S | re.I)) for tag in table_tags]
+        tag_sql = " OR ".join(["bx.tag LIKE %s"] * len(table_tags))
+        for i in range(0, len(recIDs), chunk_size):
+            chunk = recIDs[i:i + chunk_size]
+            query = "SELECT bibx.id_bibrec, bx.tag, bx.value " \
+                    "FROM %s AS bx, %s AS bibx " \
+                    "WHERE bibx.id_bibrec IN (%s) AND bx.id=bibx.id_bibxxx " \
+                    "AND (%s) ORDER BY bibx.field_number, bx.tag ASC" % \
+                    (bx, bibx, ("%s," * len(chunk))[:-1], tag_sql)
+            for recID, field_tag, value in run_sql(query, tuple(chunk) +
+                                                   tuple(table_tags)):
+                for tag, tag_re in tag_res:
+                    if tag_re.match(field_tag):
+                        out[tag].setdefault(recID, []).append(value)
+    return out
+
+
 def get_fieldvalues_alephseq_like(recID, tags_in, can_see_hidden=False):
     """
     Return buffer of ALEPH sequential-like textual format.
@@ -1880,6 +1960,43 @@ def _select_parser(parser=None):
         return parser
 
 
+def _iter_record_xmls(fileobj, chunk_size=CFG_BIBRECORD_READ_CHUNK_SIZE):
+    """
+    Yield the record XML strings of a file as create_records() finds them.
+
+    Only the part of the file after the last complete record is kept in
+    memory between two chunks.
+    """
+    # Use the DOTALL flag to include newlines.
+    regex = re.compile('<record.*?>.*?</record>', re.DOTALL)
+    buf = ''
+    eof = False
+    while not eof:
+        chunk = fileobj.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+        pos = 0
+        while True:
+            start = buf.find('<record', pos)
+            if start == -1:
+                pos = max(pos, len(buf) - len('<record'))
+                break
+            # only try to match records whose end has already been read, so
+            # that incomplete records are not scanned over and over again
+            match = None
+            if buf.find('</record>', start) != -1:
+                match = regex.match(buf, start)
+            if match is not None:
+                yield match.group()
+                pos = match.end()
+            elif eof:
+                pos = start + 1
+            else:
+                pos = start
+                break
+        buf = buf[pos:]
+
+
 def _create_record_lxml(marcxml,
                         verbose=CFG_BIBRECORD_DEFAULT_VERBOSE_LEVEL,
                         correct=CFG_BIBRECORD_DEFAULT_CORRECT,
@@ -57,6 +57,9 @@ CFG_BIBRECORD_DEFAULT_CORRECT = 0
 CFG_BIBRECORD_PARSERS_AVAILABLE = ['lxml', 'pyrxp']
 """XML parsers available:"""
 
+CFG_BIBRECORD_READ_CHUNK_SIZE = 1024 * 1024
+"""number of bytes read at once when iterating over the records of a file"""
+
 
 class InvenioBibRecordParserError(Exception):
 
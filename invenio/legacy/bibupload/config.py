@@ -34,5 +34,19 @@ CFG_BIBUPLOAD_DELETE_CODE = '0'
 
 CFG_BIBUPLOAD_DELETE_VALUE = "__DELETE_FIELDS__"
 
+CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY = 500
+
+# number of seconds to wait for the lock serializing the creation of new
+# bibxxx values by concurrent uploads
+CFG_BIBUPLOAD_BIBXXX_LOCK_TIMEOUT = 60
+
+# number of processes uploading records in parallel (the --workers option
+# of bibupload overrides it; 1 means the records are uploaded by the
+# bibupload process itself)
+CFG_BIBUPLOAD_WORKERS = 1
+
+# number of records handed over to every worker at a time
+CFG_BIBUPLOAD_RECORDS_PER_WORKER = 10
+
 CFG_BIBUPLOAD_OPT_MODES = ['insert', 'replace', 'replace_or_insert', 'reference',
         'correct', 'append', 'holdingpen', 'delete']
@@ -26,8 +26,10 @@ tables according to options.
 
 __revision__ = "$Id$"
 
+import multiprocessing
 import os
 import re
+import signal
 import sys
 import time
 from datetime import datetime
@@ -56,16 +58,22 @@ from invenio.config import CFG_OAI_ID_FIELD, \
      CFG_BIBUPLOAD_DISABLE_RECORD_REVISIONS, \
      CFG_BIBUPLOAD_CONFLICTING_REVISION_TICKET_QUEUE, \
      CFG_CERN_SITE, \
-     CFG_BIBUPLOAD_MATCH_DELETED_RECORDS
+     CFG_BIBUPLOAD_MATCH_DELETED_RECORDS, \
+     CFG_DATABASE_NAME
 
 from invenio.utils.json import json, CFG_JSON_AVAILABLE
 from invenio.legacy.bibupload.config import CFG_BIBUPLOAD_CONTROLFIELD_TAGS, \
     CFG_BIBUPLOAD_SPECIAL_TAGS, \
     CFG_BIBUPLOAD_DELETE_CODE, \
     CFG_BIBUPLOAD_DELETE_VALUE, \
-    CFG_BIBUPLOAD_OPT_MODES
+    CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY, \
+    CFG_BIBUPLOAD_BIBXXX_LOCK_TIMEOUT, \
+    CFG_BIBUPLOAD_OPT_MODES, \
+    CFG_BIBUPLOAD_RECORDS_PER_WORKER, \
+    CFG_BIBUPLOAD_WORKERS
 from invenio.legacy.dbquery import run_sql
 from invenio.legacy.bibrecord import create_records, \
+                              iter_records, \
                               record_add_field, \
                               record_delete_field, \
                               record_xml_output, \
@@ -117,6 +125,9 @@ stat['nb_records_inserted'] = 0
 stat['nb_errors'] = 0
 stat['nb_holdingpen'] = 0
 stat['exectime'] = time.localtime()
+# the statistics a worker process sends back for each record it uploads
+STAT_COUNTERS = ('nb_records_updated', 'nb_records_inserted', 'nb_errors',
+                 'nb_holdingpen')
 
 _WRITING_RIGHTS = None
 
@@ -828,11 +839,13 @@ def print_out_bibupload_statistics():
               'nb_sec': time.time() - time.mktime(stat['exectime']) }
     write_message(out)
 
-def open_marc_file(path):
-    """Open a file and return the data"""
+def open_marc_file(path, stream=False):
+    """Open a file and return the data, or the open file if stream is set"""
     try:
         # open the file containing the marc document
         marc_file = open(path, 'r')
+        if stream:
+            return marc_file
         marc = marc_file.read()
         marc_file.close()
     except IOError as erro:
@@ -862,6 +875,40 @@ def xml_marc_to_records(xml_marc):
         recs = map((lambda x:x[0]), recs)
         return recs
 
+def xml_marc_file_to_records(path):
+    """create the records of a MARCXML file one at a time
+
+    Return an iterator over the records, so that the file never has to be
+    held in memory as a whole.
+    """
+    marc_file = open_marc_file(path, stream=True)
+    recs = iter_records(marc_file, 1, 1)
+    first = next(recs, None)
+    if first is None or first[0] is None:
+        marc_file.close()
+        if first is None:
+            msg = "ERROR: Cannot parse MARCXML file."
+            write_message(msg, verbose=1, stream=sys.stderr)
+            raise StandardError(msg)
+        msg = "ERROR: MARCXML file has wrong format: %s" % (first, )
+        write_message(msg, verbose=1, stream=sys.stderr)
+        raise RecoverableError(msg)
+
+    def _records():
+        try:
+            yield first[0]
+            for rec in recs:
+                yield rec[0]
+        finally:
+            marc_file.close()
+    return _records()
+
+def count_records_to_upload(records):
+    """Count the RECORDS in the statistics as they are read."""
+    for record in records:
+        stat['nb_records_to_upload'] += 1
+        yield record
+
 def find_record_format(rec_id, bibformat):
     """Look whether record REC_ID is formatted in FORMAT,
        i.e. whether FORMAT exists in the bibfmt table for this record.
@@ -1361,6 +1408,83 @@ def insert_record_bibrec_bibxxx(table_name, id_bibxxx,
         return 1
     return res
 
+def get_bibxxx_ids(table_name, pairs):
+    """Return a dictionary (tag, value) -> id of the given pairs found in
+    the bibxxx table table_name.
+
+    Like in insert_record_bibxxx(), the values are compared in Python for
+    string binary equality.
+    """
+    ids = {}
+    for i in range(0, len(pairs), CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY):
+        chunk = pairs[i:i + CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY]
+        tags = list(set([tag for tag, dummy in chunk]))
+        values = list(set([value for dummy, value in chunk]))
+        query = """SELECT id,tag,value FROM %s """ % table_name
+        query += """ WHERE tag IN (%s) AND value IN (%s)""" % (
+            ', '.join(['%s'] * len(tags)), ', '.join(['%s'] * len(values)))
+        for row_id, row_tag, row_value in run_sql(query, tags + values):
+            ids.setdefault((row_tag, row_value), row_id)
+    return ids
+
+def insert_record_bibxxx_rows(rows, id_bibrec, pretend=False):
+    """Insert the (tag, value, field_number) rows of a record into the
+    bibxxx and bibrec_bibxxx tables.
+
+    This does the same as calling insert_record_bibxxx() and
+    insert_record_bibrec_bibxxx() for every row, but with a few queries
+    per bibxxx table instead of two or three per row.
+    """
+    tables = {}
+    for tag, value, field_number in rows:
+        tables.setdefault('bib' + tag[0:2] + 'x', []).append(
+            (tag, value, field_number))
+
+    for table_name, table_rows in tables.items():
+        pairs = list(set([(tag, value) for tag, value, dummy in table_rows]))
+        ids = get_bibxxx_ids(table_name, pairs)
+        missing = [pair for pair in pairs if pair not in ids]
+        if missing and pretend:
+            ids.update(dict.fromkeys(missing, 1))
+        elif missing:
+            # bibxxx has no unique key, so concurrent uploads (e.g. the
+            # bibupload workers) create new values one at a time, looking
+            # them up again once they hold the lock
+            lock_name = "%s.%s" % (CFG_DATABASE_NAME, table_name)
+            if not run_sql("SELECT GET_LOCK(%s, %s)",
+                           (lock_name, CFG_BIBUPLOAD_BIBXXX_LOCK_TIMEOUT))[0][0]:
+                raise StandardError("Cannot lock %s to insert new values" % \
+                                    table_name)
+            try:
+                ids.update(get_bibxxx_ids(table_name, missing))
+                missing = [pair for pair in missing if pair not in ids]
+                for i in range(0, len(missing), CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY):
+                    chunk = missing[i:i + CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY]
+                    query = """INSERT INTO %s (tag, value) VALUES """ % table_name
+                    query += ', '.join(['(%s, %s)'] * len(chunk))
+                    run_sql(query, [param for pair in chunk for param in pair])
+                # the ids of a multi-row INSERT are consecutive only with
+                # some table engines and settings, so read them back
+                ids.update(get_bibxxx_ids(table_name, missing))
+            finally:
+                run_sql("SELECT RELEASE_LOCK(%s)", (lock_name, ))
+
+        links = []
+        for tag, value, field_number in table_rows:
+            if ids.get((tag, value)) is None:
+                write_message("   Failed: during insert_record_bibxxx", verbose=1, stream=sys.stderr)
+            else:
+                links.append((id_bibrec, ids[(tag, value)], field_number))
+        if pretend:
+            continue
+        for i in range(0, len(links), CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY):
+            chunk = links[i:i + CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY]
+            query = """INSERT INTO bibrec_%s """ % table_name
+            query += """(id_bibrec,id_bibxxx, field_number) VALUES """
+            query += ', '.join(['(%s, %s, %s)'] * len(chunk))
+            if run_sql(query, [param for link in chunk for param in link]) is None:
+                write_message("   Failed: during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+
 def synchronize_8564(rec_id, record, record_had_FFT, bibrecdocs, pretend=False):
     """
     Synchronize 8564_ tags and BibDocFile tables.
@@ -2418,6 +2542,9 @@ def update_database_with_metadata(record, rec_id, oai_rec_id="oai", affected_tag
     else:
         tmp_record = record
 
+    # the (tag, value, field_number) rows to insert, all at once, into the
+    # bibxxx and bibrec_bibxxx tables
+    bibxxx_rows = []
     for tag in tmp_record.keys():
         # check if tag is not a special one:
         if tag not in CFG_BIBUPLOAD_SPECIAL_TAGS:
@@ -2452,15 +2579,7 @@ def update_database_with_metadata(record, rec_id, oai_rec_id="oai", affected_tag
 
                     # update the tables
                     write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                    # insert the tag and value into into bibxxx
-                    (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                    #print 'tname, bibrow', table_name, bibxxx_row_id;
-                    if table_name is None or bibxxx_row_id is None:
-                        write_message("   Failed: during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                    # connect bibxxx and bibrec with the table bibrec_bibxxx
-                    res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                    if res is None:
-                        write_message("   Failed: during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+                    bibxxx_rows.append((full_tag, value, datafield_number))
                 else:
                     # get the tag and value from the content of each subfield
                     for subfield in set(subfield_list):
@@ -2471,19 +2590,13 @@ def update_database_with_metadata(record, rec_id, oai_rec_id="oai", affected_tag
                         full_tag = ''.join(tag_list)
                         # update the tables
                         write_message("   insertion of the tag "+full_tag+" with the value "+value, verbose=9)
-                        # insert the tag and value into into bibxxx
-                        (table_name, bibxxx_row_id) = insert_record_bibxxx(full_tag, value, pretend=pretend)
-                        if table_name is None or bibxxx_row_id is None:
-                            write_message("   Failed: during insert_record_bibxxx", verbose=1, stream=sys.stderr)
-                        # connect bibxxx and bibrec with the table bibrec_bibxxx
-                        res = insert_record_bibrec_bibxxx(table_name, bibxxx_row_id, datafield_number, rec_id, pretend=pretend)
-                        if res is None:
-                            write_message("   Failed: during insert_record_bibrec_bibxxx", verbose=1, stream=sys.stderr)
+                        bibxxx_rows.append((full_tag, value, datafield_number))
                         # remove the subtag from the list
                         tag_list.pop()
                 tag_list.pop()
                 tag_list.pop()
             tag_list.pop()
+    insert_record_bibxxx_rows(bibxxx_rows, rec_id, pretend=pretend)
     write_message("   -Update the database with metadata: DONE", verbose=2)
 
     log_record_uploading(oai_rec_id, task_get_task_param('task_id', 0), rec_id, 'P', pretend=pretend)
@@ -2687,10 +2800,11 @@ Examples:
   --callback-url\tSend via a POST request a JSON-serialized answer (see admin guide), in
 \t\t\torder to provide a feedback to an external service about the outcome of the operation.
   --nonce\t\twhen used together with --callback add the nonce value in the JSON message.
+  --workers=NNN\t\tupload records in NNN parallel processes (%d)
   --special-treatment=MODE\tif "oracle" is specified, when used together with --callback_url,
 \t\t\tPOST an application/x-www-form-urlencoded request where the JSON message is encoded
 \t\t\tinside a form field called "results".
-""",
+""" % CFG_BIBUPLOAD_WORKERS,
             version=__revision__,
             specific_params=("ircazdnoS:",
                  [
@@ -2708,6 +2822,7 @@ Examples:
                    "nonce=",
                    "special-treatment=",
                    "stage=",
+                   "workers=",
                  ]),
             task_submit_elaborate_specific_parameter_fnc=task_submit_elaborate_specific_parameter,
             task_run_fnc=task_run_core,
@@ -2798,6 +2913,10 @@ def task_submit_elaborate_specific_parameter(key, value, opts, args): # pylint:
         else:
             print("""The specified value is not in the list of allowed special treatments codes: %s""" % CFG_BIBUPLOAD_ALLOWED_SPECIAL_TREATMENTS, file=sys.stderr)
             return False
+    elif key in ("--workers", ):
+        task_set_option('workers', int(value))
+        if task_get_option('workers') < 1:
+            raise StandardError("Number of workers should be at least 1")
     elif key in ("-S", "--stage"):
         print("""WARNING: the --stage parameter is deprecated and ignored.""", file=sys.stderr)
     else:
@@ -2887,10 +3006,84 @@ def post_results_to_callback_url(results, callback_url):
     write_message("Returned message is: %s" % msg, verbose=9)
     return res
 
+def record_uses_temporary_identifiers(record):
+    """Tell whether the record declares temporary identifiers (in the $i
+    and $v subfields of FFT fields) or uses them (in BDR and BDM fields),
+    which ties it to the other records of the same upload."""
+    if record_has_field(record, 'BDR') or record_has_field(record, 'BDM'):
+        return True
+    for fft in record_get_field_instances(record, 'FFT', '%', '%'):
+        for code in ('i', 'v'):
+            for value in field_get_subfield_values(fft, code):
+                if parse_identifier(value)[0]:
+                    return True
+    return False
+
+def get_record_identifiers(record):
+    """Return the set of identifiers (001, OAI id, SYSNO and DOIs) by which
+    bibupload may match the record with an existing one."""
+    identifiers = set([('001', value) for value in
+                       record_get_field_values(record, '001')])
+    oai_rec_id = record_extract_oai_id(record)
+    if oai_rec_id:
+        identifiers.add(('oai', oai_rec_id))
+    sysnos = record_get_field_values(record,
+        CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[0:3],
+        CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[3:4] != "_" and \
+        CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[3:4] or "",
+        CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[4:5] != "_" and \
+        CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[4:5] or "",
+        CFG_BIBUPLOAD_EXTERNAL_SYSNO_TAG[5:6])
+    identifiers.update([('sysno', sysno) for sysno in sysnos])
+    identifiers.update([('doi', doi) for doi in record_extract_dois(record)])
+    return identifiers
+
+def _close_sqlalchemy_connections():
+    """Releases the SQLAlchemy session and pooled connections of this
+    process, so that no MySQL connection is shared across a fork.  The
+    connections of run_sql() are already opened per process."""
+    from invenio.ext.sqlalchemy import db
+    db.session.remove()
+    db.engine.dispose()
+
+def _init_bibupload_worker():
+    """Initializes a worker process of the parallel upload: closes the
+    inherited SQLAlchemy connections, used e.g. by the record signal
+    handlers, and restores the default signal handlers, so that the
+    bibsched handlers of the parent do not run in the workers."""
+    _close_sqlalchemy_connections()
+    for signum in (signal.SIGTERM, signal.SIGQUIT, signal.SIGABRT,
+                   signal.SIGUSR2, signal.SIGTSTP):
+        signal.signal(signum, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _bibupload_record_in_worker(args):
+    """Uploads one record in a worker process.
+
+    Returns the (error_code, recid, message) tuple of bibupload() and the
+    statistics the record added, to be summed up by the parent process.
+    """
+    record, opt_mode, opt_notimechange, pretend = args
+    for key in STAT_COUNTERS:
+        stat[key] = 0
+    error = bibupload(record,
+                      opt_mode=opt_mode,
+                      opt_notimechange=opt_notimechange,
+                      oai_rec_id=record_extract_oai_id(record),
+                      pretend=pretend)
+    return error, dict([(key, stat[key]) for key in STAT_COUNTERS])
+
 def bibupload_records(records, opt_mode=None, opt_notimechange=0,
-                      pretend=False, callback_url=None, results_for_callback=None):
+                      pretend=False, callback_url=None, results_for_callback=None,
+                      workers=1):
     """perform the task of uploading a set of records
     returns list of (error_code, recid) tuples for separate records
+
+    With more than one worker, the records that do not use temporary
+    identifiers are uploaded by a pool of WORKERS processes, each record
+    on its own.  Records sharing an identifier (001, OAI id, SYSNO, DOI)
+    are never uploaded at the same time, and the records with temporary
+    identifiers are uploaded in order by this process, in two phases.
     """
     #Dictionaries maintaining temporary identifiers
     # Structure: identifier -> number
@@ -2905,63 +3098,116 @@ def bibupload_records(records, opt_mode=None, opt_notimechange=0,
         ## NOTE: reference mode has been deprecated in favour of 'correct'
         opt_mode = 'correct'
 
-    record = None
-    for record in records:
-        record_id = record_extract_oai_id(record)
-        task_sleep_now_if_required(can_stop_too=True)
-        if opt_mode == "holdingpen":
-                    #inserting into the holding pen
-            write_message("Inserting into holding pen", verbose=3)
-            insert_record_into_holding_pen(record, record_id, pretend=pretend)
+    def _record_uploaded(record, error):
+        results.append(error)
+        if error[0] == 1:
+            if record:
+                write_message(lambda: record_xml_output(record),
+                              stream=sys.stderr)
+            else:
+                write_message("Record could not have been parsed",
+                              stream=sys.stderr)
+            stat['nb_errors'] += 1
+            if callback_url:
+                results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
+        elif error[0] == 2:
+            if record:
+                write_message(lambda: record_xml_output(record),
+                              stream=sys.stderr)
+            else:
+                write_message("Record could not have been parsed",
+                              stream=sys.stderr)
+            if callback_url:
+                results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
+        elif error[0] == 0:
+            if callback_url:
+                from invenio.legacy.search_engine import print_record
+                results_for_callback['results'].append({'recid': error[1], 'success': True, "marcxml": print_record(error[1], 'xm'), 'url': "%s/%s/%s" % (CFG_SITE_URL, CFG_SITE_RECORD, error[1])})
         else:
-            write_message("Inserting into main database", verbose=3)
-            error = bibupload(
-                record,
-                opt_mode = opt_mode,
-                opt_notimechange = opt_notimechange,
-                oai_rec_id = record_id,
-                pretend = pretend,
-                tmp_ids = tmp_ids,
-                tmp_vers = tmp_vers)
-            results.append(error)
-            if error[0] == 1:
-                if record:
-                    write_message(lambda: record_xml_output(record),
-                                  stream=sys.stderr)
-                else:
-                    write_message("Record could not have been parsed",
-                                  stream=sys.stderr)
-                stat['nb_errors'] += 1
-                if callback_url:
-                    results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
-            elif error[0] == 2:
-                if record:
-                    write_message(lambda: record_xml_output(record),
-                                  stream=sys.stderr)
-                else:
-                    write_message("Record could not have been parsed",
-                                  stream=sys.stderr)
-                if callback_url:
-                    results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
-            elif error[0] == 0:
-                if callback_url:
-                    from invenio.legacy.search_engine import print_record
-                    results_for_callback['results'].append({'recid': error[1], 'success': True, "marcxml": print_record(error[1], 'xm'), 'url': "%s/%s/%s" % (CFG_SITE_URL, CFG_SITE_RECORD, error[1])})
+            if callback_url:
+                results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
+        # stat us a global variable
+        task_update_progress("Done %d out of %d read." % \
+                                 (stat['nb_records_inserted'] + \
+                                      stat['nb_records_updated'],
+                                  stat['nb_records_to_upload']))
+
+    # Records waiting to be uploaded by the workers, and their identifiers
+    batch = []
+    batch_identifiers = set()
+
+    def _upload_batch():
+        args = [(record, opt_mode, opt_notimechange, pretend)
+                for record in batch]
+        for record, (error, counts) in zip(batch,
+                pool.imap(_bibupload_record_in_worker, args)):
+            for key, value in iteritems(counts):
+                stat[key] += value
+            _record_uploaded(record, error)
+        del batch[:]
+        batch_identifiers.clear()
+
+    pool = None
+    if workers > 1 and opt_mode != "holdingpen":
+        write_message("Uploading records with %d workers" % workers)
+        # the workers must not inherit the connections of this process
+        _close_sqlalchemy_connections()
+        pool = multiprocessing.Pool(workers, _init_bibupload_worker)
+
+    # Only the records with BDR or BDM fields are needed by the second
+    # phase; keeping just those lets the records be streamed from the file.
+    post_phase_records = []
+    record = None
+    try:
+        for record in records:
+            record_id = record_extract_oai_id(record)
+            task_sleep_now_if_required(can_stop_too=True)
+            if opt_mode == "holdingpen":
+                        #inserting into the holding pen
+                write_message("Inserting into holding pen", verbose=3)
+                insert_record_into_holding_pen(record, record_id, pretend=pretend)
+            elif pool is not None and record and \
+                    not record_uses_temporary_identifiers(record):
+                identifiers = get_record_identifiers(record)
+                if identifiers & batch_identifiers or \
+                        len(batch) >= workers * CFG_BIBUPLOAD_RECORDS_PER_WORKER:
+                    _upload_batch()
+                batch.append(record)
+                batch_identifiers.update(identifiers)
             else:
-                if callback_url:
-                    results_for_callback['results'].append({'recid': error[1], 'success': False, 'error_message': error[2]})
-            # stat us a global variable
-            task_update_progress("Done %d out of %d." % \
-                                     (stat['nb_records_inserted'] + \
-                                          stat['nb_records_updated'],
-                                      stat['nb_records_to_upload']))
+                if batch:
+                    _upload_batch()
+                write_message("Inserting into main database", verbose=3)
+                error = bibupload(
+                    record,
+                    opt_mode = opt_mode,
+                    opt_notimechange = opt_notimechange,
+                    oai_rec_id = record_id,
+                    pretend = pretend,
+                    tmp_ids = tmp_ids,
+                    tmp_vers = tmp_vers)
+                if record and (record_has_field(record, 'BDR') or
+                               record_has_field(record, 'BDM')):
+                    post_phase_records.append(record)
+                _record_uploaded(record, error)
+        if batch:
+            _upload_batch()
+        if pool is not None:
+            pool.close()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
 
     # Second phase -> Now we can process all entries where temporary identifiers might appear (BDR, BDM)
 
     write_message("Identifiers table after processing: %s  versions: %s" % (str(tmp_ids), str(tmp_vers)), verbose=2)
     write_message("Uploading BDR and BDM fields")
     if opt_mode != "holdingpen":
-        for record in records:
+        for record in post_phase_records:
             record_id = retrieve_rec_id(record, opt_mode, pretend=pretend, post_phase = True)
             bibupload_post_phase(record,
                                  rec_id = record_id,
@@ -2982,24 +3228,22 @@ def task_run_core():
     if task_get_option('file_path') is not None:
         write_message("start preocessing", verbose=3)
         task_update_progress("Reading XML input")
-        recs = xml_marc_to_records(open_marc_file(task_get_option('file_path')))
-        stat['nb_records_to_upload'] = len(recs)
+        recs = xml_marc_file_to_records(task_get_option('file_path'))
         write_message("   -Open XML marc: DONE", verbose=2)
         task_sleep_now_if_required(can_stop_too=True)
         write_message("Entering records loop", verbose=3)
         callback_url = task_get_option('callback_url')
         results_for_callback = {'results': []}
 
-        if recs is not None:
-            # We proceed each record by record
-            bibupload_records(records=recs, opt_mode=task_get_option('mode'),
-                              opt_notimechange=task_get_option('notimechange'),
-                              pretend=task_get_option('pretend'),
-                              callback_url=callback_url,
-                              results_for_callback=results_for_callback)
-        else:
-            write_message("   ERROR: bibupload failed: No record found",
-                        verbose=1, stream=sys.stderr)
+        # We proceed each record by record, counting them as they are read
+        bibupload_records(records=count_records_to_upload(recs),
+                          opt_mode=task_get_option('mode'),
+                          opt_notimechange=task_get_option('notimechange'),
+                          pretend=task_get_option('pretend'),
+                          callback_url=callback_url,
+                          results_for_callback=results_for_callback,
+                          workers=task_get_option('workers',
+                                                  CFG_BIBUPLOAD_WORKERS))
         callback_url = task_get_option("callback_url")
         if callback_url:
             nonce = task_get_option("nonce")
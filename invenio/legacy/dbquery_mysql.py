@@ -468,6 +468,32 @@ def get_table_update_time(tablename, run_on_slave=False):
     return max(update_times)
 
 
+def get_table_update_times(tablenames, run_on_slave=False):
+    """Return dictionary of update times of TABLENAMES using one query.
+
+    Tables that do not exist are not present in the returned dictionary.
+    Depending on ``lower_case_table_names``, MySQL reports table names
+    either as created or lowercased and compares them case-sensitively, so
+    both spellings are looked up and mapped back case-insensitively.
+    """
+    if not tablenames:
+        return {}
+    tables = {}
+    for tablename in tablenames:
+        tables.setdefault(tablename.lower(), []).append(tablename)
+    names = set(tablenames) | set(tables)
+    res = run_sql("""SELECT TABLE_NAME, UPDATE_TIME
+                       FROM INFORMATION_SCHEMA.TABLES
+                      WHERE TABLE_SCHEMA=DATABASE() AND TABLE_NAME IN (%s)"""
+                  % ', '.join(['%s'] * len(names)), tuple(names),
+                  run_on_slave=run_on_slave)
+    update_times = {}
+    for tablename, update_time in res:
+        for name in tables.get(tablename.lower(), []):
+            update_times[name] = str(update_time)
+    return update_times
+
+
 def get_table_status_info(tablename, run_on_slave=False):
     """Return table status information on TABLENAME.
 
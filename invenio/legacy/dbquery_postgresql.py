@@ -250,6 +250,17 @@ def get_table_update_time(tablename, run_on_slave=False):
             update_times.append(str(row[11]))
     return max(update_times)
 
+def get_table_update_times(tablenames, run_on_slave=False):
+    """Return dictionary of update times of TABLENAMES."""
+    update_times = {}
+    for tablename in tablenames:
+        try:
+            update_times[tablename] = get_table_update_time(
+                tablename, run_on_slave=run_on_slave)
+        except ValueError:
+            pass  # table does not exist
+    return update_times
+
 def get_table_status_info(tablename, run_on_slave=False):
     """Return table status information on TABLENAME.  Returned is a
        dict with keys like Name, Rows, Data_length, Max_data_length,
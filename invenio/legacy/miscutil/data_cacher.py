@@ -22,11 +22,43 @@ Tool for caching important infos, which are slow to rebuild, but that
 rarely change.
 """
 
+import cPickle
+import fcntl
+import marshal
+import mmap
+import operator
+import os
+import struct
+import tempfile
+import threading
 import time
+import zlib
 
-from werkzeug.utils import cached_property
+from collections import MutableMapping, OrderedDict
 
-from invenio.legacy.dbquery import run_sql, get_table_update_time
+import numpy
+
+from flask import current_app, has_request_context
+from intbitset import intbitset
+from werkzeug.utils import cached_property, import_string
+
+from invenio.base.signals import record_after_create, record_after_update, \
+    tables_updated
+from invenio.legacy.dbquery import run_sql, get_table_update_time, \
+    get_table_update_times
+
+CFG_DATACACHER_SHARED_MAGIC = 'INVDC002'
+CFG_DATACACHER_SHARED_TRAILER = struct.Struct('<Q')
+# number of entries of a table in a shared cache file, followed by the
+# entries: offset and length of the marshalled key, tag, offset and length
+# of the value
+CFG_DATACACHER_SHARED_COUNT = struct.Struct('<Q')
+CFG_DATACACHER_SHARED_ENTRY = struct.Struct('<QIcQQ')
+# nested dictionaries with fewer items are stored as a whole
+CFG_DATACACHER_SHARED_DICT_MIN_SIZE = 1000
+# intbitsets whose uncompressed bitmap is at most that many times bigger
+# than their fastdump are stored uncompressed
+CFG_DATACACHER_SHARED_RAW_RATIO = 8
 
 
 class InvenioDataCacherError(Exception):
@@ -34,6 +66,457 @@ class InvenioDataCacherError(Exception):
     """Error raised by data cacher."""
 
 
+class TableVersionRegistry(object):
+
+    """Registry of update times of the tables watched by data cachers.
+
+    The update times of all the tables that were ever asked for are read
+    from the database using one query, at most once per
+    ``CFG_DATACACHER_TABLE_CHECK_INTERVAL`` seconds, so that checking the
+    freshness of a cache is usually a dictionary lookup.
+
+    The registry lives in the memory of each process.  The
+    ``tables_updated`` signal and the record signals only mark tables as
+    updated in the registry of the process sending them, e.g. bibindex or
+    bibupload, so that caches used later on by the same process are
+    refreshed immediately.  Other processes such as the web workers only
+    notice the modifications by polling the database every
+    ``CFG_DATACACHER_TABLE_CHECK_INTERVAL`` seconds.
+    """
+
+    def __init__(self, check_interval=None):
+        """Initialize empty registry."""
+        self._check_interval = check_interval
+        self.update_times = {}
+        self.last_check = 0
+        self._lock = threading.Lock()
+
+    @property
+    def check_interval(self):
+        """Return number of seconds between two checks."""
+        if self._check_interval is None:
+            from invenio.base.globals import cfg
+            return cfg.get('CFG_DATACACHER_TABLE_CHECK_INTERVAL', 0)
+        return self._check_interval
+
+    def get_update_time(self, tablename):
+        """Return update time of TABLENAME, refreshing it if needed."""
+        if '%' in tablename:
+            # wildcard table names are not watched
+            return get_table_update_time(tablename)
+        if tablename not in self.update_times or \
+                time.time() - self.last_check >= self.check_interval:
+            self.refresh(tablename)
+        return self.update_times[tablename]
+
+    def refresh(self, *tablenames):
+        """Read update times of all watched tables and of TABLENAMES."""
+        with self._lock:
+            tablenames = set(self.update_times) | set(tablenames)
+            update_times = get_table_update_times(list(tablenames))
+            for tablename in tablenames:
+                self.update_times[tablename] = update_times.get(
+                    tablename, "0000-00-00 00:00:00")
+            self.last_check = time.time()
+
+    def bump(self, tablenames):
+        """Mark TABLENAMES as updated now."""
+        now = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        with self._lock:
+            for tablename in tablenames:
+                self.update_times[tablename] = now
+
+table_version_registry = TableVersionRegistry()
+
+
+def get_table_version(tablename):
+    """Return update time of TABLENAME known by the table version registry.
+
+    This is a cheap replacement of get_table_update_time() meant for cache
+    timestamp verifiers.
+    """
+    return table_version_registry.get_update_time(tablename)
+
+
+@tables_updated.connect
+def _bump_table_versions(sender, tables=(), **kwargs):
+    """Mark tables announced by the tables_updated signal as updated.
+
+    This only affects the registry of the current process.
+    """
+    table_version_registry.bump(tables)
+
+
+@record_after_create.connect
+@record_after_update.connect
+def _bump_record_table_versions(sender, **kwargs):
+    """Mark record tables as updated when bibupload modifies a record.
+
+    This only affects the registry of the current process.
+    """
+    table_version_registry.bump(['bibrec', 'bibfmt'])
+
+
+def get_shared_cache_path(name):
+    """Return path of the memory-mapped file of the shared cache NAME."""
+    from invenio.base.globals import cfg
+    return os.path.join(cfg['CFG_CACHEDIR'], 'datacacher', name + '.cache')
+
+
+def get_shared_key(key):
+    """Return KEY normalized so that equal keys have equal marshal dumps.
+
+    Raise TypeError for keys that cannot be looked up in shared files.
+    """
+    if isinstance(key, (bool, int, long)):
+        return int(key)
+    if isinstance(key, float):
+        return int(key) if key.is_integer() else key
+    if isinstance(key, unicode):
+        try:
+            return key.encode('ascii')
+        except UnicodeError:
+            return key
+    if key is None or isinstance(key, str):
+        return key
+    if isinstance(key, tuple):
+        return tuple(get_shared_key(item) for item in key)
+    raise TypeError(key)
+
+
+def is_shared_view_p(value):
+    """Check if VALUE is stored in a layout that is read in place."""
+    return isinstance(value, (intbitset, numpy.ndarray, dict))
+
+
+class SharedCacheWriter(object):
+
+    """Write values into a shared cache file.
+
+    Every value is written as a blob described by a (tag, offset, length)
+    entry:
+
+    * ``'i'``: intbitset, as its fastdump, or uncompressed (zlib level 0)
+      when the bitset is dense, so that loading it is a mere copy;
+    * ``'n'``: numpy array, as its raw data mapped in place on access;
+    * ``'d'``: dictionary, as a table of entries sorted by marshalled key,
+      searched in place, the values being written as separate blobs;
+    * ``'t'``: tuple holding any of the above, as a table of entries;
+    * ``'o'``: object whose attributes are numpy arrays, e.g. the citation
+      graph, as the class name and the table of its attributes;
+    * ``'m'``, ``'p'``: any other value, marshalled or pickled as a whole.
+    """
+
+    def __init__(self, stream, offset):
+        """Initialize with file STREAM positioned at OFFSET."""
+        self.stream = stream
+        self.offset = offset
+
+    def write(self, blob, alignment=1):
+        """Write BLOB aligned to ALIGNMENT bytes and return its offset."""
+        padding = -self.offset % alignment
+        if padding:
+            self.stream.write('\0' * padding)
+            self.offset += padding
+        offset = self.offset
+        self.stream.write(blob)
+        self.offset += len(blob)
+        return offset
+
+    def write_table(self, tag, entries):
+        """Write table of (key blob, (tag, offset, length)) ENTRIES."""
+        rows = []
+        for key_blob, (value_tag, offset, length) in entries:
+            key_offset = self.write(key_blob) if key_blob else 0
+            rows.append(CFG_DATACACHER_SHARED_ENTRY.pack(
+                key_offset, len(key_blob), value_tag, offset, length))
+        table = CFG_DATACACHER_SHARED_COUNT.pack(len(rows)) + ''.join(rows)
+        return tag, self.write(table, 8), len(table)
+
+    def write_value(self, value, view_p=False):
+        """Write VALUE and return its (tag, offset, length) entry.
+
+        Dictionaries are written as tables when VIEW_P is set, when they
+        are big or when they hold intbitsets, arrays or dictionaries.
+        """
+        if isinstance(value, intbitset):
+            blob = value.fastdump()
+            raw = zlib.decompress(blob)
+            if len(raw) <= CFG_DATACACHER_SHARED_RAW_RATIO * len(blob):
+                blob = zlib.compress(raw, 0)
+            return 'i', self.write(blob), len(blob)
+        if isinstance(value, numpy.ndarray) and value.dtype.fields is None \
+                and not value.dtype.hasobject:
+            meta = marshal.dumps((value.dtype.str, value.shape))
+            offset = self.write(struct.pack('<I', len(meta)) + meta)
+            self.write(numpy.ascontiguousarray(value).tostring(), 16)
+            return 'n', offset, self.offset - offset
+        if type(value) is dict and (view_p or len(value) >=
+                                    CFG_DATACACHER_SHARED_DICT_MIN_SIZE or
+                                    any(is_shared_view_p(item)
+                                        for item in value.itervalues())):
+            try:
+                keys = [(marshal.dumps(get_shared_key(key)), key)
+                        for key in value]
+            except (TypeError, ValueError):
+                keys = None
+            if keys is not None:
+                entries = [(key_blob, self.write_value(value[key]))
+                           for key_blob, key in keys]
+                entries.sort()
+                return self.write_table('d', entries)
+        if type(value) is tuple and any(is_shared_view_p(item)
+                                        for item in value):
+            return self.write_table('t', [('', self.write_value(item))
+                                          for item in value])
+        attributes = getattr(value, '__dict__', None)
+        if attributes and type(value) is value.__class__ and \
+                all(isinstance(item, numpy.ndarray)
+                    for item in attributes.itervalues()):
+            cls = value.__class__
+            attributes = self.write_value(dict(attributes), view_p=True)
+            blob = marshal.dumps((cls.__module__, cls.__name__) + attributes)
+            return 'o', self.write(blob), len(blob)
+        try:
+            blob = 'm', marshal.dumps(value)
+        except ValueError:
+            blob = 'p', cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)
+        return blob[0], self.write(blob[1]), len(blob[1])
+
+
+def load_shared_value(mapped, tag, offset, length):
+    """Return value written by SharedCacheWriter from the MAPPED file."""
+    if tag == 'i':
+        return intbitset(mapped[offset:offset + length])
+    elif tag == 'n':
+        meta_length, = struct.unpack_from('<I', mapped, offset)
+        dtype, shape = marshal.loads(mapped[offset + 4:
+                                            offset + 4 + meta_length])
+        count = reduce(operator.mul, shape, 1)
+        if not count:
+            return numpy.empty(shape, dtype)
+        start = offset + 4 + meta_length
+        start += -start % 16
+        return numpy.frombuffer(mapped, dtype, count, start).reshape(shape)
+    elif tag == 'd':
+        return SharedCacheDict(mapped, offset)
+    elif tag == 't':
+        count, = CFG_DATACACHER_SHARED_COUNT.unpack_from(mapped, offset)
+        start = offset + CFG_DATACACHER_SHARED_COUNT.size
+        size = CFG_DATACACHER_SHARED_ENTRY.size
+        return tuple(load_shared_value(
+            mapped, *CFG_DATACACHER_SHARED_ENTRY.unpack_from(
+                mapped, start + i * size)[2:])
+                     for i in range(count))
+    elif tag == 'o':
+        module, name, tag, offset, length = \
+            marshal.loads(mapped[offset:offset + length])
+        value = object.__new__(import_string('%s:%s' % (module, name)))
+        value.__dict__.update(load_shared_value(mapped, tag, offset, length))
+        return value
+    elif tag == 'm':
+        return marshal.loads(mapped[offset:offset + length])
+    return cPickle.loads(mapped[offset:offset + length])
+
+
+class SharedCacheDict(MutableMapping):
+
+    """Dictionary backed by a read-only memory-mapped shared cache file.
+
+    The keys are looked up in place in the mapped file, by a binary search
+    in the table of entries sorted by marshalled key, so the dictionary
+    takes almost no private memory of the worker.  Values are read when
+    they are accessed: numpy arrays and nested dictionaries are views of
+    the mapped file, intbitsets are copied from it and other values are
+    deserialized.  Only the ``CFG_DATACACHER_SHARED_LOADED_VALUES`` most
+    recently used copied or deserialized values are kept, so that the
+    private memory of a worker stays bounded.  Clients may still alter the
+    dictionary; changes are kept in the local process only, and are not
+    subject to the limit.  Changes made in place to a returned intbitset
+    or deserialized value may be lost once the value is evicted.
+    """
+
+    def __init__(self, mapped, offset, max_loaded_values=None):
+        """Initialize with mapped file and offset of the table of keys."""
+        if max_loaded_values is None:
+            from invenio.base.globals import cfg
+            max_loaded_values = cfg.get('CFG_DATACACHER_SHARED_LOADED_VALUES',
+                                        16)
+        self._mapped = mapped
+        self._offset = offset
+        self._count, = CFG_DATACACHER_SHARED_COUNT.unpack_from(mapped, offset)
+        self._entries = offset + CFG_DATACACHER_SHARED_COUNT.size
+        self._max_loaded_values = max_loaded_values
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._values = {}
+        self._deleted = set()
+
+    def _get_entry(self, position):
+        """Return (key offset, key length, tag, offset, length) entry."""
+        return CFG_DATACACHER_SHARED_ENTRY.unpack_from(
+            self._mapped,
+            self._entries + position * CFG_DATACACHER_SHARED_ENTRY.size)
+
+    def _find(self, key):
+        """Return (tag, offset, length) of KEY in the mapped file or None."""
+        try:
+            key_blob = marshal.dumps(get_shared_key(key))
+        except (TypeError, ValueError):
+            return None
+        mapped = self._mapped
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._get_entry(middle)
+            probe = mapped[entry[0]:entry[0] + entry[1]]
+            if probe < key_blob:
+                low = middle + 1
+            elif probe > key_blob:
+                high = middle
+            else:
+                return entry[2:]
+        return None
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            if key in self._deleted:
+                raise
+        with self._lock:
+            try:
+                value = self._loaded.pop(key)
+            except KeyError:
+                entry = self._find(key)
+                if entry is None:
+                    raise KeyError(key)
+                value = load_shared_value(self._mapped, *entry)
+                if entry[0] in 'ndo':
+                    # views of the mapped file take no private memory
+                    self._values[key] = value
+                    return value
+            if self._max_loaded_values > 0:
+                self._loaded[key] = value
+                while len(self._loaded) > self._max_loaded_values:
+                    self._loaded.popitem(last=False)
+        return value
+
+    def __setitem__(self, key, value):
+        self._deleted.discard(key)
+        with self._lock:
+            self._loaded.pop(key, None)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._values.pop(key, None)
+        with self._lock:
+            self._loaded.pop(key, None)
+        if self._find(key) is not None:
+            self._deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self._values:
+            return True
+        return key not in self._deleted and self._find(key) is not None
+
+    def _iter_shared_keys(self):
+        mapped = self._mapped
+        for position in xrange(self._count):
+            key_offset, key_length = self._get_entry(position)[:2]
+            yield marshal.loads(mapped[key_offset:key_offset + key_length])
+
+    def __iter__(self):
+        for key in self._iter_shared_keys():
+            if key not in self._deleted:
+                yield key
+        for key in self._values.keys():
+            if self._find(key) is None:
+                yield key
+
+    def __len__(self):
+        return self._count - len(self._deleted) + \
+            len([key for key in self._values if self._find(key) is None])
+
+
+def write_shared_cache(path, cache, timestamp):
+    """Write CACHE into file PATH, atomically replacing any previous one.
+
+    The file starts with a magic string followed by the values written by
+    SharedCacheWriter and ends with a pickled header, holding the
+    timestamp and the entry of the cache, and the offset of the header.
+    A dictionary cache is always written as a table of entries.
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            tmp_file.write(CFG_DATACACHER_SHARED_MAGIC)
+            writer = SharedCacheWriter(tmp_file,
+                                       len(CFG_DATACACHER_SHARED_MAGIC))
+            header = {'timestamp': timestamp,
+                      'value': writer.write_value(cache, view_p=True)}
+            tmp_file.write(cPickle.dumps(header, cPickle.HIGHEST_PROTOCOL))
+            tmp_file.write(CFG_DATACACHER_SHARED_TRAILER.pack(writer.offset))
+        os.chmod(tmp_path, 0644)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def map_shared_cache(path):
+    """Map the shared cache file PATH and return (cache, timestamp).
+
+    Return (None, None) if the file does not exist or is not valid.
+    """
+    try:
+        with open(path, 'rb') as cache_file:
+            mapped = mmap.mmap(cache_file.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+    except (IOError, OSError, ValueError):
+        return None, None
+    trailer_size = CFG_DATACACHER_SHARED_TRAILER.size
+    if mapped[:len(CFG_DATACACHER_SHARED_MAGIC)] != \
+            CFG_DATACACHER_SHARED_MAGIC or len(mapped) < trailer_size:
+        return None, None
+    offset, = CFG_DATACACHER_SHARED_TRAILER.unpack(mapped[-trailer_size:])
+    header = cPickle.loads(mapped[offset:-trailer_size])
+    return load_shared_value(mapped, *header['value']), header['timestamp']
+
+
+def load_shared_cache(name, cache_filler, timestamp_verifier):
+    """Return (cache, timestamp) of the shared cache NAME.
+
+    The cache file is reused if it is more recent than the timestamp
+    returned by the verifier.  Otherwise exactly one process on the host
+    fills the cache and writes the new file while the others wait for it.
+    """
+    path = get_shared_cache_path(name)
+    last_change = timestamp_verifier()
+    cache, timestamp = map_shared_cache(path)
+    if cache is not None and timestamp >= last_change:
+        return cache, timestamp
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # another process may have refreshed the cache in the meantime
+            cache, timestamp = map_shared_cache(path)
+            if cache is not None and timestamp >= last_change:
+                return cache, timestamp
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+            write_shared_cache(path, cache_filler(), timestamp)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return map_shared_cache(path)
+
+
 class DataCacher(object):
     """
     DataCacher is an abstract cacher system, for caching informations
@@ -59,10 +542,38 @@ class DataCacher(object):
             raise InvenioDataCacherError, "timestamp_verifier is not callable"
         self.timestamp_verifier = timestamp_verifier
         self.is_ok_p = True
+        self._refill_lock = threading.Lock()
+        self._refill_thread = None
         self.create_cache()
 
+    @property
+    def name(self):
+        """Return name of the cache, used e.g. for its shared file."""
+        return self.__class__.__name__
+
+    @property
+    def shared_p(self):
+        """Check if the cache is stored in a memory-mapped shared file."""
+        from invenio.base.globals import cfg
+        shared_caches = cfg.get('CFG_DATACACHER_SHARED_CACHES', [])
+        return self.__class__.__name__ in shared_caches or \
+            self.name in shared_caches
+
+    @property
+    def background_p(self):
+        """Check if the cache is recreated in a background thread."""
+        from invenio.base.globals import cfg
+        background_caches = cfg.get('CFG_DATACACHER_BACKGROUND_CACHES', [])
+        return self.__class__.__name__ in background_caches or \
+            self.name in background_caches
+
     def clear(self):
         """Clear the cache rebuilding it."""
+        if self.shared_p:
+            try:
+                os.remove(get_shared_cache_path(self.name))
+            except OSError:
+                pass
         self.create_cache()
 
     def create_cache(self):
@@ -70,6 +581,10 @@ class DataCacher(object):
         Create and populate cache by calling cache filler.  Called on
         startup and used later during runtime as needed by clients.
         """
+        if self.shared_p:
+            self.cache, self.timestamp = load_shared_cache(
+                self.name, self.cache_filler, self.timestamp_verifier)
+            return
         self.cache = self.cache_filler()
         self.timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
 
@@ -79,7 +594,36 @@ class DataCacher(object):
         against the timestamp verifier function.
         """
         if self.timestamp_verifier() > self.timestamp:
-            self.create_cache()
+            if self.timestamp and self.background_p and \
+                    has_request_context():
+                self.create_cache_in_background()
+            else:
+                self.create_cache()
+
+    def create_cache_in_background(self):
+        """Recreate cache in a thread while the old one is still served.
+
+        The new cache replaces the old one only once it is complete.  At
+        most one thread per cacher is running at a time.
+        """
+        with self._refill_lock:
+            if self._refill_thread is not None and \
+                    self._refill_thread.is_alive():
+                return
+            app = current_app._get_current_object()
+
+            def refill():
+                with app.app_context():
+                    try:
+                        self.create_cache()
+                    except Exception:
+                        from invenio.ext.logging import register_exception
+                        register_exception(alert_admin=True)
+
+            self._refill_thread = threading.Thread(
+                target=refill, name='refill-' + self.name)
+            self._refill_thread.daemon = True
+            self._refill_thread.start()
 
 class SQLDataCacher(DataCacher):
     """
@@ -102,7 +646,7 @@ class SQLDataCacher(DataCacher):
         def timestamp_verifier():
             """The standard timestamp verifier is looking at affected
             tables time stamp."""
-            return max([get_table_update_time(table)
+            return max([get_table_version(table)
                 for table in self.affected_tables])
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
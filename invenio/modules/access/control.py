@@ -23,22 +23,26 @@ from __future__ import print_function
 
 import urlparse
 
+from flask import g, has_request_context
 from intbitset import intbitset
 
 from invenio.config import CFG_SITE_ADMIN_EMAIL, CFG_SITE_LANG, CFG_SITE_RECORD
 from invenio.ext import principal
 from invenio.ext.sqlalchemy import db
 from invenio.legacy.dbquery import ProgrammingError, run_sql
+from invenio.legacy.miscutil.data_cacher import DataCacher, \
+    DataCacherProxy, get_table_version
 from invenio.modules.access.firerole import (
     acc_firerole_check_user, compile_role_definition, deserialize,
     load_role_definition, serialize
 )
 from invenio.modules.access.local_config import (
-    CFG_ACC_ACTIVITIES_URLS, CFG_ACC_EMPTY_ROLE_DEFINITION_SER,
+    CFG_ACC_ACTIVITIES_URLS, CFG_ACC_EMPTY_ROLE_DEFINITION_OBJ,
+    CFG_ACC_EMPTY_ROLE_DEFINITION_SER,
     CFG_ACC_EMPTY_ROLE_DEFINITION_SRC, DEF_AUTHS, DEF_ROLES, DEF_USERS,
     DELEGATEADDUSERROLE, SUPERADMINROLE
 )
-from invenio.modules.access.models import AccACTION, AccAuthorization, \
+from invenio.modules.access.models import AccACTION, \
     UserAccROLE
 
 from six import iteritems
@@ -375,10 +379,12 @@ def acc_add_user_role(id_user=0, id_role=0, email='', name_role='',
         run_sql("""UPDATE user_accROLE SET expiration=%s WHERE id_user=%s AND
             id_accROLE=%s AND expiration<%s""",
             (expiration, id_user, id_role, expiration) )
+        acc_reset_user_roles_memos()
         return id_user, id_role, 0
     else:
         run_sql("""INSERT INTO user_accROLE (id_user, id_accROLE, expiration)
             VALUES (%s, %s, %s) """, (id_user, id_role, expiration))
+        acc_reset_user_roles_memos()
         return id_user, id_role, 1
 
 
@@ -395,8 +401,10 @@ def acc_delete_user_role(id_user, id_role=0, name_role=0):
     id_role = id_role or acc_get_role_id(name_role=name_role)
 
     # number of deleted entries will be returned (0 or 1)
-    return run_sql("""DELETE FROM user_accROLE WHERE id_user = %s
+    count = run_sql("""DELETE FROM user_accROLE WHERE id_user = %s
         AND id_accROLE = %s """, (id_user, id_role))
+    acc_reset_user_roles_memos()
+    return count
 
 
 # ARGUMENTS
@@ -1226,19 +1234,67 @@ def acc_is_user_in_role(user_info, id_role):
 
 
 def acc_is_user_in_any_role(user_info, id_roles):
-    if db.session.query(db.func.count(UserAccROLE.id_accROLE)).filter(db.and_(
-        UserAccROLE.id_user == user_info['uid'],
-        UserAccROLE.expiration >= db.func.now(),
-        UserAccROLE.id_accROLE.in_(id_roles))).scalar() > 0:
+    """Return True if the user belong implicitly or explicitly to any of
+    the roles.
+
+    The roles explicitly connected to the user and the result of the
+    FireRole checks are remembered until the end of the request, see
+    acc_get_user_roles_memo().
+    """
+    memo = acc_get_user_roles_memo(user_info)
+    if memo['explicit'] & intbitset(id_roles):
         return True
 
+    fireroles = get_authorization_model()['fireroles']
+    implicit = memo['implicit']
     for id_role in id_roles:
-        if acc_firerole_check_user(user_info, load_role_definition(id_role)):
+        if id_role not in implicit:
+            implicit[id_role] = acc_firerole_check_user(
+                user_info,
+                fireroles.get(id_role, CFG_ACC_EMPTY_ROLE_DEFINITION_OBJ))
+        if implicit[id_role]:
             return True
 
     return False
 
 
+def acc_get_user_roles_memo(user_info):
+    """Return the roles memo of the user for the current request.
+
+    The memo is a dictionary holding the ``explicit`` roles of the user as
+    an intbitset and the ``implicit`` dictionary of role ids and results
+    of their FireRole checks for this very USER_INFO.  Outside of a request
+    a new memo is returned at every call.  The explicit roles are read
+    from the master database, so that a role just granted is seen.
+    """
+    uid = user_info['uid']
+    if not has_request_context():
+        return {'explicit': intbitset(acc_get_user_roles(uid, False)),
+                'implicit': {}}
+    memos = getattr(g, '_acc_user_roles_memos', None)
+    if memos is None:
+        memos = g._acc_user_roles_memos = {}
+    memo = memos.get(uid)
+    if memo is None:
+        memo = memos[uid] = {
+            'explicit': intbitset(acc_get_user_roles(uid, False)),
+            'user_info': None}
+    if memo['user_info'] is not user_info:
+        # FireRole checks depend on the whole user_info
+        memo['user_info'] = user_info
+        memo['implicit'] = {}
+    return memo
+
+
+def acc_reset_user_roles_memos():
+    """Forget the roles memos of the current request.
+
+    Called when the roles of a user change, see acc_get_user_roles_memo().
+    """
+    if has_request_context():
+        g._acc_user_roles_memos = {}
+
+
 def acc_get_user_roles_from_user_info(user_info):
     """get all roles a user is connected to."""
 
@@ -1251,23 +1307,23 @@ def acc_get_user_roles_from_user_info(user_info):
             WHERE ur.id_user = %s AND ur.expiration >= NOW()
             ORDER BY ur.id_accROLE""", (uid, ), run_on_slave=True))
 
-    potential_implicit_roles = run_sql("""SELECT id, firerole_def_ser FROM accROLE
-        WHERE firerole_def_ser IS NOT NULL""", run_on_slave=True)
-
-    for role_id, firerole_def_ser in potential_implicit_roles:
+    fireroles = get_authorization_model()['fireroles']
+    for role_id, firerole_def_obj in iteritems(fireroles):
         if role_id not in roles:
-            if acc_firerole_check_user(user_info, deserialize(firerole_def_ser)):
+            if acc_firerole_check_user(user_info, firerole_def_obj):
                 roles.add(role_id)
 
     return roles
 
-def acc_get_user_roles(id_user):
-    """get all roles a user is explicitly connected to."""
+def acc_get_user_roles(id_user, run_on_slave=True):
+    """get all roles a user is explicitly connected to.
+
+    run_on_slave - whether the roles may be read from the slave database """
 
     explicit_roles = run_sql("""SELECT ur.id_accROLE
         FROM user_accROLE ur
         WHERE ur.id_user = %s AND ur.expiration >= NOW()
-        ORDER BY ur.id_accROLE""", (id_user, ), run_on_slave=True)
+        ORDER BY ur.id_accROLE""", (id_user, ), run_on_slave=run_on_slave)
 
     return [id_role[0] for id_role in explicit_roles]
 
@@ -1409,27 +1465,87 @@ def acc_find_possible_actions_argument_listid(id_role, id_action, arglistid):
     return res2
 
 
+class AccAuthorizationDataCacher(DataCacher):
+
+    """Provide the compiled authorization model of the access tables.
+
+    The cache holds:
+
+    * ``actions``: action name -> action id
+    * ``roles``: action id -> roles authorized without arguments
+    * ``argument_roles``: action id -> argument keyword -> argument value
+      -> roles authorized with it, where the ``None`` value holds the roles
+      authorized with any value of the keyword
+    * ``fireroles``: role id -> deserialized FireRole definition
+
+    This class is not to be used directly; use function
+    get_authorization_model() instead.
+    """
+
+    def __init__(self):
+        def cache_filler():
+            actions = dict(run_sql("SELECT name, id FROM accACTION",
+                                   run_on_slave=True))
+            roles = {}
+            for id_action, id_role in run_sql(
+                    """SELECT id_accACTION, id_accROLE
+                    FROM accROLE_accACTION_accARGUMENT
+                    WHERE argumentlistid <= 0""", run_on_slave=True):
+                roles.setdefault(id_action, intbitset()).add(id_role)
+            argument_roles = {}
+            for id_action, id_role, keyword, value in run_sql(
+                    """SELECT raa.id_accACTION, raa.id_accROLE, arg.keyword,
+                    arg.value
+                    FROM accROLE_accACTION_accARGUMENT raa
+                    JOIN accARGUMENT arg ON arg.id = raa.id_accARGUMENT
+                    WHERE raa.argumentlistid > 0""", run_on_slave=True):
+                values = argument_roles.setdefault(id_action, {}).setdefault(
+                    keyword, {None: intbitset()})
+                values.setdefault(value, intbitset()).add(id_role)
+                values[None].add(id_role)
+            fireroles = {}
+            for id_role, firerole_def_ser in run_sql(
+                    """SELECT id, firerole_def_ser FROM accROLE
+                    WHERE firerole_def_ser IS NOT NULL""", run_on_slave=True):
+                try:
+                    fireroles[id_role] = deserialize(firerole_def_ser)
+                except Exception:
+                    # let it repair the definition
+                    fireroles[id_role] = load_role_definition(id_role)
+            return {'actions': actions,
+                    'roles': roles,
+                    'argument_roles': argument_roles,
+                    'fireroles': fireroles}
+
+        def timestamp_verifier():
+            return max([get_table_version(table) for table in (
+                'accACTION', 'accARGUMENT', 'accROLE',
+                'accROLE_accACTION_accARGUMENT')])
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+authorization_model_cache = DataCacherProxy(AccAuthorizationDataCacher)
+
+
+def get_authorization_model():
+    """Return the authorization model, see AccAuthorizationDataCacher."""
+    authorization_model_cache.recreate_cache_if_needed()
+    return authorization_model_cache.cache
+
+
 def acc_find_possible_roles(name_action, always_add_superadmin=True,
                             batch_args=False, **arguments):
     """Find all the possible roles that are enabled to a given action.
 
+    A role authorized with an argument is enabled if the value of the
+    argument is '*', or if the given value of the keyword is missing,
+    '*' or equal to it.
+
     :return: roles as a list of role_id
     """
-    query_roles_without_args = \
-        db.select([AccAuthorization.id_accROLE], db.and_(
-            AccAuthorization.argumentlistid <= 0,
-            AccAuthorization.id_accACTION == db.bindparam('id_action')))
-
-    query_roles_with_args = \
-        AccAuthorization.query.filter(db.and_(
-            AccAuthorization.argumentlistid > 0,
-            AccAuthorization.id_accACTION == db.bindparam('id_action')
-        )).join(AccAuthorization.argument)
-
-    id_action = db.session.query(AccACTION.id).filter(
-        AccACTION.name == name_action).scalar()
-    roles = intbitset(db.engine.execute(query_roles_without_args.params(
-        id_action=id_action)).fetchall())
+    model = get_authorization_model()
+    id_action = model['actions'].get(name_action)
+    roles = intbitset(model['roles'].get(id_action, []))
 
     if always_add_superadmin:
         roles.add(CFG_SUPERADMINROLE_ID)
@@ -1441,19 +1557,22 @@ def acc_find_possible_roles(name_action, always_add_superadmin=True,
     else:
         batch_arguments = [arguments]
 
-    acc_authorizations = query_roles_with_args.params(
-        id_action=id_action
-    ).all()
+    argument_roles = model['argument_roles'].get(id_action, {})
 
     result = []
     for arguments in batch_arguments:
         batch_roles = roles.copy()
-        for auth in acc_authorizations:
-            if auth.id_accROLE not in batch_roles:
-                if not ((auth.argument.value != arguments.get(
-                            auth.argument.keyword, '*') != '*'
-                         ) and auth.argument.value != '*'):
-                    batch_roles.add(auth.id_accROLE)
+        for keyword, value_roles in iteritems(argument_roles):
+            value = arguments.get(keyword, '*')
+            if value == '*':
+                batch_roles |= value_roles[None]
+                continue
+            if '*' in value_roles:
+                batch_roles |= value_roles['*']
+            try:
+                batch_roles |= value_roles[value]
+            except (KeyError, TypeError):
+                pass
         result.append(batch_roles)
     return result if batch_args else result[0]
 
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the compiled authorization model."""
+
+from intbitset import intbitset
+from mock import patch
+
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+
+class AccessControlAuthorizationModelTest(InvenioTestCase):
+
+    """Test authorizations computed on the authorization model."""
+
+    def setUp(self):
+        """Prepare the rows of the access control tables."""
+        from invenio.modules.access.firerole import compile_role_definition, \
+            serialize
+        self.tables = {
+            'SELECT name, id FROM accACTION': [('viewrestrcoll', 1),
+                                               ('runbibedit', 2)],
+            'argumentlistid <= 0': [(2, 10)],
+            'argumentlistid > 0': [(1, 11, 'collection', 'Theses'),
+                                   (1, 12, 'collection', '*'),
+                                   (1, 13, 'collection', 'Books'),
+                                   (1, 13, 'status', 'draft')],
+            'firerole_def_ser IS NOT NULL': [(11, serialize(compile_role_definition(
+                "allow email 'jekyll@cds.cern.ch'")))],
+        }
+        self.queries = []
+
+    def run_sql(self, query, param=None, *args, **kwargs):
+        self.queries.append(query)
+        for key, rows in self.tables.items():
+            if key in query:
+                return rows
+        return []
+
+    def test_find_possible_roles(self):
+        """access control - possible roles of an action"""
+        from invenio.modules.access.control import AccAuthorizationDataCacher
+        with patch('invenio.modules.access.control.run_sql', self.run_sql):
+            model = AccAuthorizationDataCacher()
+            self.assertEqual(4, len(self.queries))
+            with patch('invenio.modules.access.control.'
+                       'get_authorization_model', lambda: model.cache):
+                from invenio.modules.access.control import \
+                    acc_find_possible_roles, CFG_SUPERADMINROLE_ID
+                # a missing argument matches any value
+                self.assertEqual(
+                    intbitset([12, 13, CFG_SUPERADMINROLE_ID]),
+                    acc_find_possible_roles('viewrestrcoll',
+                                            collection='Articles'))
+                self.assertEqual(
+                    intbitset([11, 12]),
+                    acc_find_possible_roles('viewrestrcoll',
+                                            always_add_superadmin=False,
+                                            collection='Theses',
+                                            status='final'))
+                self.assertEqual(
+                    intbitset([11, 12, 13]),
+                    acc_find_possible_roles('viewrestrcoll',
+                                            always_add_superadmin=False))
+                self.assertEqual(
+                    [intbitset([12, 13]), intbitset([11, 12, 13])],
+                    acc_find_possible_roles('viewrestrcoll',
+                                            always_add_superadmin=False,
+                                            batch_args=True,
+                                            collection=['Books', 'Theses'],
+                                            status=['x', 'draft']))
+                self.assertEqual(
+                    intbitset([10]),
+                    acc_find_possible_roles('runbibedit',
+                                            always_add_superadmin=False,
+                                            collection='Theses'))
+                self.assertEqual(
+                    intbitset(),
+                    acc_find_possible_roles('unknown',
+                                            always_add_superadmin=False))
+        self.assertEqual([11], model.cache['fireroles'].keys())
+
+    def test_user_roles_memo(self):
+        """access control - explicit roles memo follows role changes"""
+        from invenio.modules.access import control
+        roles = [[(10, ), (13, )], [(10, )]]
+        slave_queries = []
+
+        def run_sql(query, param=None, *args, **kwargs):
+            if kwargs.get('run_on_slave'):
+                slave_queries.append(query)
+            if 'FROM user_accROLE' in query:
+                return roles[0]
+            if query.startswith('DELETE'):
+                return 1
+            return []
+
+        user_info = {'uid': 5}
+        with self.app.test_request_context():
+            with patch.object(control, 'run_sql', run_sql):
+                self.assertEqual(
+                    intbitset([10, 13]),
+                    control.acc_get_user_roles_memo(user_info)['explicit'])
+                roles.pop(0)
+                self.assertEqual(
+                    intbitset([10, 13]),
+                    control.acc_get_user_roles_memo(user_info)['explicit'])
+                self.assertEqual(1, control.acc_delete_user_role(5, 13))
+                self.assertEqual(
+                    intbitset([10]),
+                    control.acc_get_user_roles_memo(user_info)['explicit'])
+        self.assertEqual([], slave_queries)
+
+
+TEST_SUITE = make_test_suite(AccessControlAuthorizationModelTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -23,7 +23,9 @@ from intbitset import intbitset
 from werkzeug import cached_property
 
 from invenio.base.globals import cfg
-from invenio.legacy.miscutil.data_cacher import DataCacher, DataCacherProxy
+from invenio.ext.sqlalchemy import db
+from invenio.legacy.miscutil.data_cacher import DataCacher, \
+    DataCacherProxy, get_table_version
 from invenio.modules.indexer.models import IdxINDEX
 from invenio.utils.memoise import memoize
 
@@ -46,9 +48,8 @@ class CollectionAllChildrenDataCacher(DataCacher):
             ])
 
         def timestamp_verifier():
-            from invenio.legacy.dbquery import get_table_update_time
-            return max(get_table_update_time('collection'),
-                       get_table_update_time('collection_collection'))
+            return max(get_table_version('collection'),
+                       get_table_version('collection_collection'))
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -73,16 +74,44 @@ class CollectionRecListDataCacher(DataCacher):
     """
 
     def __init__(self):
+        #: checksums of the collection hitlists the cache was filled with
+        self.checksums = {}
+        self._filled_checksums = None
+
         def cache_filler():
-            from invenio.modules.search.searchext.engines.native import \
-                search_unit_in_idxphrases
-            collections = Collection.query.all()
-            setattr(get_all_recids, 'cache', dict())
-            setattr(get_collection_nbrecs, 'cache', dict())
-            return dict([
-                (c.name, search_unit_in_idxphrases(c.name, 'collection', 'e'))
-                for c in collections
-            ])
+            collections = [name for name, in Collection.query.values(
+                Collection.name)]
+            model = IdxINDEX.idxPHRASEF('collection', fallback=False)
+            if model is None or not collections:
+                self._filled_checksums = {}
+                return dict((name, intbitset()) for name in collections)
+
+            # only the hitlists that changed since the last fill are read
+            checksums = dict(model.query.filter(
+                model.term.in_(collections)
+            ).values(model.term, db.func.md5(model.hitlist)))
+            previous = self.cache
+            changed = [name for name in collections
+                       if name not in previous or
+                       checksums.get(name) != self.checksums.get(name)]
+            hitlists = {}
+            if changed:
+                hitlists = dict(
+                    (term, intbitset(hitlist))
+                    for term, hitlist in model.query.filter(
+                        model.term.in_(changed)
+                    ).values(model.term, model.hitlist))
+            self._filled_checksums = checksums
+
+            cache = {}
+            for name in collections:
+                if name in hitlists:
+                    cache[name] = hitlists[name]
+                elif name in changed:
+                    cache[name] = intbitset()
+                else:
+                    cache[name] = previous[name]
+            return cache
 
         def timestamp_verifier():
             return IdxINDEX.query.filter_by(id=self._index_id).value(
@@ -90,6 +119,20 @@ class CollectionRecListDataCacher(DataCacher):
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+    def create_cache(self):
+        """Fill the cache and reset the values computed from the old one.
+
+        The checksums and the memoized functions are only updated once the
+        new cache is installed, as the old one may still be served while
+        the cache is filled in the background.
+        """
+        self._filled_checksums = None
+        DataCacher.create_cache(self)
+        # checksums are unknown if the cache was loaded from a shared file
+        self.checksums = self._filled_checksums or {}
+        get_all_recids.cache.clear()
+        get_collection_nbrecs.cache.clear()
+
     @cached_property
     def _index_id(self):
         return IdxINDEX.get_from_field('collection').id
@@ -141,9 +184,8 @@ class RestrictedCollectionDataCacher(DataCacher):
             setattr(get_all_restricted_recids, 'cache', dict())
 
         def timestamp_verifier():
-            from invenio.legacy.dbquery import get_table_update_time
-            return max(get_table_update_time('accROLE_accACTION_accARGUMENT'),
-                       get_table_update_time('accARGUMENT'))
+            return max(get_table_version('accROLE_accACTION_accARGUMENT'),
+                       get_table_version('accARGUMENT'))
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -179,6 +221,102 @@ def get_all_recids():
     return ret
 
 
+class CollectionVisibilityCache(object):
+
+    """Cache bitsets used to filter search results by collection visibility.
+
+    Two kinds of bitsets are kept: the records that are *not permitted* for
+    a given set of permitted restricted collections, and the records that
+    are *displayable* in a given collection subtree.  Both are derived from
+    the collection reclists, hence they are dropped together with them
+    whenever the collection reclist, the restricted collection or the
+    collection tree cache is recreated.
+    """
+
+    def __init__(self):
+        """Initialize empty cache."""
+        self.sources = None
+        self.notpermitted = {}
+        self.displayable = {}
+
+    def recreate_cache_if_needed(self):
+        """Drop cached bitsets if any of the source caches changed."""
+        collection_reclist_cache.recreate_cache_if_needed()
+        restricted_collection_cache.recreate_cache_if_needed()
+        collection_allchildren_cache.recreate_cache_if_needed()
+        sources = (collection_reclist_cache.cache,
+                   restricted_collection_cache.cache,
+                   collection_allchildren_cache.cache)
+        if self.sources is None or any(
+                old is not new for old, new in zip(self.sources, sources)):
+            self.sources = sources
+            self.notpermitted = {}
+            self.displayable = {}
+
+    def _store(self, cache, key, value):
+        if len(cache) >= cfg['CFG_WEBSEARCH_VISIBILITY_CACHE_SIZE']:
+            cache.clear()
+        cache[key] = value
+        return value
+
+    def get_notpermitted_recids(self, permitted_restricted_collections,
+                                policy):
+        """Return records hidden from a user.
+
+        :param permitted_restricted_collections: restricted collections the
+            user is allowed to see
+        :param policy: ``'ANY'`` if access to one of the restricting
+            collections suffices, anything else if all of them are needed
+        """
+        restricted = restricted_collection_cache.cache
+        permitted = frozenset(permitted_restricted_collections) & \
+            frozenset(restricted)
+        key = (policy == 'ANY', permitted)
+        if key in self.notpermitted:
+            return self.notpermitted[key]
+
+        permitted_recids = intbitset()
+        notpermitted_recids = intbitset()
+        for collection in restricted:
+            if collection in permitted:
+                permitted_recids |= get_collection_reclist(
+                    collection, recreate_cache_if_needed=False)
+            else:
+                notpermitted_recids |= get_collection_reclist(
+                    collection, recreate_cache_if_needed=False)
+        if policy == 'ANY':
+            # User needs to have access to at least one collection that
+            # restricts the records. We need this to be able to remove
+            # records that are both in a public and restricted collection.
+            notpermitted_recids -= permitted_recids
+        return self._store(self.notpermitted, key, notpermitted_recids)
+
+    def get_displayable_recids(self, current_coll, colls,
+                               permitted_restricted_collections):
+        """Return records of ``colls`` and of visible ``current_coll`` children.
+
+        A child of ``current_coll`` is visible if it is one of ``colls`` or
+        one of the permitted restricted collections.
+        """
+        children = get_collection_allchildren(current_coll,
+                                              recreate_cache_if_needed=False)
+        colls = frozenset(colls)
+        permitted = frozenset(permitted_restricted_collections) & \
+            frozenset(children)
+        key = (current_coll, colls, permitted)
+        if key in self.displayable:
+            return self.displayable[key]
+
+        recids = intbitset()
+        for coll in colls | permitted:
+            recids |= get_collection_reclist(coll,
+                                             recreate_cache_if_needed=False)
+        return self._store(self.displayable, key, recids)
+
+
+collection_visibility_cache = CollectionVisibilityCache()
+
+
 def is_record_in_any_collection(recID, recreate_cache_if_needed=True):
     """Return True if the record belongs to at least one collection.
 
@@ -211,8 +349,7 @@ class CollectionI18nNameDataCacher(DataCacher):
             return ret
 
         def timestamp_verifier():
-            from invenio.legacy.dbquery import get_table_update_time
-            return get_table_update_time('collectionname')
+            return get_table_version('collectionname')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
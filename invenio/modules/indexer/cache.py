@@ -19,7 +19,12 @@
 
 """Implementation of indexer caches."""
 
-from invenio.legacy.miscutil.data_cacher import DataCacher, DataCacherProxy
+import re
+
+from invenio.ext.sqlalchemy import db
+from invenio.legacy.miscutil.data_cacher import DataCacher, \
+    DataCacherProxy, get_table_version
+from invenio.modules.knowledge.models import KnwKB, KnwKBRVAL
 
 from .models import IdxINDEX
 
@@ -38,8 +43,7 @@ class IndexStemmingDataCacher(DataCacher):
                                               IdxINDEX.stemming_language))
 
         def timestamp_verifier():
-            from invenio.legacy.dbquery import get_table_update_time
-            return get_table_update_time('idxINDEX')
+            return get_table_version('idxINDEX')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -51,3 +55,71 @@ def get_index_stemming_language(index_id, recreate_cache_if_needed=True):
     if recreate_cache_if_needed:
         index_stemming_cache.recreate_cache_if_needed()
     return index_stemming_cache.cache[index_id]
+
+
+def get_synonym_lookup_key(term):
+    """Return the key of TERM in a synonym lookup table.
+
+    Knowledge base keys are matched case-insensitively, like the collation
+    of the ``knwKBRVAL`` table does.
+    """
+    if isinstance(term, str):
+        term = term.decode('utf-8', 'ignore')
+    return term.lower().encode('utf-8')
+
+
+class SynonymDataCacher(DataCacher):
+
+    """Provide the synonym lookup table of a knowledge base.
+
+    The cache maps the lookup keys of the knowledge base terms to the list
+    of their synonyms.  It is always stored in a memory-mapped shared file,
+    so that it is built once per change of the knowledge bases and then
+    read lazily by bibindex and by the search workers.
+
+    This class is not to be used directly; use function
+    get_synonym_lookup() instead.
+    """
+
+    def __init__(self, kbr_name):
+        self.kbr_name = kbr_name
+
+        def cache_filler():
+            lookup = {}
+            mappings = db.session.query(KnwKBRVAL.m_key, KnwKBRVAL.m_value) \
+                .join(KnwKB).filter(KnwKB.name == kbr_name)
+            for key, value in mappings:
+                lookup.setdefault(get_synonym_lookup_key(key),
+                                  []).append(value)
+            return lookup
+
+        def timestamp_verifier():
+            return max(get_table_version('knwKB'),
+                       get_table_version('knwKBRVAL'))
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+    @property
+    def name(self):
+        """Return name of the cache, including the knowledge base name."""
+        return '%s-%s' % (self.__class__.__name__,
+                          re.sub(r'[^\w.-]', '_', self.kbr_name))
+
+    @property
+    def shared_p(self):
+        """Synonym lookup tables are always stored in shared files."""
+        return True
+
+synonym_caches = {}
+
+
+def get_synonym_lookup(kbr_name, recreate_cache_if_needed=True):
+    """Return synonym lookup table of knowledge base KBR_NAME."""
+    try:
+        cacher = synonym_caches[kbr_name]
+    except KeyError:
+        cacher = synonym_caches[kbr_name] = SynonymDataCacher(kbr_name)
+    else:
+        if recreate_cache_if_needed:
+            cacher.recreate_cache_if_needed()
+    return cacher.cache
@@ -19,9 +19,13 @@
 
 """Unit tests for the indexing engine."""
 
+from intbitset import intbitset
+
 from invenio.base.wrappers import lazy_import
 from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
 
+from mock import patch
+
 bibindex_engine = lazy_import('invenio.legacy.bibindex.engine')
 load_tokenizers = lazy_import(
     'invenio.legacy.bibindex.engine_utils.load_tokenizers')
@@ -277,13 +281,245 @@ class TestGetValuesFromRecjson(InvenioTestCase):
         self.assertEqual(phrases, ['name1', 'name2', 'name4'])
 
 
+class TestBulkFlush(InvenioTestCase):
+
+    """Tests for flushing batches of words into index tables."""
+
+    def setUp(self):
+        self.table = bibindex_engine.AbstractIndexTable.__new__(
+            bibindex_engine.AbstractIndexTable)
+        self.table.table_name = 'idxWORD01F'
+        self.table.value = {'higgs': {1: 1, 2: 1},
+                            'boson': {3: 1},
+                            'gone': {4: -1},
+                            'new': {5: 1}}
+        self.db = {'higgs': intbitset([2]).fastdump(),
+                   'boson': intbitset([2, 3]).fastdump(),
+                   'gone': intbitset([4]).fastdump()}
+        self.queries = []
+
+    def run_sql(self, query, params=()):
+        self.queries.append(query)
+        if query.startswith('SELECT hitlist'):
+            return tuple((self.db[term], ) for term in params
+                         if term in self.db)
+        elif query.startswith('SELECT'):
+            return tuple((term, self.db[term]) for term in params
+                         if term in self.db)
+        elif query.startswith('UPDATE'):
+            self.db[params[1]] = params[0]
+        elif query.startswith('INSERT'):
+            for i in range(0, len(params), 2):
+                self.db[params[i]] = params[i + 1]
+        elif query.startswith('DELETE'):
+            for term in params:
+                del self.db[term]
+        return ()
+
+    def run_sql_many(self, query, params):
+        self.queries.append(query)
+        for hitlist, term in params:
+            self.db[term] = hitlist
+
+    def test_put_words_into_db(self):
+        """bibindex engine - flush batch of words with few queries"""
+        with patch('invenio.legacy.bibindex.engine.run_sql', self.run_sql):
+            with patch('invenio.legacy.bibindex.engine.run_sql_many',
+                       self.run_sql_many):
+                self.table.put_words_into_db(self.table.value.keys())
+        self.assertEqual(len(self.queries), 4)
+        self.assertEqual(
+            dict((term, intbitset(hitlist))
+                 for term, hitlist in self.db.items()),
+            {'higgs': intbitset([1, 2]),
+             'boson': intbitset([2, 3]),
+             'new': intbitset([5])})
+
+    def flush_fixture_index(self, batch_size):
+        """Flush 1000 words, half of them already indexed."""
+        self.table.index_name = 'title'
+        self.table.recIDs_in_mem = []
+        self.table.value = {}
+        self.db = {}
+        self.queries = []
+        for i in range(1000):
+            word = 'word%04d' % i
+            if i % 2:
+                self.table.value[word] = {i: 1}
+            elif i % 10:
+                self.db[word] = intbitset([i]).fastdump()
+                self.table.value[word] = {i + 1: 1}
+            else:
+                self.db[word] = intbitset([i]).fastdump()
+                self.table.value[word] = {i: -1}
+        with patch('invenio.legacy.bibindex.engine.run_sql', self.run_sql), \
+                patch('invenio.legacy.bibindex.engine.run_sql_many',
+                      self.run_sql_many), \
+                patch('invenio.legacy.bibindex.engine.'
+                      'CFG_BIBINDEX_FLUSH_BATCH_SIZE', batch_size), \
+                patch('invenio.legacy.bibindex.engine.write_message'), \
+                patch('invenio.legacy.bibindex.engine.task_update_progress'):
+            self.table.put_into_db()
+        return dict((term, intbitset(hitlist))
+                    for term, hitlist in self.db.items())
+
+    def test_put_into_db_statements(self):
+        """bibindex engine - number of statements of a flush"""
+        words = self.flush_fixture_index(0)
+        # one SELECT and one write per word, one more DELETE per emptied word
+        self.assertEqual(len(self.queries), 2100)
+        self.assertEqual(len(words), 900)
+        self.assertEqual(self.flush_fixture_index(100), words)
+        # at most one SELECT, UPDATE, INSERT and DELETE per batch of 100
+        self.assertTrue(len(self.queries) <= 40)
+
+
+class TestReverseIndexRows(InvenioTestCase):
+
+    """Tests for writing the reverse index rows of records."""
+
+    def setUp(self):
+        self.table = bibindex_engine.WordTable.__new__(
+            bibindex_engine.WordTable)
+        self.table.table_name = 'idxWORD01F'
+        self.queries = []
+
+    def run_sql(self, query, params=()):
+        self.queries.append((query, params))
+        if query.startswith('SELECT'):
+            return ((1, 'PUBLIC'), (2, 'DELETED'), (4, 'DELETED'),
+                    (5, 'deleted'))
+        return ()
+
+    def test_put_termlists_into_db(self):
+        """bibindex engine - insert reverse index rows of a chunk at once"""
+        with patch('invenio.legacy.bibindex.engine.run_sql', self.run_sql):
+            self.table.put_termlists_into_db({3: ['boson'],
+                                              1: ['higgs', 'boson']})
+        self.assertEqual(len(self.queries), 2)
+        future, current = self.queries
+        self.assertTrue(future[0].startswith('INSERT INTO idxWORD01R'))
+        self.assertEqual(future[1][0::2], (1, 3))
+        self.assertEqual(
+            bibindex_engine.deserialize_via_marshal(future[1][1]),
+            ['higgs', 'boson'])
+        self.assertTrue(current[0].startswith('INSERT IGNORE INTO'))
+        self.assertEqual(current[1][0::2], (1, 3))
+
+    def test_get_deleted_recIDs(self):
+        """bibindex engine - find deleted records of a range at once"""
+        with patch('invenio.legacy.bibindex.engine.run_sql', self.run_sql):
+            deleted = self.table.get_deleted_recIDs(1, 5)
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(deleted, intbitset([2, 4]))
+
+
+class TestParallelIndexing(InvenioTestCase):
+
+    """Tests for tokenizing records in parallel worker processes."""
+
+    def setUp(self):
+        class FakeWordTable(bibindex_engine.WordTable):
+
+            def __init__(self):
+                self.index_name = 'title'
+                self.table_name = 'idxWORD01F'
+                self.wash_index_terms = 0
+                self.virtual_indexes = []
+                self.value = {}
+                self.recIDs_in_mem = []
+                self.flushed = []
+
+            def chk_recID_range(self, low, high):
+                pass
+
+            def del_recID_range(self, low, high):
+                self.recIDs_in_mem.append([low, high])
+                for recID in range(low, high + 1):
+                    self.put(recID, 'word%d' % (recID % 5), -1)
+
+            def add_recID_range(self, low, high):
+                self.recIDs_in_mem.append([low, high])
+                for recID in range(low, high + 1):
+                    if recID % 4:
+                        self.put(recID, 'word%d' % (recID % 7), 1)
+                        self.put(recID, 'rec%d' % recID, 1)
+                return high - low + 1
+
+            def put_into_db(self, mode="normal"):
+                self.flushed.append(
+                    (self.value,
+                     bibindex_engine.beautify_range_list(self.recIDs_in_mem)))
+                self.recIDs_in_mem = []
+
+        self.table_class = FakeWordTable
+        self.recIDs = [[1, 70], [100, 145]]
+
+    def add_recIDs(self, workers, table_class=None):
+        table = (table_class or self.table_class)()
+        with patch('invenio.legacy.bibindex.engine.write_message'):
+            with patch('invenio.legacy.bibindex.engine.task_update_progress'):
+                with patch('invenio.legacy.bibindex.engine.'
+                           'task_sleep_now_if_required'):
+                    table.add_recIDs(self.recIDs, 50, workers)
+        return table.flushed
+
+    def test_split_recID_ranges(self):
+        """bibindex engine - split record ranges into flushed chunks"""
+        self.assertEqual(
+            list(bibindex_engine.split_recID_ranges(self.recIDs, 50, 20)),
+            [[[1, 20], [21, 40], [41, 50]],
+             [[51, 70], [100, 119], [120, 129]],
+             [[130, 145]]])
+
+    def test_parallel_equals_serial(self):
+        """bibindex engine - parallel tokenizing equals the serial one"""
+        serial = self.add_recIDs(1)
+        parallel = self.add_recIDs(3)
+        self.assertEqual(len(serial), 3)
+        self.assertEqual(parallel, serial)
+
+    def test_workers_database_connections(self):
+        """bibindex engine - workers query the database on own connections"""
+        from invenio.ext.sqlalchemy import db
+        from invenio.legacy.dbquery import run_sql
+
+        def get_connection_id():
+            return db.session.execute('SELECT CONNECTION_ID()').scalar()
+
+        class DatabaseWordTable(self.table_class):
+
+            def add_recID_range(self, low, high):
+                self.recIDs_in_mem.append([low, high])
+                for recID in range(low, high + 1):
+                    self.put(recID, 'connection%d' % get_connection_id(), 1)
+                    self.put(recID, 'rec%d' % int(
+                        run_sql('SELECT %s', (recID, ))[0][0]), 1)
+                return high - low + 1
+
+        parent_connection_id = get_connection_id()
+        flushed = self.add_recIDs(3, DatabaseWordTable)
+        words = dict((word, recIDs) for value, dummy in flushed
+                     for word, recIDs in value.items())
+        recIDs = set(recID for low, high in self.recIDs
+                     for recID in range(low, high + 1))
+        self.assertEqual(
+            set(word for word in words if word.startswith('rec')),
+            set('rec%d' % recID for recID in recIDs))
+        self.assertFalse('connection%d' % parent_connection_id in words)
+        self.assertEqual(get_connection_id(), get_connection_id())
+
+
 TEST_SUITE = make_test_suite(TestListSetOperations,
                              TestWashIndexTerm,
                              TestGetWordsFromPhrase,
                              TestGetPairsFromPhrase,
                              TestGetWordsFromDateTag,
                              TestGetAuthorFamilyNameWords,
-                             TestGetValuesFromRecjson,)
+                             TestGetValuesFromRecjson,
+                             TestBulkFlush,
+                             TestReverseIndexRows,
+                             TestParallelIndexing,)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the index-time and search-time synonym lookups."""
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
+
+from mock import patch
+
+indexer_utils = lazy_import('invenio.modules.indexer.utils')
+indexer_cache = lazy_import('invenio.modules.indexer.cache')
+
+
+class TestSynonymLookup(InvenioTestCase):
+
+    """Tests for synonym lookups in precompiled knowledge bases."""
+
+    lookup = {'higgs': ['Higgs boson', 'BEH boson'],
+              'h': ['Higgs boson'],
+              'phys. rev. d': ['Physical Review D']}
+
+    def get_synonym_terms(self, term, match_type):
+        from invenio.legacy.bibindex.engine_config import \
+            CFG_BIBINDEX_SYNONYM_MATCH_TYPE as MATCH_TYPES
+        with patch('invenio.modules.indexer.utils.get_synonym_lookup',
+                   return_value=self.lookup):
+            return sorted(indexer_utils.get_synonym_terms(
+                term, 'SYNONYMS', MATCH_TYPES[match_type]))
+
+    def test_lookup_key(self):
+        """indexer - synonym lookup keys are lowercased UTF-8 strings"""
+        self.assertEqual(indexer_cache.get_synonym_lookup_key('HiGGs'),
+                         'higgs')
+        self.assertEqual(indexer_cache.get_synonym_lookup_key(u'\xc9T\xc9'),
+                         '\xc3\xa9t\xc3\xa9')
+
+    def test_exact_match(self):
+        """indexer - synonym lookup of an exact term"""
+        self.assertEqual(self.get_synonym_terms('Higgs', 'exact'),
+                         ['BEH boson', 'Higgs boson'])
+        self.assertEqual(self.get_synonym_terms('Higgs 2012', 'exact'), [])
+
+    def test_leading_to_comma_match(self):
+        """indexer - synonym lookup of a term leading to comma"""
+        self.assertEqual(self.get_synonym_terms('H, boson', 'leading_to_comma'),
+                         ['Higgs boson, boson'])
+
+    def test_leading_to_number_match(self):
+        """indexer - synonym lookup of a term leading to number"""
+        self.assertEqual(self.get_synonym_terms('Phys. Rev. D 84',
+                                                'leading_to_number'),
+                         ['Physical Review D 84'])
+
+
+TEST_SUITE = make_test_suite(TestSynonymLookup,)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
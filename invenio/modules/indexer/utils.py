@@ -23,9 +23,9 @@ import re
 
 from invenio.ext.cache import cache
 from invenio.ext.sqlalchemy import db
-from invenio.modules.knowledge.api import get_kbr_values
 from invenio.utils.datastructures import LazyDict
 
+from .cache import get_synonym_lookup, get_synonym_lookup_key
 from .models import IdxINDEX, IdxINDEXField
 from .registry import tokenizers
 
@@ -55,7 +55,8 @@ def get_synonym_terms(term, kbr_name, match_type, use_memoise=False):
     :param match_type: specifies how the term matches against the KBR
         before doing the lookup.  Could be `exact' (default),
         'leading_to_comma', `leading_to_number'.
-    :param use_memoise: can we memoise while doing lookups?
+    :param use_memoise: can we skip checking whether the knowledge base
+        changed since its lookup table was loaded?
     :return: list of term synonyms
     """
     dterms = {}
@@ -75,15 +76,10 @@ def get_synonym_terms(term, kbr_name, match_type, use_memoise=False):
         if mmm:
             term_for_lookup = mmm.group(1)
             term_remainder = mmm.group(2)
-    # FIXME: workaround: escaping SQL wild-card signs, since KBR's
-    # exact search is doing LIKE query, so would match everything:
-    term_for_lookup = term_for_lookup.replace('%', '\\%')
-    # OK, now find synonyms:
-    for kbr_values in get_kbr_values(kbr_name,
-                                     searchkey=term_for_lookup,
-                                     searchtype='e',
-                                     use_memoise=use_memoise):
-        for kbr_value in kbr_values:
-            dterms[kbr_value + term_remainder] = 1
+    # OK, now find synonyms in the precompiled lookup table:
+    lookup = get_synonym_lookup(kbr_name,
+                                recreate_cache_if_needed=not use_memoise)
+    for kbr_value in lookup.get(get_synonym_lookup_key(term_for_lookup), ()):
+        dterms[kbr_value + term_remainder] = 1
     # return list of term synonyms:
     return dterms.keys()
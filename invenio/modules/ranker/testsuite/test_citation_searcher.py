@@ -51,7 +51,141 @@ class TestCitationSearcher(InvenioTestCase):
         """bibrank citation searcher - get co-cited-with data"""
         # FIXME: test postponed
 
-TEST_SUITE = make_test_suite(TestCitationSearcher,)
+
+class TestCitationGraph(InvenioTestCase):
+    """Test the in-memory citation graph."""
+
+    def setUp(self):
+        """Initialize stuff"""
+        from numpy import array
+        from invenio.legacy.bibrank.citation_searcher import CitationGraph
+        # 1 and 2 cite 3, 1 cites 4, 4 cites 2
+        self.graph = CitationGraph(array([1, 2, 1, 4]), array([3, 3, 4, 2]))
+
+    def test_get_refers_to(self):
+        """bibrank citation searcher - records referenced by a hitset"""
+        from intbitset import intbitset
+        self.assertEqual(intbitset([2, 3, 4]),
+                         self.graph.get_refers_to(intbitset([1, 4, 10])))
+
+    def test_get_cited_by(self):
+        """bibrank citation searcher - records citing a hitset"""
+        from intbitset import intbitset
+        self.assertEqual(intbitset([1, 2]),
+                         self.graph.get_cited_by(intbitset([3, 10])))
+
+    def test_get_cited_by_list(self):
+        """bibrank citation searcher - citing records of each record"""
+        self.assertEqual([(3, set([1, 2])), (1, set()), (10, set())],
+                         self.graph.get_cited_by_list([3, 1, 10]))
+
+    def test_get_co_cited_with_counts(self):
+        """bibrank citation searcher - co-cited records"""
+        co_cited, counts = self.graph.get_co_cited_with_counts(3)
+        self.assertEqual([(4, 1)], zip(co_cited.tolist(), counts.tolist()))
+
+    def test_updated(self):
+        """bibrank citation searcher - patching the citation graph"""
+        from intbitset import intbitset
+        graph, deltas = self.graph.updated([(1, 3, False), (5, 3, True),
+                                            (2, 3, True), (5, 1, True),
+                                            (4, 2, False), (4, 2, True)])
+        self.assertEqual({3: 0, 1: 1}, deltas)
+        self.assertEqual([(3, set([2, 5])), (1, set([5])), (2, set([4]))],
+                         graph.get_cited_by_list([3, 1, 2]))
+        self.assertEqual(intbitset([1, 3]), graph.get_refers_to([5]))
+        self.assertEqual(intbitset([3, 4]), self.graph.get_refers_to([1]))
+
+    def test_update_citation_counts_arrays(self):
+        """bibrank citation searcher - patching the citation counts"""
+        from invenio.legacy.bibrank.citation_searcher import \
+            get_citation_counts_arrays, update_citation_counts_arrays, \
+            get_citation_counts
+        arrays = get_citation_counts_arrays({1: 5, 2: 1, 3: 3})
+        arrays = update_citation_counts_arrays(arrays, {1: 5, 3: 6, 4: 2},
+                                               [2, 3, 4])
+        self.assertEqual([(3, 6), (1, 5), (4, 2)], get_citation_counts(arrays))
+
+
+class TestCitationDictsDataCacher(InvenioTestCase):
+    """Test the patching of the citation dictionaries cache."""
+
+    def fill(self, citers, citees):
+        """Return the cache filled from the citation graph."""
+        from mock import patch
+        from numpy import array
+        from invenio.legacy.bibrank.citation_searcher import \
+            CitationDictsDataCacher, CitationGraph
+        module = 'invenio.legacy.bibrank.citation_searcher.'
+        with patch(module + 'load_citation_graph',
+                   return_value=CitationGraph(array(citers), array(citees))), \
+                patch(module + 'get_citation_log_id', return_value=10), \
+                patch(module + 'get_selfcites_last_updated',
+                      return_value='2015-01-01 00:00:00'), \
+                patch(module + 'cache.get', return_value=None), \
+                patch('invenio.legacy.bibrank.tag_based_indexer.fromDB',
+                      return_value={3: 1}), \
+                patch('invenio.legacy.bibrank.tag_based_indexer.'
+                      'get_lastupdated', return_value=None):
+            return CitationDictsDataCacher()
+
+    def test_update_cache(self):
+        """bibrank citation searcher - patched cache equals a new one"""
+        from mock import patch
+        # 1 and 2 cite 3, 1 cites 4, 4 cites 2
+        cacher = self.fill([1, 2, 1, 4], [3, 3, 4, 2])
+        changes = [(11, 1, 3, False), (12, 5, 3, True), (13, 5, 1, True),
+                   (14, 2, 3, False), (15, 2, 3, True)]
+        module = 'invenio.legacy.bibrank.citation_searcher.'
+        with patch(module + 'get_citation_log_id', return_value=15), \
+                patch(module + 'get_citation_log', return_value=changes), \
+                patch(module + 'get_selfcites_last_updated',
+                      return_value='2015-01-01 00:00:00'):
+            self.assertTrue(cacher.update_cache())
+        patched = cacher.cache
+        filled = self.fill([2, 1, 4, 5, 5], [3, 4, 2, 3, 1]).cache
+        self.assertEqual(15, patched['citations_log_id'])
+        for name in ('citations', 'selfcites'):
+            self.assertEqual(filled[name + '_weights'],
+                             patched[name + '_weights'])
+            filled_recids, filled_cites = filled[name + '_counts_arrays']
+            recids, cites = patched[name + '_counts_arrays']
+            # records with the same counts may come in another order
+            self.assertEqual(filled_cites.tolist(), cites.tolist())
+            self.assertEqual(
+                sorted(zip(filled_recids.tolist(), filled_cites.tolist())),
+                sorted(zip(recids.tolist(), cites.tolist())))
+            self.assertEqual(sorted(filled[name + '_counts']),
+                             sorted(patched[name + '_counts']))
+        self.assertEqual(filled['citations_keys'], patched['citations_keys'])
+        self.assertEqual(
+            filled['citations_graph'].get_cited_by_list([1, 2, 3, 4]),
+            patched['citations_graph'].get_cited_by_list([1, 2, 3, 4]))
+
+    def test_selfcites_recomputed(self):
+        """bibrank citation searcher - recomputed self-cites refill cache"""
+        from mock import patch
+        from invenio.legacy.bibrank.citation_searcher import \
+            CitationDictsDataCacher
+        cacher = CitationDictsDataCacher.__new__(CitationDictsDataCacher)
+        cacher.cache = {'citations_log_id': 10,
+                        'selfcites_last_updated': '2015-01-01 00:00:00'}
+        module = 'invenio.legacy.bibrank.citation_searcher.'
+        with patch(module + 'get_citation_log_id', return_value=10), \
+                patch(module + 'get_citation_log', return_value=[]), \
+                patch(module + 'get_selfcites_last_updated',
+                      return_value='2015-01-01 00:00:00'):
+            self.assertTrue(cacher.update_cache())
+        with patch(module + 'get_citation_log_id', return_value=10), \
+                patch(module + 'get_citation_log', return_value=[]), \
+                patch(module + 'get_selfcites_last_updated',
+                      return_value='2015-01-02 00:00:00'):
+            self.assertFalse(cacher.update_cache())
+
+
+TEST_SUITE = make_test_suite(TestCitationSearcher,
+                             TestCitationGraph,
+                             TestCitationDictsDataCacher)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
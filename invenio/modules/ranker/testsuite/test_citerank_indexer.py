@@ -53,6 +53,34 @@ class TestCiterankIndexer(InvenioTestCase):
         dict_of_ranks = bibrank_citerank_indexer.run_pagerank(self.cit, self.dict_of_ids, len(self.dict_of_ids), self.ref, self.damping_factor, self.conv_threshold, self.check_point, self.dates)
         self.assertEqual({96: 0.622, 18: 1.1419839999999999, 74: 0.88200100000000003, 77: 1.142002, 78: 1.6020020000000001, 79: 0.86200299999999996, 80: 0.62200199999999994, 81: 2.712002, 82: 0.62200199999999994, 83: 0.62200299999999997, 84: 1.6520029999999999, 85: 0.62200299999999997, 86: 0.62200299999999997, 87: 0.62200299999999997, 88: 0.62200299999999997, 89: 0.62200500000000003, 91: 0.88200699999999999, 92: 0.62200599999999995, 94: 1.1419969999999999, 95: 1.8519990000000002}, dict_of_ranks)
 
+    def test_sparse_matrix(self):
+        """bibrank citerank indexer - sparse matrix in CSR format"""
+        from numpy import array, int32
+        sparse = bibrank_citerank_indexer.SparseMatrix(
+            array([2, 0, 2], int32), array([0, 1, 2], int32),
+            array([3.0, 1.0, 2.0]), 3)
+        self.assertEqual(list(sparse.indptr), [0, 1, 1, 3])
+        self.assertEqual(list(sparse.indices), [1, 0, 2])
+        self.assertEqual(list(sparse.dot(array([1.0, 10.0, 100.0]))),
+                         [10.0, 0.0, 203.0])
+
+    def assert_ranks_almost_equal(self, expected, dict_of_ranks):
+        self.assertEqual(sorted(expected.keys()), sorted(dict_of_ranks.keys()))
+        for recid in expected:
+            self.assertAlmostEqual(expected[recid], dict_of_ranks[recid], 4)
+
+    def test_calculate_ranks_ext(self):
+        """bibrank citerank indexer - calculate ranks with external links"""
+        ext_links = {0: 2, 3: 1, 5: 4, 8: 0, 13: 3}
+        dict_of_ranks = bibrank_citerank_indexer.run_pagerank_ext(self.cit, self.dict_of_ids, self.ref, ext_links, self.conv_threshold, self.check_point, 0.1, 1.0, self.dates)
+        self.assert_ranks_almost_equal({96: 0.362, 18: 0.701984, 74: 0.532001, 77: 0.652002, 78: 1.032002, 79: 0.532003, 80: 0.362002, 81: 1.732002, 82: 0.362002, 83: 0.362003, 84: 0.992003, 85: 0.362003, 86: 0.362003, 87: 0.362003, 88: 0.362003, 89: 0.362005, 91: 0.532007, 92: 0.362006, 94: 0.701997, 95: 1.151999}, dict_of_ranks)
+
+    def test_calculate_ranks_time(self):
+        """bibrank citerank indexer - calculate ranks with time decay"""
+        date_coef = dict((j, 0.5 + 0.025 * j) for j in range(20))
+        dict_of_ranks = bibrank_citerank_indexer.run_pagerank_time(self.cit, self.dict_of_ids, len(self.dict_of_ids), self.ref, self.damping_factor, self.conv_threshold, self.check_point, date_coef, self.dates)
+        self.assert_ranks_almost_equal({96: 58.692, 18: 115.401984, 74: 76.202001, 77: 97.882002, 78: 136.892002, 79: 77.462003, 80: 58.692002, 81: 262.172002, 82: 58.692002, 83: 58.692003, 84: 156.682003, 85: 58.692003, 86: 58.692003, 87: 58.692003, 88: 58.692003, 89: 58.692005, 91: 76.202007, 92: 58.692006, 94: 122.071997, 95: 139.901999}, dict_of_ranks)
+
 TEST_SUITE = make_test_suite(TestCiterankIndexer,)
 
 if __name__ == "__main__":
@@ -48,7 +48,95 @@ class TestListSetOperations(InvenioTestCase):
         self.assertEqual(({1: 7, 2: 7, 5: 5}, {1: 1, 2: 1, 5: 1}),  bibrank_word_searcher.calculate_record_relevance(("testterm", 2.0),
 {"Gi":(0, 50.0), 1: (3, 4.0), 2: (4, 5.0), 5: (1, 3.5)}, hitset, {}, {}, 0, None))
 
-TEST_SUITE = make_test_suite(TestListSetOperations,)
+    def test_sort_record_relevance_top(self):
+        """bibrank record sorter - sorting only the best records"""
+        from invenio.legacy.bibrank import word_searcher as bibrank_word_searcher
+        from intbitset import intbitset
+        from numpy import array
+        recids = array([1, 2, 3, 4])
+        values = array([50, 30, 70, 10])
+        (res1, res2) = bibrank_word_searcher.sort_record_relevance_top(recids, values, intbitset([1, 2, 5]), 50, None, 0)
+        self.assertEqual(([(1, 71), (3, 100)], [5]), (res1, list(res2)))
+        (res1, res2) = bibrank_word_searcher.sort_record_relevance_top(recids, values, intbitset([1, 2, 5]), 50, 1, 0)
+        self.assertEqual(([(3, 100)], [1, 5]), (res1, list(res2)))
+
+    def test_sort_record_relevance_top_no_relevance(self):
+        """bibrank record sorter - sorting records without relevance"""
+        from invenio.legacy.bibrank import word_searcher as bibrank_word_searcher
+        from intbitset import intbitset
+        from numpy import array
+        recids = array([1, 2])
+        values = array([0, 0])
+        (res1, res2) = bibrank_word_searcher.sort_record_relevance_top(recids, values, intbitset([1, 2, 5]), 50, None, 0)
+        self.assertEqual(([], [5]), (res1, list(res2)))
+        (res1, res2) = bibrank_word_searcher.sort_record_relevance_top(recids, values, intbitset([1, 2, 5]), 0, None, 0)
+        self.assertEqual(([(1, 0), (2, 0)], [5]), (res1, list(res2)))
+
+    def test_calculate_record_relevance_from_posting(self):
+        """bibrank record sorter - calculating relevances from a posting"""
+        from invenio.legacy.bibrank import word_searcher as bibrank_word_searcher
+        from intbitset import intbitset
+        posting = bibrank_word_searcher.create_term_posting(
+            {"Gi":(0, 50.0), 1: (3, 4.0), 2: (4, 5.0), 4: (2, 1.0), 5: (1, 3.5)})
+        (recids, values) = bibrank_word_searcher.calculate_record_relevance_from_posting(posting, 2.0, intbitset([1, 2, 5]))
+        self.assertEqual([(1, 7), (2, 7), (5, 5)], zip(recids.tolist(), values.tolist()))
+
+class TestRankByMethod(InvenioTestCase):
+    """Test ranking by the predetermined values of a rank method."""
+
+    def setUp(self):
+        from invenio.legacy.bibrank import record_sorter
+        from invenio.legacy.dbquery import serialize_via_marshal
+        self.record_sorter = record_sorter
+        self.relevance_data = serialize_via_marshal({1: 5, 2: 3, 3: 5, 7: 1})
+        self.queries = []
+        record_sorter.rank_method_data_caches.clear()
+
+    def tearDown(self):
+        self.record_sorter.rank_method_data_caches.clear()
+
+    def run_sql(self, query, param=None):
+        self.queries.append(query)
+        if 'relevance_data' in query:
+            return ((self.relevance_data,),)
+        return ((10,),)
+
+    def rank_by_method(self, hitset, lwords=()):
+        from mock import patch
+        with patch.object(self.record_sorter, 'run_sql', self.run_sql), \
+                patch.object(self.record_sorter, 'get_table_version',
+                             lambda table: '2015-01-01 00:00:00'):
+            with patch.dict(self.record_sorter.METHODS,
+                            {'test': {'prefix': '(', 'postfix': ')'}}):
+                return self.record_sorter.rank_by_method(
+                    'test', list(lwords), hitset, 0, 0)
+
+    def test_rank_by_method(self):
+        """bibrank record sorter - ranking by method data"""
+        from intbitset import intbitset
+        result = self.rank_by_method(intbitset([1, 2, 3, 4, 7]))
+        self.assertEqual([(4, 0), (7, 1), (2, 3), (1, 5), (3, 5)], result[0])
+        self.assertEqual(('(', ')'), result[1:3])
+
+    def test_rank_by_method_data_loaded_once(self):
+        """bibrank record sorter - ranking data stays loaded"""
+        from intbitset import intbitset
+        self.rank_by_method(intbitset([1, 2]))
+        self.rank_by_method(intbitset([3, 7]))
+        self.assertEqual(1, len([query for query in self.queries
+                                 if 'relevance_data' in query]))
+        self.assertEqual([], [query for query in self.queries
+                              if 'last_updated' in query])
+
+    def test_rank_by_method_recid_range(self):
+        """bibrank record sorter - ranking records in given range"""
+        from intbitset import intbitset
+        result = self.rank_by_method(intbitset([1, 2, 3, 4, 7]),
+                                     ['recid:2->5'])
+        self.assertEqual([(4, 0), (2, 3), (3, 5)], result[0])
+
+TEST_SUITE = make_test_suite(TestListSetOperations,
+                             TestRankByMethod,)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
@@ -51,6 +51,17 @@ class BibRecordSuccessTest(InvenioTestCase):
         """ bibrecord - demo file how many records are created """
         self.assertEqual(142, len(self.recs))
 
+    def test_records_iterated(self):
+        """ bibrecord - demo file records created while streaming it """
+        from StringIO import StringIO
+        xmltext = pkg_resources.resource_string('invenio.testsuite',
+                os.path.join('data', 'demo_record_marc_data.xml'))
+        self.assertEqual(142, bibrecord.count_records(StringIO(xmltext),
+                                                      chunk_size=4096))
+        recs = [rec[0] for rec in
+                bibrecord.iter_records(StringIO(xmltext), chunk_size=4096)]
+        self.assertEqual(self.recs, recs)
+
     def test_tags_created(self):
         """ bibrecord - demo file which tags are created """
         ## check if the tags are correct
@@ -607,6 +618,39 @@ class BibRecordGettingFieldValuesViaWildcardsTest(InvenioTestCase):
         self.assertEqual(bibrecord.record_get_field_value(self.rec, "55%", " ", " ", "a"),
                          'val4a')
 
+class BibRecordGettingFieldValuesOfRecordsTest(InvenioTestCase):
+    """ bibrecord - testing for getting field values of many records """
+
+    def setUp(self):
+        """Prepare the rows returned by the database."""
+        self.queries = []
+        self.rows = {'bib10x': [(1, '100__a', 'Ellis, J'),
+                                (3, '100__u', 'CERN'),
+                                (1, '100__u', 'CERN'),
+                                (3, '100__a', 'Smith, J')],
+                     'bib70x': [(2, '700__a', 'Ellis, J')]}
+
+    def run_sql(self, query, param=None):
+        self.queries.append((query, param))
+        table = query.split(' FROM ')[1].split()[0]
+        return [row for row in self.rows[table] if row[0] in param]
+
+    def test_get_fieldvalues_of_records(self):
+        """bibrecord - getting field values of many records"""
+        from mock import patch
+        with patch('invenio.legacy.bibrecord.run_sql', self.run_sql):
+            values = bibrecord.get_fieldvalues_of_records(
+                [1, 2, 3], ['100__a', '100__u', '700__a', '001___'],
+                chunk_size=2)
+        self.assertEqual({'100__a': {1: ['Ellis, J'], 3: ['Smith, J']},
+                          '100__u': {1: ['CERN'], 3: ['CERN']},
+                          '700__a': {2: ['Ellis, J']},
+                          '001___': {1: ['1'], 2: ['2'], 3: ['3']}},
+                         values)
+        # one query per table and chunk of records
+        self.assertEqual(4, len(self.queries))
+
+
 class BibRecordAddFieldTest(InvenioTestCase):
     """ bibrecord - testing adding field """
 
@@ -1718,6 +1762,7 @@ TEST_SUITE = make_test_suite(
     BibRecordBadInputTreatmentTest,
     BibRecordGettingFieldValuesTest,
     BibRecordGettingFieldValuesViaWildcardsTest,
+    BibRecordGettingFieldValuesOfRecordsTest,
     BibRecordAddFieldTest,
     BibRecordDeleteFieldTest,
     BibRecordManageMultipleFieldsTest,
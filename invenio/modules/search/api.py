@@ -19,10 +19,13 @@
 
 """Search engine API."""
 
+import threading
+
+from collections import OrderedDict
+
 import pypeg2
 import six
 
-from flask import g
 from flask_login import current_user
 from invenio.base.globals import cfg
 from werkzeug.utils import cached_property, import_string
@@ -30,18 +33,55 @@ from werkzeug.utils import cached_property, import_string
 from .walkers.match_unit import MatchUnit
 from .walkers.terms import Terms
 
+_imported_objects = {}
+
+_query_trees = OrderedDict()
+_query_trees_lock = threading.Lock()
+
+
+def import_objects(objects):
+    """Return tuple of objects with import strings resolved only once."""
+    key = tuple(objects)
+    try:
+        return _imported_objects[key]
+    except KeyError:
+        value = tuple(import_string(obj)
+                      if isinstance(obj, six.string_types) else obj
+                      for obj in objects)
+        _imported_objects[key] = value
+        return value
+
 
 def query_enhancers():
     """Return list of query enhancers."""
-    functions = getattr(g, 'search_query_enhancers', None)
-    if functions is None:
-        functions = []
-        for enhancer in cfg['SEARCH_QUERY_ENHANCERS']:
-            if isinstance(enhancer, six.string_types):
-                enhancer = import_string(enhancer)
-                functions.append(enhancer)
-        setattr(g, 'search_query_enhancers', functions)
-    return functions
+    return import_objects(cfg['SEARCH_QUERY_ENHANCERS'])
+
+
+def parse_query(query, parser, walkers):
+    """Parse query string and apply all walkers on the resulting tree.
+
+    Trees are kept in a process-wide cache of at most
+    ``SEARCH_QUERY_CACHE_SIZE`` entries keyed by the query string, parser
+    and walkers; they are shared and must not be modified by the callers.
+    """
+    max_size = cfg['SEARCH_QUERY_CACHE_SIZE']
+    key = (query, parser, walkers)
+    with _query_trees_lock:
+        tree = _query_trees.pop(key, None)
+        if tree is not None:
+            _query_trees[key] = tree
+            return tree
+
+    tree = pypeg2.parse(query, import_objects([parser])[0], whitespace="")
+    for walker in import_objects(walkers):
+        tree = tree.accept(walker())
+
+    if max_size > 0:
+        with _query_trees_lock:
+            _query_trees[key] = tree
+            while len(_query_trees) > max_size:
+                _query_trees.popitem(last=False)
+    return tree
 
 
 class SearchEngine(object):
@@ -54,20 +94,13 @@ class SearchEngine(object):
 
     @cached_property
     def parser(self):
-        query_parser = cfg['SEARCH_QUERY_PARSER']
-        if isinstance(query_parser, six.string_types):
-            query_parser = import_string(query_parser)
-        return query_parser
+        return import_objects([cfg['SEARCH_QUERY_PARSER']])[0]
 
     @cached_property
     def query(self):
         """Parse query string using given grammar."""
-        tree = pypeg2.parse(self._query, self.parser, whitespace="")
-        for walker in cfg['SEARCH_QUERY_WALKERS']:
-            if isinstance(walker, six.string_types):
-                walker = import_string(walker)
-            tree = tree.accept(walker())
-        return tree
+        return parse_query(self._query, cfg['SEARCH_QUERY_PARSER'],
+                           tuple(cfg['SEARCH_QUERY_WALKERS']))
 
     def search(self, user_info=None, collection=None):
         """Search records."""
@@ -78,8 +111,9 @@ class SearchEngine(object):
             query = enhancer(query, user_info=user_info,
                              collection=collection)
 
+        from invenio.modules.search.walkers.query_planner import QueryPlanner
         from invenio.modules.search.walkers.search_unit import SearchUnit
-        return query.accept(SearchUnit())
+        return query.accept(QueryPlanner()).accept(SearchUnit())
 
     def match(self, record, user_info=None):
         """Return True if record match the query."""
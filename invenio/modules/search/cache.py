@@ -19,12 +19,21 @@
 
 """Implementation of search results caching."""
 
+import re
+import threading
+import time
+
+from collections import OrderedDict
+
 from intbitset import intbitset
 from flask import current_app
+from six import iteritems
 
 from invenio.base.globals import cfg
 from invenio.ext.cache import cache
-from invenio.legacy.miscutil.data_cacher import DataCacher, DataCacherProxy
+from invenio.legacy.dbquery import run_sql
+from invenio.legacy.miscutil.data_cacher import DataCacher, \
+    DataCacherProxy, get_table_version
 from invenio.utils.hash import md5
 
 from .models import Field, Fieldname
@@ -121,8 +130,7 @@ class FieldI18nNameDataCacher(DataCacher):
             return ret
 
         def timestamp_verifier():
-            from invenio.legacy.dbquery import get_table_update_time
-            return get_table_update_time('fieldname')
+            return get_table_version('fieldname')
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
@@ -149,3 +157,317 @@ def get_field_i18nname(f, ln=None, verify_cache_timestamp=True):
     except KeyError:
         pass  # translation in LN does not exist
     return out
+
+
+def get_index_last_updated_timestamps():
+    """Return dictionary of index identifiers and their last update time."""
+    from invenio.modules.indexer.models import IdxINDEX
+    return dict(IdxINDEX.query.values(IdxINDEX.id, IdxINDEX.last_updated))
+
+
+class HitlistCache(object):
+
+    """Provide bounded in-process cache of index term hitlists.
+
+    Entries are keyed by index table name and term and evicted in least
+    recently used order once their estimated memory footprint exceeds
+    ``CFG_WEBSEARCH_HITLIST_CACHE_SIZE`` bytes.  Entries belonging to an
+    index are dropped as soon as the ``last_updated`` timestamp of the index,
+    set by the indexer via ``update_index_last_updated``, changes.  The
+    timestamps are checked at most once per
+    ``CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL`` seconds.
+
+    This class is not to be used directly; use function get_term_hitset()
+    instead.
+    """
+
+    def __init__(self, max_size=None, check_interval=None,
+                 timestamp_verifier=get_index_last_updated_timestamps):
+        """Initialize empty cache.
+
+        :param max_size: maximal size of the cache in bytes; defaults to
+            ``CFG_WEBSEARCH_HITLIST_CACHE_SIZE``
+        :param check_interval: number of seconds between timestamp checks;
+            defaults to ``CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL``
+        :param timestamp_verifier: function returning a dictionary of index
+            identifiers and their last update time
+        """
+        self._max_size = max_size
+        self._check_interval = check_interval
+        self.timestamp_verifier = timestamp_verifier
+        self.timestamps = {}
+        self.last_check = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_size(self):
+        """Return maximal size of the cache in bytes."""
+        if self._max_size is None:
+            return cfg['CFG_WEBSEARCH_HITLIST_CACHE_SIZE']
+        return self._max_size
+
+    @property
+    def check_interval(self):
+        """Return number of seconds between two timestamp checks."""
+        if self._check_interval is None:
+            return cfg['CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL']
+        return self._check_interval
+
+    @staticmethod
+    def get_index_id(table):
+        """Return index identifier from table name, e.g. ``idxWORD01F``."""
+        match = re.match(r'idx[A-Z]+(\d+)[FR]$', table)
+        return int(match.group(1)) if match else None
+
+    @staticmethod
+    def estimate_size(hitset):
+        """Return approximate number of bytes used by the hitset."""
+        if not hitset:
+            return 64
+        # intbitset allocates one bit per recid up to the largest one
+        return 64 + (hitset[-1] >> 3)
+
+    def __len__(self):
+        """Return number of cached terms."""
+        return len(self._entries)
+
+    def __contains__(self, key):
+        """Check if (table, term) key is cached."""
+        return key in self._entries
+
+    def get(self, table, term):
+        """Return cached hitset or None; the hitset must not be modified."""
+        self.verify_timestamps()
+        key = (table, term)
+        with self._lock:
+            try:
+                hitset, size = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = (hitset, size)
+        return hitset
+
+    def set(self, table, term, hitset):
+        """Store the hitset of the term, evicting old entries if needed."""
+        size = self.estimate_size(hitset)
+        if size > self.max_size:
+            return
+        key = (table, term)
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (hitset, size)
+            self.size += size
+            while self.size > self.max_size:
+                dummy_key, (dummy_hitset, old_size) = \
+                    self._entries.popitem(last=False)
+                self.size -= old_size
+
+    def invalidate(self, index_ids=None):
+        """Drop cached terms of given indexes (all when not specified)."""
+        with self._lock:
+            if index_ids is None:
+                self._entries.clear()
+                self.size = 0
+                return
+            for key in list(self._entries):
+                if self.get_index_id(key[0]) in index_ids:
+                    self.size -= self._entries.pop(key)[1]
+
+    def verify_timestamps(self):
+        """Drop terms of indexes updated since the previous check."""
+        now = time.time()
+        if now - self.last_check < self.check_interval:
+            return
+        self.last_check = now
+        timestamps = self.timestamp_verifier()
+        if self.timestamps:
+            changed = set(index_id for index_id, last_updated
+                          in timestamps.items()
+                          if self.timestamps.get(index_id) != last_updated)
+            changed.update(set(self.timestamps) - set(timestamps))
+            if changed:
+                self.invalidate(changed)
+        self.timestamps = timestamps
+
+hitlist_cache = HitlistCache()
+
+
+def get_term_hitset(model, term, loader):
+    """Return hitset of the term in index table represented by model.
+
+    The hitset is taken from the hitlist cache if possible, otherwise it is
+    computed by calling ``loader()`` and stored in the cache.  A copy is
+    returned so that callers are free to modify it in place.
+    """
+    if hitlist_cache.max_size <= 0:
+        return loader()
+    table = model.__tablename__
+    hitset = hitlist_cache.get(table, term)
+    if hitset is not None:
+        return intbitset(hitset)
+    hitset = loader()
+    hitlist_cache.set(table, term, intbitset(hitset))
+    return hitset
+
+
+def get_field_values_recids(tags, recids=None):
+    """Return dictionary of the values of TAGS and their records.
+
+    :param tags: list of tags, possibly with SQL wildcards
+    :param recids: if given, only the values of these records are read
+    """
+    values = {}
+    if recids is not None:
+        from invenio.legacy.bibrecord import get_fieldvalues_of_records
+        for tag_values in get_fieldvalues_of_records(recids, tags).values():
+            for recid, record_values in iteritems(tag_values):
+                for value in record_values:
+                    values.setdefault(value, intbitset()).add(recid)
+        return values
+    for tag in tags:
+        digits = tag[0:2]
+        try:
+            intdigits = int(digits)
+            if intdigits < 0 or intdigits > 99:
+                raise ValueError
+        except ValueError:
+            # invalid tag value asked for
+            continue
+        query = "SELECT bibx.id_bibrec, bx.value " \
+                "FROM bib%sx AS bx, bibrec_bib%sx AS bibx " \
+                "WHERE bx.id=bibx.id_bibxxx AND bx.tag LIKE %%s" % \
+                (digits, digits)
+        for recid, value in run_sql(query, (tag, )):
+            values.setdefault(value, intbitset()).add(recid)
+    return values
+
+
+def get_values_by_size(values):
+    """Return the values sorted by descending number of records."""
+    return sorted(values, key=lambda value: len(values[value]), reverse=True)
+
+
+def get_record_values(values):
+    """Return the dictionary of the list of values of every record."""
+    record_values = {}
+    for value, recids in iteritems(values):
+        for recid in recids:
+            record_values.setdefault(recid, []).append(value)
+    return record_values
+
+
+class FacetIndexDataCacher(DataCacher):
+
+    """Provide value to records index of a facet.
+
+    The cache holds the ``values`` dictionary of the values of the tags of
+    the facet field and their records, and the ``values_by_size`` list of
+    the values in descending order of number of records.  When records are
+    modified, only their values are read again and the index is patched.
+    To this end, unless the cache is shared, it also holds the
+    ``record_values`` dictionary of the values of every record, so that
+    only the values of the modified records are touched.
+
+    This class is not to be used directly; use function get_facet_index()
+    instead.
+    """
+
+    def __init__(self, facet_name):
+        self.facet_name = facet_name
+
+        def cache_filler():
+            values = get_field_values_recids(self.get_tags())
+            return {'values': values,
+                    'values_by_size': get_values_by_size(values)}
+
+        def timestamp_verifier():
+            return get_table_version('bibrec')
+
+        DataCacher.__init__(self, cache_filler, timestamp_verifier)
+
+    @property
+    def name(self):
+        """Return name of the cache, used e.g. for its shared file."""
+        return self.__class__.__name__ + '_' + self.facet_name
+
+    def get_tags(self):
+        """Return tags of the facet field."""
+        return list(Field.get_field_tags(self.facet_name))
+
+    def create_cache(self):
+        """Fill the cache, stamped with the time the fill started.
+
+        Records modified while the cache is filled are thus indexed again
+        by the next update.
+        """
+        if self.shared_p:
+            return DataCacher.create_cache(self)
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        cache = self.cache_filler()
+        cache['record_values'] = get_record_values(cache['values'])
+        self.cache = cache
+        self.timestamp = timestamp
+
+    def update_cache(self):
+        """Index again the records modified since the cache was filled.
+
+        The values of the modified records are patched in copies, which
+        replace the cache as a whole, so that concurrent readers keep a
+        consistent index.  The previous values of the modified records are
+        found in ``record_values``, which is only used by the updates and
+        is patched in place.  Return False if the cache cannot be updated.
+        """
+        if self.shared_p or 'record_values' not in self.cache:
+            return False
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+        modified = intbitset(run_sql(
+            "SELECT id FROM bibrec WHERE modification_date>=%s",
+            (self.timestamp, )))
+        if modified:
+            values = dict(self.cache['values'])
+            record_values = self.cache['record_values']
+            removed = {}
+            for recid in modified:
+                for value in record_values.pop(recid, ()):
+                    removed.setdefault(value, intbitset()).add(recid)
+            for value, recids in iteritems(removed):
+                recids = values.get(value, intbitset()) - recids
+                if recids:
+                    values[value] = recids
+                else:
+                    values.pop(value, None)
+            for value, recids in iteritems(
+                    get_field_values_recids(self.get_tags(), modified)):
+                if value in values:
+                    values[value] = values[value] | recids
+                else:
+                    values[value] = recids
+                for recid in recids:
+                    record_values.setdefault(recid, []).append(value)
+            self.cache = {'values': values,
+                          'values_by_size': get_values_by_size(values),
+                          'record_values': record_values}
+        self.timestamp = timestamp
+        return True
+
+    def recreate_cache_if_needed(self):
+        """Update the cache if needed, patching it when possible."""
+        if self.timestamp_verifier() > self.timestamp:
+            if not self.update_cache():
+                self.create_cache()
+
+_facet_index_cachers = {}
+
+
+def get_facet_index(facet_name):
+    """Return the facet index of the facet, see FacetIndexDataCacher."""
+    cacher = _facet_index_cachers.get(facet_name)
+    if cacher is None:
+        cacher = _facet_index_cachers[facet_name] = \
+            FacetIndexDataCacher(facet_name)
+    else:
+        cacher.recreate_cache_if_needed()
+    return cacher.cache
@@ -28,6 +28,11 @@ SEARCH_QUERY_WALKERS = [
     'invenio_query_parser.walkers.pypeg_to_ast:PypegConverter',
 ]
 
+# SEARCH_QUERY_CACHE_SIZE -- maximal number of parsed query trees kept in
+# memory by every process, so that repeated queries are not parsed again.
+# Set to 0 to disable.
+SEARCH_QUERY_CACHE_SIZE = 1000
+
 # SEARCH_QUERY_ENHANCERS -- a comma separated list of strings. Each string is a
 # function that is applied to the AST generated by the parser and enhances the
 # query tree
@@ -54,6 +59,11 @@ CFG_WEBSEARCH_IDXPAIRS_FIELDS = ['global', 'abstract', 'title', 'caption']
 # title search, but True for report number search.
 CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH = False
 
+# CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH_CHUNK_SIZE -- number of records whose
+# phrase termlists are fetched by one query while eliminating the false
+# positives of the word pairs search.
+CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH_CHUNK_SIZE = 1000
+
 # Maximum number of collections to be displayed on the search results
 # page. All the rest of the collections will be hidden by a
 # "See more collections" link.
@@ -160,3 +170,14 @@ CFG_WEBSEARCH_MAX_RECORDS_CITEDBY = 50000
 # SEARCH_ELASTIC_KEYWORD_MAPPING -- this variable holds a dictionary to map
 # invenio keywords to elasticsearch fields
 SEARCH_ELASTIC_KEYWORD_MAPPING = None
+
+# CFG_WEBSEARCH_HITLIST_CACHE_SIZE -- upper bound (in bytes) on the memory
+# used by the per-process cache of index term hitlists.  Hot terms are served
+# from this cache instead of re-reading and deserializing their hitlist from
+# the idxWORDxxF, idxPHRASExxF and idxPAIRxxF tables.  Set to 0 to disable.
+CFG_WEBSEARCH_HITLIST_CACHE_SIZE = 64 * 1024 * 1024
+
+# CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL -- how often (in seconds) the
+# hitlist cache checks the `last_updated' timestamps of the indexes in order
+# to drop terms of indexes that have been updated by bibindex.
+CFG_WEBSEARCH_HITLIST_CACHE_CHECK_INTERVAL = 10
@@ -26,21 +26,39 @@ class CacheOp(object):
 
     """Store results in cache."""
 
-    def __init__(self, query, collection=None):
+    def __init__(self, query, collection=None, key=None):
         """Define query that should be cached."""
         self.query = query
         self.collection = collection
+        self._key = key
+
+    @property
+    def key(self):
+        """Return cache key of the query."""
+        if self._key is None:
+            self._key = str(self.query)
+        return self._key
 
     def __repr__(self):
         """Object representation."""
         return "%s(%s)" % (self.__class__.__name__, repr(self.query))
 
     def accept(self, visitor):
-        """Store intermediate results to the cache."""
-        results = get_results_cache(str(self.query), self.collection)
+        """Store intermediate results to the cache.
+
+        Visitors defining a ``CacheOp`` method, e.g. the query planner, are
+        handed the node with its query unevaluated.
+        """
+        try:
+            type(visitor).visitor[CacheOp]
+        except (AttributeError, KeyError):
+            pass
+        else:
+            return visitor.visit(self, self.query)
+        results = get_results_cache(self.key, self.collection)
         if results is None:
             results = self.query.accept(visitor)
-            set_results_cache(results, str(self.query), self.collection)
+            set_results_cache(results, self.key, self.collection)
         return results
 
 
@@ -102,15 +102,25 @@ def apply(query, user_info=None, collection=None):
     Get the permitted restricted collection for the current user from the
     user_info object and all the restriced collections from the
     restricted_collection_cache.
+
+    The current collection and the records hidden by the not permitted
+    collections are represented by
+    :class:`~invenio.modules.search.walkers.query_planner.CollectionOp` and
+    :class:`~invenio.modules.search.walkers.query_planner.RestrictedRecordsOp`
+    nodes, which are resolved from the collection caches.
     """
     from invenio.modules.collections.cache import restricted_collection_cache
+    from invenio.modules.search.walkers.query_planner import (
+        CollectionOp, RestrictedRecordsOp
+    )
 
     policy = cfg['CFG_WEBSEARCH_VIEWRESTRCOLL_POLICY'].strip().upper()
     restricted_cols = restricted_collection_cache.cache
     permitted_restricted_cols = user_info.get(
         'precached_permitted_restricted_collections', [])
     current_col = collection or cfg['CFG_SITE_NAME']
-    result_tree = create_collection_query(restricted_cols,
-                                          permitted_restricted_cols,
-                                          current_col, policy)
+    result_tree = CollectionOp(current_col)
+    if set(restricted_cols) - set(permitted_restricted_cols):
+        result_tree = AndOp(result_tree, NotOp(RestrictedRecordsOp(
+            permitted_restricted_cols, policy)))
     return AndOp(query, result_tree)
@@ -19,6 +19,8 @@
 
 """Facet utility functions."""
 
+import heapq
+
 from flask import g, url_for, request
 from flask_login import current_user
 from intbitset import intbitset
@@ -31,14 +33,11 @@ from invenio.modules.collections.cache import get_collection_reclist
 from invenio.modules.collections.models import Collection
 
 from .cache import (
+    get_facet_index,
     get_search_results_cache_key_from_qid,
     search_results_cache,
 )
-from .models import Field
-from .utils import (
-    get_most_popular_field_values,
-    get_records_that_can_be_displayed,
-)
+from .utils import get_records_that_can_be_displayed
 
 
 def get_current_user_records_that_can_be_displayed(qid):
@@ -104,12 +103,49 @@ def faceted_results_filter(recids, filter_data, facets):
     return output
 
 
+def get_most_popular_facet_values(facet_index, recids, limit=20):
+    """Return the values of the facet index with the most records in RECIDS.
+
+    The values are tried in descending order of their total number of
+    records, and the counting stops as soon as no remaining value can have
+    more records in RECIDS than the LIMIT-th value found so far.
+
+    :param facet_index: facet index as returned by `get_facet_index`
+    :param recids: records as intbitset
+    :param limit: number of values to return
+
+    :return: list of (value, number of records) tuples sorted by descending
+        number of records and then by lowercased value
+    """
+    values = facet_index['values']
+    counts = []
+    # the LIMIT highest counts found so far
+    top_counts = []
+    for value in facet_index['values_by_size']:
+        value_recids = values[value]
+        if len(top_counts) == limit and \
+                min(len(value_recids), len(recids)) < top_counts[0]:
+            break
+        count = len(value_recids & recids)
+        if not count:
+            continue
+        if len(top_counts) < limit:
+            heapq.heappush(top_counts, count)
+        elif count >= top_counts[0]:
+            heapq.heappushpop(top_counts, count)
+        else:
+            continue
+        counts.append((value, count))
+    counts.sort(key=lambda item: (-item[1], item[0].lower()))
+    return counts[0:limit]
+
+
 class FacetBuilder(object):
 
     """Facet builder helper class.
 
-    Implement a general facet builder using function
-    `get_most_popular_field_values`.
+    Implement a general facet builder counting the records of the values
+    of the facet index (see `get_facet_index`) among the found records.
     """
 
     def __init__(self, name):
@@ -143,16 +179,14 @@ class FacetBuilder(object):
 
     def get_facets_for_query(self, qid, limit=20, parent=None):
         """Return facet data."""
-        return get_most_popular_field_values(
-            self.get_recids(qid), Field.get_field_tags(self.name)
-        )[0:limit]
+        return get_most_popular_facet_values(
+            get_facet_index(self.name), self.get_recids_intbitset(qid), limit)
 
     def get_value_recids(self, value):
         """Return record ids in intbitset for given field value."""
-        from .searchext.engines.native import search_unit
         if isinstance(value, unicode):
             value = value.encode('utf8')
-        return search_unit(p=value, f=self.name, m='e')
+        return intbitset(get_facet_index(self.name)['values'].get(value, []))
 
     def get_facet_recids(self, values):
         """Return record ids in intbitset for all field values."""
@@ -195,3 +229,10 @@ class CollectionFacetBuilder(FacetBuilder):
             if num_records:
                 facet.append((c.name, num_records, c.name_ln))
         return sorted(facet, key=lambda x: x[1], reverse=True)[0:limit]
+
+    def get_value_recids(self, value):
+        """Return record ids in intbitset for given collection."""
+        from .searchext.engines.native import search_unit
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        return search_unit(p=value, f=self.name, m='e')
@@ -31,6 +31,7 @@ from invenio.modules.indexer.models import IdxINDEX
 from invenio.modules.indexer.utils import field_tokenizer_cache
 from invenio.modules.records import models
 from invenio.modules.records.models import Record
+from invenio.modules.search.cache import get_term_hitset, hitlist_cache
 from invenio.modules.search.errors import InvenioWebSearchWildcardLimitError
 from invenio.modules.search.models import Field
 from invenio.modules.search.registry import units
@@ -114,6 +115,14 @@ def search_unit(p, f=None, m=None, wl=0, ignore_synonyms=None):
     return hitset
 
 
+def load_hitset(query):
+    """Return union of all hitlists selected by the index table query."""
+    hitset = intbitset()
+    for row in query.values('hitlist'):
+        hitset |= intbitset(row[0])
+    return hitset
+
+
 def is_marc_tag(f):
     """Return True if the field a MARC tag, e.g. ``980__a``."""
     return f and len(f) >= 2 and str(f[0]).isdigit() and str(f[1]).isdigit()
@@ -139,16 +148,46 @@ def default_search_unit(p, f, m, wl):
     return hitset
 
 
+def wash_word(word, stemming_language):
+    """Return word as stored in the word index, keeping its truncation."""
+    from invenio.legacy.bibindex.engine_stemmer import stem
+    from invenio.legacy.bibindex.engine_washer import lower_index_term
+    word = re_word.sub('', word)
+    if stemming_language:
+        word = lower_index_term(word)
+        # We remove trailing truncation character before stemming
+        if word.endswith('%'):
+            word = stem(word[:-1], stemming_language) + '%'
+        else:
+            word = stem(word, stemming_language)
+    return word
+
+
+def get_cached_word_cardinality(word, f):
+    """Return number of records containing WORD if its hitlist is cached.
+
+    Only the exact word lookups of ``search_unit_in_bibwords``, i.e. the ones
+    served by the hitlist cache, are considered; None is returned for other
+    queries and for words that are not cached.
+    """
+    from invenio.legacy.bibindex.engine_washer import wash_index_term
+    if not len(hitlist_cache) or f in units or is_marc_tag(f) or \
+            '*' in word or '%' in word or '->' in word:
+        return None
+    index = IdxINDEX.get_from_field(f or 'anyfield')
+    if index is None or index.wordf is None:
+        return None
+    term = wash_index_term(wash_word(word, index.stemming_language))
+    hitset = hitlist_cache.get(index.wordf.__tablename__, term)
+    return None if hitset is None else len(hitset)
+
+
 def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
     """Search for 'word' inside bibwordsX table for field 'f'.
 
     :return: hitset of recIDs.
     """
-    from invenio.legacy.bibindex.engine_stemmer import stem
-    from invenio.legacy.bibindex.engine_washer import (
-        lower_index_term,
-        wash_index_term,
-    )
+    from invenio.legacy.bibindex.engine_washer import wash_index_term
     # FIXME: Should not be used for journal field.
     hitset = intbitset()  # will hold output result set
     limit_reached = 0  # flag for knowing if the query limit has been reached
@@ -168,21 +207,8 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
     word = word.replace('*', '%')  # we now use '*' as the truncation character
     words = word.split("->", 1)  # check for span query
     if len(words) == 2:
-        word0 = re_word.sub('', words[0])
-        word1 = re_word.sub('', words[1])
-        if stemming_language:
-            word0 = lower_index_term(word0)
-            word1 = lower_index_term(word1)
-            # We remove trailing truncation character before stemming
-            if word0.endswith('%'):
-                word0 = stem(word0[:-1], stemming_language) + '%'
-            else:
-                word0 = stem(word0, stemming_language)
-            if word1.endswith('%'):
-                word1 = stem(word1[:-1], stemming_language) + '%'
-            else:
-                word1 = stem(word1, stemming_language)
-
+        word0 = wash_word(words[0], stemming_language)
+        word1 = wash_word(words[1], stemming_language)
         word0_washed = wash_index_term(word0)
         word1_washed = wash_index_term(word1)
         if f.endswith('count'):
@@ -202,14 +228,7 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
         if wl > 0 and len(res) == wl:
             limit_reached = 1  # set the limit reached flag to true
     else:
-        word = re_word.sub('', word)
-        if stemming_language:
-            word = lower_index_term(word)
-            # We remove trailing truncation character before stemming
-            if word.endswith('%'):
-                word = stem(word[:-1], stemming_language) + '%'
-            else:
-                word = stem(word, stemming_language)
+        word = wash_word(word, stemming_language)
         if word.find('%') >= 0:  # do we have wildcard in the word?
             query = model.query.filter(model.term.like(wash_index_term(word)))
             if wl > 0:
@@ -218,9 +237,11 @@ def search_unit_in_bibwords(word, f, decompress=zlib.decompress, wl=0):
             # set the limit reached flag to true
             limit_reached = wl > 0 and len(res) == wl
         else:
-            res = model.query.filter(
-                model.term.like(wash_index_term(word))
-            ).values('term', 'hitlist')
+            # exact term lookups are served from the hitlist cache
+            word = wash_index_term(word)
+            res = []
+            hitset = get_term_hitset(model, word, lambda: load_hitset(
+                model.query.filter(model.term.like(word))))
     # fill the result set:
     for word, hitlist in res:
         # add the results:
@@ -242,7 +263,7 @@ def search_unit_in_idxpairs(p, f, m, wl=0):
     limit_reached = False
     # flag to know when it makes sense to try to do exact matching
     do_exact_search = True
-    result_set = intbitset()
+    result_set = None
     # determine the idxPAIR table to read from
     index = IdxINDEX.get_from_field(f)
     if index is None:
@@ -253,6 +274,8 @@ def search_unit_in_idxpairs(p, f, m, wl=0):
     pairs_tokenizer = BibIndexDefaultTokenizer(stemming_language)
 
     conditions = []
+    # pairs that have to be matched exactly
+    exact_pairs = []
 
     if p.startswith("%") and p.endswith("%"):
         p = p[1:-1]
@@ -286,8 +309,7 @@ def search_unit_in_idxpairs(p, f, m, wl=0):
                 (column.between(pairs_left[-1], pairs_right[-1]), True)
             )
             # which should be equal with pairs_right[:-1]
-            for pair in pairs_left[:-1]:
-                conditions.append((column == pair, False))
+            exact_pairs.extend(pairs_left[:-1])
         do_exact_search = False  # no exact search for span queries
     elif p.find('%') > -1:
         # tokenizing p will remove the '%', so we have to make sure it stays
@@ -304,7 +326,7 @@ def search_unit_in_idxpairs(p, f, m, wl=0):
                 pair = pair.replace(replacement, '%')
                 conditions.append((column.like(pair), True))
             else:
-                conditions.append((column == pair, False))
+                exact_pairs.append(pair)
         do_exact_search = False
     else:
         # normal query
@@ -312,8 +334,18 @@ def search_unit_in_idxpairs(p, f, m, wl=0):
         if not pairs:
             # we are not actually dealing with pairs but with words
             return search_unit_in_bibwords(original_pattern, f, wl=wl)
-        for pair in pairs:
-            conditions.append((column == pair, False))
+        exact_pairs.extend(pairs)
+
+    for pair in exact_pairs:
+        # exact pair lookups are served from the hitlist cache
+        hitset_idxpairs = get_term_hitset(model, pair, lambda: load_hitset(
+            model.query.filter(column == pair)))
+        if not hitset_idxpairs:
+            return intbitset()
+        if result_set is None:
+            result_set = hitset_idxpairs
+        else:
+            result_set.intersection_update(hitset_idxpairs)
 
     for condition, use_query_limit in conditions:
         query = model.query.filter(condition)
@@ -336,24 +368,40 @@ def search_unit_in_idxpairs(p, f, m, wl=0):
 
     # check if we need to eliminate the false positives
     if cfg['CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH'] and do_exact_search:
-        # we need to eliminate the false positives
-        model = IdxINDEX.idxPHRASER(f)
-        not_exact_search = intbitset()
-        for recid in result_set:
-            res = model.query.filter(model.id_bibrec == recid).value(
-                model.termlist)
-            if res:
-                termlist = deserialize_via_marshal(res)
-                if not [term for term in termlist
-                        if term.lower().find(p.lower()) > -1]:
-                    not_exact_search.add(recid)
-            else:
-                not_exact_search.add(recid)
-        # remove the recs that are false positives from the final result
-        result_set.difference_update(not_exact_search)
+        result_set = get_exact_phrase_matches(p, f, result_set)
     return result_set or intbitset()
 
 
+def get_exact_phrase_matches(p, f, recids):
+    """Return subset of RECIDS having a phrase containing 'p' in field 'f'.
+
+    The phrase termlists are read from the idxPHRASExxR table by chunks of
+    ``CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH_CHUNK_SIZE`` records, using a range
+    scan for dense chunks and an IN-list for sparse ones, and deserialized
+    one row at a time.
+    """
+    model = IdxINDEX.idxPHRASER(f)
+    chunk_size = cfg['CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH_CHUNK_SIZE']
+    p = p.lower()
+    result = intbitset()
+    recids_list = recids.tolist()
+    for i in range(0, len(recids_list), chunk_size):
+        chunk = recids_list[i:i + chunk_size]
+        if chunk[-1] - chunk[0] < 2 * len(chunk):
+            condition = model.id_bibrec.between(chunk[0], chunk[-1])
+        else:
+            condition = model.id_bibrec.in_(chunk)
+        query = model.query.filter(condition, model.type == 'CURRENT')
+        for recid, termlist in query.values(model.id_bibrec, model.termlist):
+            if recid not in recids or not termlist:
+                continue
+            for term in deserialize_via_marshal(termlist):
+                if term.lower().find(p) > -1:
+                    result.add(recid)
+                    break
+    return result
+
+
 def search_unit_in_idxphrases(p, f, m, wl=0):
     """Searche for phrase 'p' inside idxPHRASE*F table for field 'f'.
 
@@ -389,7 +437,9 @@ def search_unit_in_idxphrases(p, f, m, wl=0):
                 use_query_limit = True
                 column_filter = lambda column: column.like(p)
             else:
-                column_filter = lambda column: column == p
+                # exact phrase lookups are served from the hitlist cache
+                return get_term_hitset(model, p, lambda: load_hitset(
+                    model.query.filter(model.term == p)))
 
     # special washing for fuzzy author index:
     # if f in ('author', 'firstauthor', 'exactauthor', 'exactfirstauthor',
@@ -22,9 +22,8 @@
 import re
 from invenio.config import CFG_SITE_LANG
 from invenio.modules.knowledge.api import get_kb_mappings
-from invenio.legacy.miscutil.data_cacher import DataCacher
+from invenio.legacy.miscutil.data_cacher import DataCacher, get_table_version
 from invenio.legacy.bibindex.engine_stemmer import stem
-from invenio.legacy.dbquery import get_table_update_time
 from invenio.base.i18n import gettext_set_language
 from invenio.legacy import template
 
@@ -297,7 +296,7 @@ class KnowledgeBaseService(ListLinksService):
         :return: string-formatted time ``'%Y-%m-%d %H:%M:%S'``
         """
         # This is an approximation...
-        return get_table_update_time('knwKBRVAL')
+        return get_table_version('knwKBRVAL')
 
 re_split_words_pattern = re.compile('\s*')
 re_non_alphanum_only = re.compile('\W')
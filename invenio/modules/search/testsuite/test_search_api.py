@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the search engine API."""
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
+
+api = lazy_import('invenio.modules.search.api')
+
+
+class TestParsedQueryCache(InvenioTestCase):
+
+    """Test caching of parsed query trees."""
+
+    def test_same_tree(self):
+        """search api - repeated queries are parsed only once"""
+        first = api.SearchEngine('title:higgs and author:ellis').query
+        second = api.SearchEngine('title:higgs and author:ellis').query
+        self.assertTrue(first is second)
+        self.assertFalse(first is api.SearchEngine('title:higgs').query)
+
+    def test_cache_size(self):
+        """search api - number of cached query trees is bounded"""
+        self.app.config['SEARCH_QUERY_CACHE_SIZE'] = 2
+        for word in ('alpha', 'beta', 'gamma'):
+            api.SearchEngine(word).query
+        self.assertTrue(len(api._query_trees) <= 2)
+
+
+TEST_SUITE = make_test_suite(TestParsedQueryCache)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
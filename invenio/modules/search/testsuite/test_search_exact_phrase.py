@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the false positive elimination of word pairs search."""
+
+from intbitset import intbitset
+from mock import MagicMock, patch
+
+from invenio.base.globals import cfg
+from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
+from invenio.utils.serializers import serialize_via_marshal
+
+
+class FakeColumn(object):
+
+    """Column of the fake phrase table recording the conditions."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def between(self, low, high):
+        return ('between', low, high)
+
+    def in_(self, values):
+        return ('in', list(values))
+
+    def __eq__(self, value):
+        return ('eq', self.name, value)
+
+
+class FakePhraseTable(object):
+
+    """Reverse phrase table holding the termlists of some records."""
+
+    def __init__(self, termlists):
+        self.termlists = termlists
+        self.id_bibrec = FakeColumn('id_bibrec')
+        self.termlist = FakeColumn('termlist')
+        self.type = FakeColumn('type')
+        self.queries = []
+        self.query = self
+
+    def filter(self, condition, *dummy_conditions):
+        self.queries.append(condition)
+        if condition[0] == 'between':
+            recids = range(condition[1], condition[2] + 1)
+        else:
+            recids = condition[1]
+        self.rows = [(recid, serialize_via_marshal(self.termlists[recid]))
+                     for recid in recids if recid in self.termlists]
+        return self
+
+    def values(self, *dummy_columns):
+        return self.rows
+
+
+class TestExactPhraseMatches(InvenioTestCase):
+
+    """Test the verification of the word pairs search candidates."""
+
+    def setUp(self):
+        self.table = FakePhraseTable(dict(
+            (recid, ['Higgs Boson' if recid % 3 == 0 else 'boson higgs'])
+            for recid in range(1, 101)))
+
+    def get_exact_phrase_matches(self, p, recids, chunk_size=10):
+        from invenio.modules.search.searchext.engines.native import \
+            get_exact_phrase_matches
+        with patch.dict(cfg, {
+                'CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH_CHUNK_SIZE':
+                chunk_size}):
+            with patch('invenio.modules.search.searchext.engines.native.'
+                       'IdxINDEX.idxPHRASER',
+                       MagicMock(return_value=self.table)):
+                return get_exact_phrase_matches(p, 'title', recids)
+
+    def test_matches(self):
+        """exact phrase - only records containing the phrase are kept"""
+        recids = intbitset(range(1, 101))
+        self.assertEqual(self.get_exact_phrase_matches('higgs boson', recids),
+                         intbitset(range(3, 101, 3)))
+
+    def test_dense_chunks(self):
+        """exact phrase - dense candidates are read by bounded range scans"""
+        self.get_exact_phrase_matches('higgs boson',
+                                      intbitset(range(1, 101)))
+        self.assertEqual(len(self.table.queries), 10)
+        self.assertEqual(self.table.queries[0], ('between', 1, 10))
+        self.assertEqual(self.table.queries[-1], ('between', 91, 100))
+
+    def test_sparse_chunks(self):
+        """exact phrase - sparse candidates are read by bounded IN-lists"""
+        recids = intbitset(range(3, 101, 7))
+        result = self.get_exact_phrase_matches('higgs boson', recids,
+                                               chunk_size=5)
+        self.assertEqual(result, recids & intbitset(range(3, 101, 3)))
+        self.assertEqual(len(self.table.queries), 3)
+        self.assertTrue(all(query[0] == 'in' and len(query[1]) <= 5
+                            for query in self.table.queries))
+
+    def test_many_candidates(self):
+        """exact phrase - large candidate sets are verified by chunks"""
+        from invenio.modules.search.searchext.engines import native
+        model = MagicMock()
+        with patch.dict(cfg, {'CFG_WEBSEARCH_IDXPAIRS_EXACT_SEARCH': True}):
+            with patch.object(native.IdxINDEX, 'get_from_field',
+                              MagicMock(return_value=model)), \
+                    patch.object(native, 'get_term_hitset',
+                                 MagicMock(return_value=intbitset(
+                                     range(1, 100001)))), \
+                    patch.object(native, 'get_exact_phrase_matches',
+                                 MagicMock(return_value=intbitset([3]))) \
+                    as get_exact_phrase_matches, \
+                    patch.object(native, 'search_unit_in_idxphrases') \
+                    as search_unit_in_idxphrases:
+                model.stemming_language = ''
+                result = native.search_unit_in_idxpairs('higgs boson',
+                                                        'title', 'a')
+        self.assertEqual(result, intbitset([3]))
+        self.assertEqual(len(get_exact_phrase_matches.call_args[0][2]),
+                         100000)
+        self.assertFalse(search_unit_in_idxphrases.called)
+
+
+TEST_SUITE = make_test_suite(TestExactPhraseMatches)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
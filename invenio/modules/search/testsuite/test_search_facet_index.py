@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the facet index."""
+
+from intbitset import intbitset
+from mock import patch
+
+from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
+
+
+class TestFacetIndex(InvenioTestCase):
+
+    """Test facet counts computed on the facet index."""
+
+    def setUp(self):
+        from invenio.modules.search.cache import get_values_by_size
+        values = {'Ellis, J': intbitset([1, 2, 3, 4, 5]),
+                  'Smith, J': intbitset([1, 2, 6]),
+                  'adams, A': intbitset([2, 6]),
+                  'Brown, B': intbitset([7, 8, 9, 10])}
+        self.facet_index = {'values': values,
+                            'values_by_size': get_values_by_size(values)}
+
+    def test_most_popular_values(self):
+        """facet index - values sorted by number of found records"""
+        from invenio.modules.search.facet_builders import \
+            get_most_popular_facet_values
+        recids = intbitset([1, 2, 3, 6])
+        self.assertEqual(
+            get_most_popular_facet_values(self.facet_index, recids),
+            [('Ellis, J', 3), ('Smith, J', 3), ('adams, A', 2)])
+        self.assertEqual(
+            get_most_popular_facet_values(self.facet_index, recids, 2),
+            [('Ellis, J', 3), ('Smith, J', 3)])
+        self.assertEqual(
+            get_most_popular_facet_values(self.facet_index, intbitset(), 2),
+            [])
+
+    def test_update_cache(self):
+        """facet index - modified records are indexed again"""
+        from invenio.modules.search.cache import FacetIndexDataCacher
+
+        def get_field_values_recids(tags, recids=None):
+            if recids is None:
+                return dict((value, intbitset(recids)) for value, recids
+                            in self.facet_index['values'].items())
+            self.assertEqual(intbitset([2, 7]), recids)
+            return {'Brown, B': intbitset([2]), 'Green, G': intbitset([7])}
+
+        with patch('invenio.modules.search.cache.get_field_values_recids',
+                   get_field_values_recids), \
+                patch('invenio.modules.search.cache.run_sql',
+                      lambda query, params: [(2, ), (7, )]), \
+                patch.object(FacetIndexDataCacher, 'get_tags',
+                             lambda self: ['100__a', '700__a']):
+            cacher = FacetIndexDataCacher('author')
+            index = cacher.cache
+            self.assertTrue(cacher.update_cache())
+        # readers of the previous index are not affected
+        self.assertEqual(intbitset([1, 2, 3, 4, 5]),
+                         index['values']['Ellis, J'])
+        self.assertEqual(intbitset([7, 8, 9, 10]), index['values']['Brown, B'])
+        self.assertTrue('Green, G' not in index['values'])
+        values = cacher.cache['values']
+        self.assertEqual(intbitset([1, 3, 4, 5]), values['Ellis, J'])
+        self.assertEqual(intbitset([6]), values['adams, A'])
+        self.assertEqual(intbitset([2, 8, 9, 10]), values['Brown, B'])
+        self.assertEqual(intbitset([7]), values['Green, G'])
+        self.assertEqual(set(['Brown, B', 'Ellis, J']),
+                         set(cacher.cache['values_by_size'][0:2]))
+        # the previous values of the modified records are remembered
+        record_values = cacher.cache['record_values']
+        self.assertEqual(['Brown, B'], record_values[2])
+        self.assertEqual(['Green, G'], record_values[7])
+        self.assertEqual(['Smith, J', 'adams, A'], sorted(record_values[6]))
+
+
+TEST_SUITE = make_test_suite(TestFacetIndex)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the hitlist cache."""
+
+from intbitset import intbitset
+
+from invenio.modules.search.cache import HitlistCache
+from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
+
+
+class TestHitlistCache(InvenioTestCase):
+
+    """Test bounded term hitlist cache."""
+
+    def setUp(self):
+        self.timestamps = {1: '2015-01-01 00:00:00', 2: '2015-01-01 00:00:00'}
+        self.cache = HitlistCache(max_size=1000, check_interval=0,
+                                  timestamp_verifier=lambda: self.timestamps)
+
+    def test_get_set(self):
+        """hitlist cache - stored hitsets are returned"""
+        self.assertEqual(self.cache.get('idxWORD01F', 'higgs'), None)
+        self.cache.set('idxWORD01F', 'higgs', intbitset([1, 2, 3]))
+        self.assertEqual(self.cache.get('idxWORD01F', 'higgs'),
+                         intbitset([1, 2, 3]))
+        self.assertEqual(self.cache.get('idxWORD02F', 'higgs'), None)
+
+    def test_eviction(self):
+        """hitlist cache - least recently used terms are evicted"""
+        self.cache.set('idxWORD01F', 'a', intbitset([3000]))
+        self.cache.set('idxWORD01F', 'b', intbitset([3000]))
+        self.cache.get('idxWORD01F', 'a')
+        self.cache.set('idxWORD01F', 'c', intbitset([3000]))
+        self.assertTrue(('idxWORD01F', 'a') in self.cache)
+        self.assertFalse(('idxWORD01F', 'b') in self.cache)
+        self.assertTrue(('idxWORD01F', 'c') in self.cache)
+        self.assertTrue(self.cache.size <= 1000)
+
+    def test_too_big_hitset(self):
+        """hitlist cache - hitsets bigger than the cache are not stored"""
+        self.cache.set('idxWORD01F', 'a', intbitset([100000]))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidation(self):
+        """hitlist cache - terms of updated indexes are dropped"""
+        self.cache.set('idxWORD01F', 'a', intbitset([1]))
+        self.cache.set('idxPHRASE02F', 'a', intbitset([1]))
+        self.cache.verify_timestamps()
+        self.timestamps = {1: '2015-01-02 00:00:00',
+                           2: '2015-01-01 00:00:00'}
+        self.assertEqual(self.cache.get('idxWORD01F', 'a'), None)
+        self.assertEqual(self.cache.get('idxPHRASE02F', 'a'), intbitset([1]))
+
+    def test_index_id(self):
+        """hitlist cache - index identifiers of index tables"""
+        self.assertEqual(self.cache.get_index_id('idxWORD01F'), 1)
+        self.assertEqual(self.cache.get_index_id('idxPAIR12R'), 12)
+        self.assertEqual(self.cache.get_index_id('idxPHRASE100F'), 100)
+
+
+TEST_SUITE = make_test_suite(TestHitlistCache)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
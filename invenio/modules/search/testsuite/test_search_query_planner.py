@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the query plan optimizer."""
+
+from intbitset import intbitset
+
+from invenio.modules.search.walkers.query_planner import CollectionOp, \
+    ConjunctionOp, QueryPlanner, RestrictedRecordsOp
+from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
+
+from invenio_query_parser.ast import (
+    AndOp, DoubleQuotedValue, Keyword, KeywordOp, NotOp, OrOp, Value,
+    ValueQuery
+)
+
+from mock import patch
+
+
+class TestQueryPlanner(InvenioTestCase):
+
+    """Test rewriting of query trees."""
+
+    def setUp(self):
+        self.word = ValueQuery(Value('ellis'))
+        self.truncated = ValueQuery(Value('ell*'))
+        self.phrase = KeywordOp(Keyword('title'),
+                                DoubleQuotedValue('higgs boson'))
+
+    def test_conjunction_order(self):
+        """query planner - most selective operands come first"""
+        tree = AndOp(self.truncated, AndOp(self.word, self.phrase))
+        self.assertEqual(
+            tree.accept(QueryPlanner()),
+            ConjunctionOp([self.phrase, self.word, self.truncated]))
+
+    def test_cached_cardinality(self):
+        """query planner - cached hitlists give the number of hits"""
+        tree = AndOp(self.truncated, AndOp(self.phrase, self.word))
+        with patch('invenio.modules.search.searchext.engines.native.'
+                   'get_cached_word_cardinality',
+                   lambda word, f: {'ellis': 5}.get(word)):
+            self.assertEqual(
+                tree.accept(QueryPlanner()),
+                ConjunctionOp([self.word, self.phrase, self.truncated]))
+
+    def test_cached_query(self):
+        """query planner - cached queries keep their cache key"""
+        from invenio.modules.search.enhancers.cache_results import CacheOp
+        query = AndOp(self.truncated, self.phrase)
+        plan = CacheOp(query, 'Articles').accept(QueryPlanner())
+        self.assertTrue(isinstance(plan, CacheOp))
+        self.assertEqual(plan.query,
+                         ConjunctionOp([self.phrase, self.truncated]))
+        self.assertEqual(plan.collection, 'Articles')
+        self.assertEqual(plan.key, str(query))
+
+    def test_and_not(self):
+        """query planner - negated operands are subtracted"""
+        tree = AndOp(NotOp(self.word), self.phrase)
+        self.assertEqual(tree.accept(QueryPlanner()),
+                         ConjunctionOp([self.phrase], [self.word]))
+
+    def test_nested_conjunction(self):
+        """query planner - conjunctions below other operators are planned"""
+        tree = OrOp(self.word, AndOp(self.truncated, self.phrase))
+        self.assertEqual(
+            tree.accept(QueryPlanner()),
+            OrOp(self.word, ConjunctionOp([self.phrase, self.truncated])))
+
+    def test_short_circuit(self):
+        """query planner - empty intersection stops the evaluation"""
+        from invenio.modules.search.walkers.search_unit import SearchUnit
+        tree = AndOp(self.truncated, AndOp(self.word, NotOp(self.phrase)))
+        with patch('invenio.modules.search.walkers.search_unit.search_unit',
+                   return_value=intbitset()) as search_unit:
+            result = tree.accept(QueryPlanner()).accept(SearchUnit())
+        self.assertEqual(result, intbitset())
+        search_unit.assert_called_once_with(p='ellis')
+
+    def test_collection_restriction(self):
+        """query planner - collections are resolved from the caches"""
+        from invenio.modules.search.walkers.search_unit import SearchUnit
+        restricted = RestrictedRecordsOp(['Theses'], 'ANY')
+        tree = AndOp(self.word, AndOp(CollectionOp('Articles'),
+                                      NotOp(restricted)))
+        reclists = {'Articles': intbitset([1, 2, 3, 4])}
+        with patch('invenio.modules.collections.cache.get_collection_reclist',
+                   lambda coll, **kwargs: reclists[coll]), \
+                patch('invenio.modules.search.walkers.search_unit.'
+                      'get_collection_reclist', lambda coll: reclists[coll]):
+            plan = tree.accept(QueryPlanner())
+            self.assertEqual(
+                plan, ConjunctionOp([CollectionOp('Articles'), self.word],
+                                    [restricted]))
+            with patch('invenio.modules.search.walkers.search_unit.'
+                       'collection_visibility_cache') as cache, \
+                    patch('invenio.modules.search.walkers.search_unit.'
+                          'search_unit',
+                          return_value=intbitset([2, 3, 5])) as search_unit:
+                cache.get_notpermitted_recids.return_value = intbitset([3])
+                result = plan.accept(SearchUnit())
+        self.assertEqual(result, intbitset([2]))
+        search_unit.assert_called_once_with(p='ellis')
+        cache.get_notpermitted_recids.assert_called_once_with(
+            ('Theses', ), 'ANY')
+
+
+TEST_SUITE = make_test_suite(TestQueryPlanner)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
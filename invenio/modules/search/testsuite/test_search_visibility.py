@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the filtering of displayable records."""
+
+from intbitset import intbitset
+from mock import patch
+
+from invenio.testsuite import InvenioTestCase, make_test_suite, run_test_suite
+
+
+class FakeCacheProxy(object):
+
+    """Data cacher proxy returning a fixed cache."""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def recreate_cache_if_needed(self):
+        pass
+
+
+class TestRecordsThatCanBeDisplayed(InvenioTestCase):
+
+    """Test the visibility filter of search results."""
+
+    def setUp(self):
+        from invenio.modules.collections.cache import \
+            CollectionVisibilityCache
+        self.reclists = FakeCacheProxy({
+            'Atlantis': intbitset(range(1, 11)),
+            'Articles': intbitset([1, 2, 3]),
+            'Theses': intbitset([3, 4, 5]),
+            'Drafts': intbitset([5, 6]),
+            'Books': intbitset([7, 8]),
+        })
+        self.restricted = FakeCacheProxy(['Theses', 'Drafts'])
+        self.allchildren = FakeCacheProxy({
+            'Atlantis': ['Articles', 'Theses', 'Drafts', 'Books'],
+            'Articles': [], 'Theses': [], 'Drafts': [], 'Books': [],
+        })
+        self.visibility_cache = CollectionVisibilityCache()
+        self.patches = [
+            patch('invenio.modules.collections.cache.'
+                  'collection_reclist_cache', self.reclists),
+            patch('invenio.modules.collections.cache.'
+                  'restricted_collection_cache', self.restricted),
+            patch('invenio.modules.collections.cache.'
+                  'collection_allchildren_cache', self.allchildren),
+            patch('invenio.modules.search.utils.'
+                  'collection_visibility_cache', self.visibility_cache),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+
+    def _displayable(self, permitted, hits, policy='ANY', **kwargs):
+        from invenio.modules.search.utils import \
+            get_records_that_can_be_displayed
+        self.app.config['CFG_WEBSEARCH_VIEWRESTRCOLL_POLICY'] = policy
+        return get_records_that_can_be_displayed(permitted, hits, **kwargs)
+
+    def test_policies(self):
+        """search - records hidden by restricted collections"""
+        hits = intbitset(range(1, 11))
+        self.assertEqual(
+            intbitset([1, 2, 7, 8, 9, 10]),
+            self._displayable([], hits, current_coll='Atlantis'))
+        self.assertEqual(
+            intbitset([1, 2, 3, 4, 5, 7, 8, 9, 10]),
+            self._displayable(['Theses'], hits, current_coll='Atlantis'))
+        self.assertEqual(
+            intbitset([1, 2, 3, 4, 7, 8, 9, 10]),
+            self._displayable(['Theses'], hits, policy='ALL',
+                              current_coll='Atlantis'))
+        self.assertEqual(
+            intbitset([1, 2, 3, 4, 5, 6, 7, 8, 9, 10]),
+            self._displayable(['Theses', 'Drafts'], hits,
+                              current_coll='Atlantis'))
+
+    def test_subtree(self):
+        """search - records of permitted children and selected collections"""
+        hits = intbitset(range(1, 11))
+        self.assertEqual(
+            intbitset([1, 2, 3, 4, 5]),
+            self._displayable(['Theses'], hits, current_coll='Atlantis',
+                              colls=['Articles']))
+        self.assertEqual(
+            intbitset([2, 7]),
+            self._displayable([], intbitset([2, 3, 7]), current_coll='Books',
+                              colls=['Articles', 'Books']))
+
+    def test_cache_invalidation(self):
+        """search - cached bitsets are invalidated with the reclists"""
+        hits = intbitset([1, 2, 3])
+        self.assertEqual(intbitset([1, 2]),
+                         self._displayable([], hits, current_coll='Articles'))
+        self.assertEqual(intbitset([1, 2]),
+                         self._displayable([], intbitset(range(1, 11)),
+                                           current_coll='Articles'))
+
+        self.reclists.cache = dict(self.reclists.cache,
+                                   Articles=intbitset([1, 2, 3, 9]))
+        self.assertEqual(intbitset([1, 2, 9]),
+                         self._displayable([], intbitset(range(1, 11)),
+                                           current_coll='Articles'))
+
+
+TEST_SUITE = make_test_suite(TestRecordsThatCanBeDisplayed)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Implement query plan optimizer for the ``SearchUnit`` visitor."""
+
+from invenio_query_parser.ast import (
+    AndOp, DoubleQuotedValue, EmptyQuery,
+    GreaterOp, Keyword,
+    KeywordOp, Leaf, ListOp, NotOp, OrOp,
+    RangeOp, RegexValue,
+    SingleQuotedValue,
+    Value, ValueQuery,
+)
+from invenio_query_parser.visitor import make_visitor
+
+from ..enhancers.cache_results import CacheOp
+
+#: Estimated number of hits of a query matching (almost) all records.
+UNIVERSE = float('inf')
+
+#: Estimated number of hits of a basic search unit by its value type.
+VALUE_CARDINALITY = {
+    DoubleQuotedValue: 10,
+    SingleQuotedValue: 100,
+    Value: 1000,
+    RegexValue: 100000,
+    RangeOp: 100000,
+    GreaterOp: 100000,
+}
+
+#: Estimated number of hits of a truncated word, e.g. ``ell*``.
+TRUNCATED_VALUE_CARDINALITY = 100000
+
+#: Estimated number of hits of a second level operator, e.g. ``refersto:``.
+SUBQUERY_CARDINALITY = 1000000
+
+
+class ConjunctionOp(ListOp):
+
+    """Represent a planned conjunction of queries.
+
+    The ``children`` are sorted by their estimated cardinality and have to
+    be intersected, while the ``exclusions`` have to be subtracted from the
+    intersection.  Contrary to other nodes, the operands are handed to the
+    visitor unevaluated so it can stop as soon as the result is empty.
+    """
+
+    def __init__(self, children, exclusions=None):
+        """Initialize conjunction with positive and negated operands."""
+        super(ConjunctionOp, self).__init__(children)
+        self.exclusions = exclusions or []
+
+    def accept(self, visitor):
+        return visitor.visit(self, self.children, self.exclusions)
+
+    @property
+    def cardinality(self):
+        """Return estimated number of hits."""
+        if not self.children:
+            return UNIVERSE
+        return estimate_cardinality(self.children[0])
+
+    def __eq__(self, other):
+        return (type(self) == type(other)
+                and self.children == other.children
+                and self.exclusions == other.exclusions)
+
+    def __repr__(self):
+        return "%s(%s, %s)" % (self.__class__.__name__,
+                               repr(self.children), repr(self.exclusions))
+
+
+class CollectionOp(Leaf):
+
+    """Represent the records of a collection.
+
+    The node is resolved against the collection reclist cache instead of
+    the phrase index, i.e. without querying the database.
+    """
+
+    @property
+    def cardinality(self):
+        """Return number of records in the cached collection reclist."""
+        from invenio.modules.collections.cache import get_collection_reclist
+        return len(get_collection_reclist(self.value,
+                                          recreate_cache_if_needed=False))
+
+
+class RestrictedRecordsOp(Leaf):
+
+    """Represent the records a user is not allowed to see.
+
+    The value is the tuple of restricted collections the user can access
+    and the ``CFG_WEBSEARCH_VIEWRESTRCOLL_POLICY`` to apply.  The node is
+    resolved against the precombined bitset of the collection visibility
+    cache.
+    """
+
+    def __init__(self, permitted_restricted_collections, policy):
+        """Initialize with permitted restricted collections and policy."""
+        super(RestrictedRecordsOp, self).__init__(
+            (tuple(sorted(permitted_restricted_collections)), policy))
+
+    @property
+    def permitted_restricted_collections(self):
+        return self.value[0]
+
+    @property
+    def policy(self):
+        return self.value[1]
+
+
+def estimate_cardinality(node):
+    """Return estimated number of hits of the query tree.
+
+    Words whose hitlists are in the hitlist cache are estimated by their
+    real number of hits.  Otherwise the estimate is deduced from the shape
+    of the query: exact phrases are assumed to be more selective than words,
+    which are more selective than truncated words, regular expressions,
+    ranges and second level operators.
+    """
+    from invenio.modules.search.searchext.engines.native import \
+        get_cached_word_cardinality
+    if isinstance(node, (ConjunctionOp, CollectionOp)):
+        return node.cardinality
+    if isinstance(node, OrOp):
+        return (estimate_cardinality(node.left) +
+                estimate_cardinality(node.right))
+    if isinstance(node, (KeywordOp, ValueQuery)):
+        value = node.right if isinstance(node, KeywordOp) else node.op
+        if type(value) in (Value, DoubleQuotedValue):
+            field = node.left.value if isinstance(node, KeywordOp) else ''
+            cardinality = get_cached_word_cardinality(value.value, field)
+            if cardinality is not None:
+                return cardinality
+        if type(value) not in VALUE_CARDINALITY:
+            return SUBQUERY_CARDINALITY
+        if type(value) is Value and '*' in value.value:
+            return TRUNCATED_VALUE_CARDINALITY
+        return VALUE_CARDINALITY[type(value)]
+    if isinstance(node, (NotOp, EmptyQuery)):
+        return UNIVERSE
+    return SUBQUERY_CARDINALITY
+
+
+class QueryPlanner(object):
+
+    """Rewrite query tree into an equivalent tree that is cheaper to search.
+
+    Nested ``AndOp`` nodes are flattened into one :class:`ConjunctionOp`
+    whose operands are ordered by their estimated cardinality and whose
+    negated operands are subtracted from the intersection instead of being
+    complemented first, i.e. ``A AND NOT B`` becomes ``A - B``.
+    """
+
+    visitor = make_visitor()
+
+    # pylint: disable=W0613,E0102
+
+    @visitor(AndOp)
+    def visit(self, node, left, right):
+        children = []
+        exclusions = []
+        for operand in (left, right):
+            if isinstance(operand, ConjunctionOp):
+                children.extend(operand.children)
+                exclusions.extend(operand.exclusions)
+            elif isinstance(operand, NotOp):
+                exclusions.append(operand.op)
+            elif not isinstance(operand, EmptyQuery):
+                children.append(operand)
+        children.sort(key=estimate_cardinality)
+        return ConjunctionOp(children, exclusions)
+
+    @visitor(OrOp)
+    def visit(self, node, left, right):
+        return OrOp(left, right)
+
+    @visitor(NotOp)
+    def visit(self, node, op):
+        return NotOp(op)
+
+    @visitor(KeywordOp)
+    def visit(self, node, left, right):
+        return KeywordOp(left, right)
+
+    @visitor(ValueQuery)
+    def visit(self, node, op):
+        return ValueQuery(op)
+
+    @visitor(GreaterOp)
+    def visit(self, node, op):
+        return GreaterOp(op)
+
+    @visitor(RangeOp)
+    def visit(self, node, left, right):
+        return RangeOp(left, right)
+
+    @visitor(Keyword)
+    def visit(self, node):
+        return node
+
+    @visitor(Value)
+    def visit(self, node):
+        return node
+
+    @visitor(SingleQuotedValue)
+    def visit(self, node):
+        return node
+
+    @visitor(DoubleQuotedValue)
+    def visit(self, node):
+        return node
+
+    @visitor(RegexValue)
+    def visit(self, node):
+        return node
+
+    @visitor(EmptyQuery)
+    def visit(self, node):
+        return node
+
+    @visitor(CollectionOp)
+    def visit(self, node):
+        return node
+
+    @visitor(RestrictedRecordsOp)
+    def visit(self, node):
+        return node
+
+    @visitor(CacheOp)
+    def visit(self, node, query):
+        # keep the cache key of the original query
+        return CacheOp(query.accept(self), node.collection, key=node.key)
+
+    # pylint: enable=W0612,E0102
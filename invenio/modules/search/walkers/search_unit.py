@@ -31,6 +31,12 @@ from invenio_query_parser.ast import (
 )
 from invenio_query_parser.visitor import make_visitor
 
+from invenio.modules.collections.cache import (
+    collection_visibility_cache,
+    get_collection_reclist,
+)
+
+from .query_planner import CollectionOp, ConjunctionOp, RestrictedRecordsOp
 from ..searchext.engines.native import search_unit
 
 
@@ -54,6 +60,19 @@ class SearchUnit(object):
     def visit(self, node, op):
         return intbitset(trailing_bits=1) - op
 
+    @visitor(ConjunctionOp)
+    def visit(self, node, children, exclusions):
+        result = intbitset(trailing_bits=1)
+        for child in children:
+            result &= child.accept(self)
+            if not result:
+                return intbitset()
+        for exclusion in exclusions:
+            result -= exclusion.accept(self)
+            if not result:
+                return intbitset()
+        return result
+
     @visitor(KeywordOp)
     def visit(self, node, left, right):
         if isinstance(right, intbitset):  # second level operator
@@ -99,4 +118,14 @@ class SearchUnit(object):
     def visit(self, node):
         return intbitset(trailing_bits=1)
 
+    @visitor(CollectionOp)
+    def visit(self, node):
+        return get_collection_reclist(node.value)
+
+    @visitor(RestrictedRecordsOp)
+    def visit(self, node):
+        collection_visibility_cache.recreate_cache_if_needed()
+        return collection_visibility_cache.get_notpermitted_recids(
+            node.permitted_restricted_collections, node.policy)
+
     # pylint: enable=W0612,E0102
@@ -19,15 +19,37 @@
 
 """Define caches for sorter module."""
 
-from invenio.legacy.miscutil.data_cacher import DataCacher
+from numpy import fromiter, ones
+
+from invenio.legacy.miscutil.data_cacher import DataCacher, \
+    get_table_version
 from invenio.utils.datastructures import LazyDict
 
 from .models import BsrMETHOD
 
 
+def get_weights_array(data_dict_ordered):
+    """Return the weights of the records as an array indexed by recid.
+
+    Records without weight get -1.
+    """
+    size = max(data_dict_ordered) + 1 if data_dict_ordered else 0
+    weights = -ones(size, dtype='int64')
+    weights[fromiter(data_dict_ordered.iterkeys(), dtype='int64',
+                     count=len(data_dict_ordered))] = \
+        fromiter(data_dict_ordered.itervalues(), dtype='int64',
+                 count=len(data_dict_ordered))
+    return weights
+
+
 class BibSortDataCacher(DataCacher):
 
-    """Cache holding all structures created by sorter."""
+    """Cache holding all structures created by sorter.
+
+    The weights of the records are kept as a dense array indexed by recid,
+    see get_weights_array(), together with the number of buckets of the
+    method.
+    """
 
     def __init__(self, method_name):
         """Initialize data cacher for given method."""
@@ -36,15 +58,32 @@ class BibSortDataCacher(DataCacher):
         def cache_filler():
             """Return data to populate cache."""
             method = BsrMETHOD.query.filter_by(name=self.method_name).first()
-            return dict(method.get_cache()) if method is not None else {}
+            cache = dict(method.get_cache()) if method is not None else {}
+            if 'data_dict_ordered' in cache:
+                cache['weights_array'] = get_weights_array(
+                    cache.pop('data_dict_ordered'))
+            # only the number of buckets is needed, to check that the
+            # method is complete
+            cache['nb_buckets'] = len(cache.pop('bucket_data', {}))
+            return cache
 
         def timestamp_verifier():
-            """Return string representing last update datetime."""
-            return BsrMETHOD.timestamp_verifier(self.method_name).strftime(
-                "%Y-%m-%d %H:%M:%S")
+            """Return string representing last update datetime.
+
+            The update times of the bibsort tables are used instead of
+            the ``last_updated`` columns of the method, so that checking
+            the cache does not query the database on every request.
+            """
+            return max(get_table_version('bsrMETHODDATA'),
+                       get_table_version('bsrMETHODDATABUCKET'))
 
         DataCacher.__init__(self, cache_filler, timestamp_verifier)
 
+    @property
+    def name(self):
+        """Return name of the cache including the sorting method."""
+        return '{0}_{1}'.format(self.__class__.__name__, self.method_name)
+
 
 SORTING_METHODS = LazyDict(BsrMETHOD.get_sorting_methods)
 
@@ -20,10 +20,12 @@
 """Implementation of sorting engine."""
 
 from intbitset import intbitset
+from numpy import arange, argpartition, concatenate, flatnonzero, fromiter, \
+    iinfo, lexsort, ones
 
 from invenio.base.globals import cfg
 from invenio.legacy.bibrank.record_sorter import rank_records
-from invenio.legacy.bibrecord import get_fieldvalues
+from invenio.legacy.bibrecord import get_fieldvalues_of_records
 from invenio.legacy.search_engine import get_interval_for_records_to_sort
 from invenio.legacy.search_engine import slice_records
 from invenio.utils.text import strip_accents
@@ -66,6 +68,17 @@ def sort_records(recIDs, sort_field='', sort_order='a', sort_pattern='',
 
     2. sort_field is not in bsrMETHOD, and thus, the cache does not contain
        any information regarding this sorting method.
+
+    Several sort fields separated by commas, e.g. "year,citations", sort
+    the records lexicographically: by the first field, then by the second
+    one for the records having the same value, and so on.  BibSort sorts
+    them by the weights of its methods, otherwise the values of the fields
+    are compared as strings.  The two paths differ in the records without
+    value for a field, which BibSort puts last (first for
+    CFG_BIBSORT_DEFAULT_FIELD sorted descending) while strings put them
+    first in ascending order, and in the records having the same values,
+    which BibSort orders by recid while strings order them by recid in the
+    sort order.
     """
     sorting_methods = sorting_methods or SORTING_METHODS
 
@@ -91,15 +104,20 @@ def sort_records(recIDs, sort_field='', sort_order='a', sort_pattern='',
     sort_fields = sort_field.split(",")
     if len(sort_fields) == 1:
         # we have only one sorting_field, check if it is treated by BibSort
-        for sort_method in sorting_methods:
-            definition = sorting_methods[sort_method]
-            if use_sorting_buckets and ((
-                    definition.startswith('FIELD') and definition.replace(
-                        'FIELD:', '').strip().lower() == sort_fields[0].lower()
-                    ) or sort_method == sort_fields[0]):
-                # use BibSort
-                return sort_records_bibsort(recIDs, sort_method, sort_field,
-                                            sort_order, rg, jrec)
+        sort_method = get_bibsort_method(sort_fields[0], sorting_methods)
+        if use_sorting_buckets and sort_method is not None:
+            # use BibSort
+            return sort_records_bibsort(recIDs, sort_method, sort_field,
+                                        sort_order, rg, jrec)
+    elif use_sorting_buckets:
+        # several sorting fields, use BibSort if it treats all of them
+        sort_methods = [get_bibsort_method(field, sorting_methods)
+                        for field in sort_fields]
+        if None not in sort_methods:
+            solution = sort_records_bibsort_multiple(
+                recIDs, sort_methods, sort_order, rg, jrec)
+            if solution is not None:
+                return solution
     # deduce sorting MARC tag out of the 'sort_field' argument:
     tags, error_field = get_tags_from_sort_fields(sort_fields)
     if error_field:
@@ -127,6 +145,76 @@ def sort_records(recIDs, sort_field='', sort_order='a', sort_pattern='',
         return slice_records(recIDs, jrec, rg)
 
 
+def get_bibsort_method(sort_field, sorting_methods):
+    """Return the BibSort method sorting by SORT_FIELD or None."""
+    for sort_method in sorting_methods:
+        definition = sorting_methods[sort_method]
+        if (definition.startswith('FIELD') and definition.replace(
+                'FIELD:', '').strip().lower() == sort_field.lower()) or \
+                sort_method == sort_field:
+            return sort_method
+    return None
+
+
+def get_bibsort_weights(sort_cache, recids):
+    """Return the weights of the array of RECIDS, -1 for unknown ones."""
+    weights_array = sort_cache['weights_array']
+    weights = -ones(len(recids), dtype='int64')
+    known = recids < len(weights_array)
+    weights[known] = weights_array[recids[known]]
+    return weights
+
+
+def get_bibsort_keys(weights, reverse, missing_first=False):
+    """Return ascending sort keys, putting records without weight last.
+
+    Records without weight are put first if MISSING_FIRST is set.
+    """
+    keys = -weights if reverse else weights.copy()
+    keys[weights < 0] = iinfo('int64').min if missing_first else \
+        iinfo('int64').max
+    return keys
+
+
+def get_bibsort_missing_first_p(sort_method, reverse):
+    """Check if records without weight for SORT_METHOD go first.
+
+    This is the case of the default field sorted descending, e.g. the
+    records not yet sorted by their insertion date.
+    """
+    return reverse and \
+        sort_method.strip().lower() == cfg['CFG_BIBSORT_DEFAULT_FIELD']
+
+
+def get_sorted_positions(keys, amount):
+    """Return the positions of the AMOUNT first records ordered by KEYS.
+
+    KEYS is a list of arrays of sort keys, the most significant first.
+    Ties are broken by position.  Only the records which may be among the
+    first ones are sorted.
+    """
+    primary = keys[0]
+    candidates = arange(len(primary))
+    if amount < len(primary):
+        if amount <= 0:
+            return candidates[:0]
+        threshold = primary[argpartition(primary, amount - 1)[amount - 1]]
+        candidates = flatnonzero(primary <= threshold)
+    order = lexsort([candidates] + [key[candidates] for key in reversed(keys)])
+    return candidates[order[:amount]]
+
+
+def get_bibsort_cache(sort_method):
+    """Return the cache of SORT_METHOD, or None if it is not complete."""
+    CACHE_SORTED_DATA[sort_method].recreate_cache_if_needed()
+    sort_cache = CACHE_SORTED_DATA[sort_method].cache
+    # check if all buckets have been constructed
+    if sort_cache.get('nb_buckets') != cfg['CFG_BIBSORT_BUCKETS'] \
+            or 'weights_array' not in sort_cache:
+        return None
+    return sort_cache
+
+
 def sort_records_bibsort(recIDs, sort_method, sort_field='', sort_order='d',
                          rg=None, jrec=1, sort_or_rank='s',
                          sorting_methods=SORTING_METHODS):
@@ -146,15 +234,8 @@ def sort_records_bibsort(recIDs, sort_method, sort_field='', sort_order='d',
             return sort_records_bibxxx(recIDs, None, sort_field, sort_order,
                                        '', rg, jrec)
 
-    # we should return sorted records up to irec_max(exclusive)
-    dummy, irec_max = get_interval_for_records_to_sort(len(recIDs), jrec, rg)
-    solution = intbitset()
-    input_recids = intbitset(recIDs)
-    CACHE_SORTED_DATA[sort_method].recreate_cache_if_needed()
-    sort_cache = CACHE_SORTED_DATA[sort_method].cache
-    bucket_numbers = sort_cache['bucket_data'].keys()
-    # check if all buckets have been constructed
-    if len(bucket_numbers) != cfg['CFG_BIBSORT_BUCKETS']:
+    sort_cache = get_bibsort_cache(sort_method)
+    if sort_cache is None:
         if sort_or_rank == 'r':
             return rank_records(rank_method_code=sort_method,
                                 rank_limit_relevance=0, hitset=recIDs)
@@ -162,55 +243,65 @@ def sort_records_bibsort(recIDs, sort_method, sort_field='', sort_order='d',
             return sort_records_bibxxx(recIDs, None, sort_field,
                                        sort_order, rg=rg, jrec=jrec)
 
-    if sort_order == 'd':
-        bucket_numbers.reverse()
-    for bucket_no in bucket_numbers:
-        solution.union_update(
-            input_recids & sort_cache['bucket_data'][bucket_no]
-        )
-        if len(solution) >= irec_max:
-            break
-
-    dict_solution = {}
-    missing_records = intbitset()
-    for recid in solution:
-        try:
-            dict_solution[recid] = sort_cache['data_dict_ordered'][recid]
-        except KeyError:
-            # recid is in buckets, but not in the bsrMETHODDATA,
-            # maybe because the value has been deleted, but the change has not
-            # yet been propagated to the buckets
-            missing_records.add(recid)
-
-    # check if there are recids that are not in any bucket -> to be added at
-    # the end/top, ordered by insertion date
-    if len(solution) < irec_max:
-        # some records have not been yet inserted in the bibsort structures
-        # or, some records have no value for the sort_method
-        missing_records += input_recids - solution
-
+    input_recids = intbitset(recIDs)
+    recids = fromiter(input_recids, dtype='int64', count=len(input_recids))
+    # we should return sorted records up to irec_max(exclusive)
+    dummy, irec_max = get_interval_for_records_to_sort(len(recids), jrec, rg)
+    weights = get_bibsort_weights(sort_cache, recids)
     reverse = sort_order == 'd'
 
-    if sort_method.strip().lower() == cfg['CFG_BIBSORT_DEFAULT_FIELD'] and \
-            reverse:
+    if get_bibsort_missing_first_p(sort_method, reverse):
         # If we want to sort the records on their insertion date, add the
-        # missing records at the top.
-        solution = sorted(missing_records, reverse=True) + \
-            sorted(dict_solution, key=dict_solution.__getitem__, reverse=True)
+        # records without weight at the top.
+        missing = flatnonzero(weights < 0)[::-1][:irec_max]
+        weighted = flatnonzero(weights >= 0)
+        positions = concatenate((missing, weighted[get_sorted_positions(
+            [-weights[weighted]], irec_max - len(missing))]))
     else:
-        solution = sorted(dict_solution, key=dict_solution.__getitem__,
-                          reverse=reverse) + sorted(missing_records)
+        # records without weight go at the end, ordered by recid
+        positions = get_sorted_positions(
+            [get_bibsort_keys(weights, reverse)], irec_max)
 
     # Only keep records, we are going to display
-    solution = slice_records(solution, jrec, rg)
+    solution = slice_records(recids[positions].tolist(), jrec, rg)
 
     if sort_or_rank == 'r':
         # We need the recids, with their ranking score
-        return solution, [dict_solution.get(record, 0) for record in solution]
+        scores = slice_records(weights[positions].clip(0).tolist(), jrec, rg)
+        return solution, scores
     else:
         return solution
 
 
+def sort_records_bibsort_multiple(recIDs, sort_methods, sort_order='d',
+                                  rg=None, jrec=1):
+    """Order the list by several sorting methods using the BibSortDataCacher.
+
+    The records are ordered by the first method, then by the second one for
+    the records having the same weight, and so on.  Records without weight
+    for a method go after the ones having one.  Return None if the cache of
+    some method is not available.  For the default field sorted
+    descending, records without weight go before the ones having one.
+    """
+    sort_caches = [get_bibsort_cache(sort_method)
+                   for sort_method in sort_methods]
+    if None in sort_caches:
+        return None
+
+    if not jrec:
+        jrec = 1
+    input_recids = intbitset(recIDs)
+    recids = fromiter(input_recids, dtype='int64', count=len(input_recids))
+    dummy, irec_max = get_interval_for_records_to_sort(len(recids), jrec, rg)
+    reverse = sort_order == 'd'
+    keys = [get_bibsort_keys(get_bibsort_weights(sort_cache, recids), reverse,
+                             get_bibsort_missing_first_p(sort_method,
+                                                         reverse))
+            for sort_method, sort_cache in zip(sort_methods, sort_caches)]
+    positions = get_sorted_positions(keys, irec_max)
+    return slice_records(recids[positions].tolist(), jrec, rg)
+
+
 def sort_records_bibxxx(recIDs, tags, sort_field='', sort_order='d',
                         sort_pattern='', rg=None, jrec=None):
     """Sort record list according sort field in given order.
@@ -218,7 +309,9 @@ def sort_records_bibxxx(recIDs, tags, sort_field='', sort_order='d',
     If more than one instance of 'sort_field' is found for a given record, try
     to choose that that is given by 'sort pattern', for example "sort by report
     number that starts by CERN-PS".  Note that 'sort_field' can be field code
-    like 'author' or MARC tag like '100__a' directly.
+    like 'author' or MARC tag like '100__a' directly.  Several sort fields
+    separated by commas are compared one after the other, see
+    sort_records().
     """
     # check arguments:
     if not sort_field:
@@ -230,45 +323,59 @@ def sort_records_bibxxx(recIDs, tags, sort_field='', sort_order='d',
     recIDs_dict = {}
     recIDs_out = []
 
-    if not tags:
-        # tags have not been camputed yet
-        sort_fields = sort_field.split(',')
-        tags, error_field = get_tags_from_sort_fields(sort_fields)
-        if error_field:
-            return slice_records(recIDs, jrec, rg)
+    sort_fields = sort_field.split(',')
+    if not tags or len(sort_fields) > 1:
+        # tags have not been camputed yet, or not field by field
+        tags_of_fields = []
+        for field in sort_fields:
+            field_tags, error_field = get_tags_from_sort_fields([field])
+            if error_field:
+                return slice_records(recIDs, jrec, rg)
+            tags_of_fields.append(field_tags)
+        tags = sum(tags_of_fields, [])
+    else:
+        tags_of_fields = [tags]
 
     # check if we have sorting tag defined:
     if tags:
-        # fetch the necessary field values:
+        # fetch the necessary field values of all records at once:
+        tag_values = get_fieldvalues_of_records(recIDs, tags)
         for recID in recIDs:
-            val = ""  # will hold value for recID according to which sort
-            vals = []  # will hold all values found in sorting tag for recID
-            for tag in tags:
-                if cfg['CFG_CERN_SITE'] and tag == '773__c':
-                    # CERN hack: journal sorting
-                    # 773__c contains page numbers, e.g. 3-13,
-                    # and we want to sort by 3, and numerically:
-                    vals.extend([
-                        "%050s" % x.split("-", 1)[0]
-                        for x in get_fieldvalues(recID, tag)])
+            # will hold values for recID according to which sort, by field
+            val = []
+            for field_tags in tags_of_fields:
+                field_val = ""
+                vals = []  # will hold all values found in sorting tag
+                for tag in field_tags:
+                    if cfg['CFG_CERN_SITE'] and tag == '773__c':
+                        # CERN hack: journal sorting
+                        # 773__c contains page numbers, e.g. 3-13,
+                        # and we want to sort by 3, and numerically:
+                        vals.extend([
+                            "%050s" % x.split("-", 1)[0]
+                            for x in tag_values[tag].get(recID, [])])
+                    else:
+                        vals.extend(tag_values[tag].get(recID, []))
+                if sort_pattern:
+                    # try to pick that tag value that corresponds to sort
+                    # pattern
+                    bingo = 0
+                    for v in vals:
+                        if v.lower().startswith(sort_pattern.lower()):
+                            bingo = 1
+                            field_val = v
+                            break
+                    if not bingo:
+                        # sort_pattern not present, so add other vals after
+                        # spaces
+                        field_val = sort_pattern + "          " + \
+                            ''.join(vals)
                 else:
-                    vals.extend(get_fieldvalues(recID, tag))
-            if sort_pattern:
-                # try to pick that tag value that corresponds to sort pattern
-                bingo = 0
-                for v in vals:
-                    if v.lower().startswith(sort_pattern.lower()):  # bingo!
-                        bingo = 1
-                        val = v
-                        break
-                if not bingo:
-                    # sort_pattern not present, so add other vals after spaces
-                    val = sort_pattern + "          " + ''.join(vals)
-            else:
-                # no sort pattern defined, so join them all together
-                val = ''.join(vals)
-            # sort values regardless of accents and case
-            val = strip_accents(val.lower())
+                    # no sort pattern defined, so join them all together
+                    field_val = ''.join(vals)
+                # sort values regardless of accents and case
+                val.append(strip_accents(field_val.lower()))
+            val = tuple(val)
             if val in recIDs_dict:
                 recIDs_dict[val].append(recID)
             else:
@@ -27,6 +27,10 @@ binary_search = lazy_import('invenio.legacy.bibsort.engine:binary_search')
 perform_delete_record = lazy_import('invenio.legacy.bibsort.engine:perform_delete_record')
 perform_insert_record = lazy_import('invenio.legacy.bibsort.engine:perform_insert_record')
 perform_modify_record = lazy_import('invenio.legacy.bibsort.engine:perform_modify_record')
+get_weights_array = lazy_import('invenio.modules.sorter.cache:get_weights_array')
+get_bibsort_keys = lazy_import('invenio.modules.sorter.engine:get_bibsort_keys')
+get_bibsort_weights = lazy_import('invenio.modules.sorter.engine:get_bibsort_weights')
+get_sorted_positions = lazy_import('invenio.modules.sorter.engine:get_sorted_positions')
 
 class TestBibSort(InvenioTestCase):
     """Test BibSort."""
@@ -161,7 +165,73 @@ class TestBibSort(InvenioTestCase):
         #testinsertion at the end
         self.assertEqual(0, binary_search(sorted_list, 'a', data_dict))
 
+
+class TestBibSortWeights(InvenioTestCase):
+    """Test sorting by BibSort weights arrays."""
+
+    def setUp(self):
+        """Prepare the weights of a sorting method."""
+        from numpy import array
+        self.sort_cache = {'weights_array': get_weights_array(
+            {1: 16, 2: 8, 4: 24, 5: 8, 6: 32})}
+        self.recids = array([1, 2, 3, 5, 6, 9])
+
+    def test_get_bibsort_weights(self):
+        """bibsort - gathering the weights of records"""
+        self.assertEqual([16, 8, -1, 8, 32, -1],
+                         get_bibsort_weights(self.sort_cache,
+                                             self.recids).tolist())
+
+    def test_get_sorted_positions(self):
+        """bibsort - sorting records by weight"""
+        weights = get_bibsort_weights(self.sort_cache, self.recids)
+        keys = get_bibsort_keys(weights, False)
+        self.assertEqual([2, 5, 1, 6, 3, 9],
+                         self.recids[get_sorted_positions([keys], 6)].tolist())
+        keys = get_bibsort_keys(weights, True)
+        self.assertEqual([6, 1, 2],
+                         self.recids[get_sorted_positions([keys], 3)].tolist())
+
+    def test_get_sorted_positions_several_keys(self):
+        """bibsort - sorting records by several weights"""
+        from numpy import array
+        weights = get_bibsort_weights(self.sort_cache, self.recids)
+        keys = [get_bibsort_keys(weights, True),
+                get_bibsort_keys(array([1, 2, 0, 1, 1, 3]), True)]
+        self.assertEqual([6, 1, 2, 5],
+                         self.recids[get_sorted_positions(keys, 4)].tolist())
+
+    def test_get_sorted_positions_missing_first(self):
+        """bibsort - records without weight can be sorted first"""
+        weights = get_bibsort_weights(self.sort_cache, self.recids)
+        keys = [get_bibsort_keys(weights, True, True),
+                get_bibsort_keys(weights, False)]
+        self.assertEqual([3, 9, 6, 1],
+                         self.recids[get_sorted_positions(keys, 4)].tolist())
+
+
+class TestSortRecordsBibxxx(InvenioTestCase):
+    """Test sorting records by the values of their fields."""
+
+    def test_several_fields(self):
+        """bibsort - several fields are compared one after the other"""
+        from mock import patch
+        from invenio.modules.sorter.engine import sort_records_bibxxx
+        values = {'100__a': {1: ['Ellis'], 2: ['Ellis'], 3: ['Abbott']},
+                  '260__c': {1: ['2001'], 2: ['1999'], 3: ['2005']}}
+        with patch('invenio.modules.sorter.engine.'
+                   'get_fieldvalues_of_records',
+                   return_value=values):
+            self.assertEqual([3, 2, 1], sort_records_bibxxx(
+                [1, 2, 3], None, '100__a,260__c', 'a'))
+            self.assertEqual([1, 2, 3], sort_records_bibxxx(
+                [1, 2, 3], None, '100__a,260__c', 'd'))
+            self.assertEqual([2, 1, 3], sort_records_bibxxx(
+                [1, 2, 3], None, '260__c,100__a', 'a'))
+
 TEST_SUITE = make_test_suite(TestBibSort,
+                             TestBibSortWeights,
+                             TestSortRecordsBibxxx,
                              )
 
 if __name__ == "__main__":
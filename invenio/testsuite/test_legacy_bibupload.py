@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+"""Unit tests for the bibupload engine."""
+
+from mock import patch
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+engine = lazy_import('invenio.legacy.bibupload.engine')
+
+
+class FakeBibxxxTable(object):
+
+    """Answer the bibxxx queries of bibupload like MySQL would."""
+
+    def __init__(self, rows, next_id=100):
+        self.rows = list(rows)
+        self.next_id = next_id
+        self.queries = []
+
+    def run_sql(self, query, params=None):
+        params = list(params)
+        if 'GET_LOCK' in query:
+            self.queries.append('LOCK')
+            return ((1, ), )
+        elif 'RELEASE_LOCK' in query:
+            self.queries.append('UNLOCK')
+            return ((1, ), )
+        self.queries.append(query.split()[0])
+        if query.startswith('SELECT'):
+            # case-insensitive comparison, as with the default collation
+            tags = params[:query.count('%s', 0, query.index('value IN'))]
+            values = [value.lower() for value in params[len(tags):]]
+            return tuple(row for row in self.rows
+                         if row[1] in tags and row[2].lower() in values)
+        elif '(tag, value)' in query:
+            # ids are not necessarily consecutive, e.g. with InnoDB
+            first_id = self.next_id
+            while params:
+                self.rows.append((self.next_id, params[0], params[1]))
+                self.next_id += 2
+                params = params[2:]
+            return first_id
+        return 1
+
+
+class BibxxxRowsTest(InvenioTestCase):
+
+    """Test the batched writes of the bibxxx rows of a record."""
+
+    def setUp(self):
+        self.table = FakeBibxxxTable([(1, '100__a', 'ELLIS'),
+                                      (2, '100__a', 'Ellis, J'),
+                                      (3, '245__a', 'Higgs')])
+
+    def test_exact_match(self):
+        """bibupload - bibxxx ids are matched on exact values"""
+        with patch('invenio.legacy.bibupload.engine.run_sql',
+                   self.table.run_sql):
+            ids = engine.get_bibxxx_ids('bib10x', [('100__a', 'Ellis'),
+                                                   ('100__a', 'Ellis, J')])
+        self.assertEqual(ids.get(('100__a', 'Ellis, J')), 2)
+        self.assertFalse(('100__a', 'Ellis') in ids)
+
+    def test_case_variant_inserted_once(self):
+        """bibupload - case variants of values get their own bibxxx row"""
+        with patch('invenio.legacy.bibupload.engine.run_sql',
+                   self.table.run_sql):
+            engine.insert_record_bibxxx_rows(
+                [('100__a', 'Ellis', 1), ('100__a', 'Ellis, J', 2)], 10)
+        self.assertEqual([row for row in self.table.rows if row[0] >= 100],
+                         [(100, '100__a', 'Ellis')])
+        self.assertEqual(self.table.queries, ['SELECT', 'LOCK', 'SELECT',
+                                              'INSERT', 'SELECT', 'UNLOCK',
+                                              'INSERT'])
+
+    def test_value_created_concurrently(self):
+        """bibupload - values created by another upload are not duplicated"""
+        links = []
+
+        def run_sql(query, params=None):
+            if 'GET_LOCK' in query:
+                # another worker inserted the value before we got the lock
+                self.table.rows.append((50, '245__a', 'Boson'))
+            elif query.startswith('INSERT INTO bibrec_'):
+                links.extend(zip(*[iter(params)] * 3))
+            return self.table.run_sql(query, params)
+
+        with patch('invenio.legacy.bibupload.engine.run_sql', run_sql):
+            engine.insert_record_bibxxx_rows(
+                [('245__a', 'Boson', 1), ('245__a', 'Higgs', 2)], 10)
+        self.assertEqual([row for row in self.table.rows
+                          if row[2] == 'Boson'], [(50, '245__a', 'Boson')])
+        self.assertEqual(self.table.queries, ['SELECT', 'LOCK', 'SELECT',
+                                              'UNLOCK', 'INSERT'])
+        self.assertEqual(sorted(links), [(10, 3, 2), (10, 50, 1)])
+
+    def test_chunks(self):
+        """bibupload - bibxxx rows are written in chunks"""
+        rows = [('100__a', 'Author %d' % i, i) for i in range(5)]
+        links = []
+
+        def run_sql(query, params=None):
+            if query.startswith('INSERT INTO bibrec_'):
+                links.extend(zip(*[iter(params)] * 3))
+            return self.table.run_sql(query, params)
+
+        with patch('invenio.legacy.bibupload.engine.run_sql', run_sql), \
+                patch('invenio.legacy.bibupload.engine.'
+                      'CFG_BIBUPLOAD_BIBXXX_ROWS_PER_QUERY', 2):
+            engine.insert_record_bibxxx_rows(rows, 10)
+        self.assertEqual(self.table.queries,
+                         ['SELECT'] * 3 + ['LOCK'] + ['SELECT'] * 3 +
+                         ['INSERT'] * 3 + ['SELECT'] * 3 + ['UNLOCK'] +
+                         ['INSERT'] * 3)
+        inserted = dict((row[2], row[0]) for row in self.table.rows
+                        if row[0] >= 100)
+        self.assertEqual(sorted(links),
+                         sorted((10, inserted[value], field_number)
+                                for dummy, value, field_number in rows))
+        self.assertEqual(sorted(inserted.values()), range(100, 110, 2))
+
+    def test_pretend(self):
+        """bibupload - nothing is written in pretend mode"""
+        with patch('invenio.legacy.bibupload.engine.run_sql',
+                   self.table.run_sql):
+            engine.insert_record_bibxxx_rows(
+                [('100__a', 'Ellis', 1), ('245__a', 'Higgs', 1)], 10,
+                pretend=True)
+        self.assertEqual(set(self.table.queries), set(['SELECT']))
+        self.assertEqual(len(self.table.rows), 3)
+
+
+def make_record(controlfield='', datafields=''):
+    """Return record structure of the MARCXML fields."""
+    from invenio.legacy.bibrecord import create_record
+    return create_record('<record>%s%s</record>' % (controlfield,
+                                                     datafields))[0]
+
+
+def make_numbered_record(recid, datafields=''):
+    """Return record structure with the given 001 and MARCXML fields."""
+    return make_record('<controlfield tag="001">%s</controlfield>' % recid,
+                       datafields)
+
+
+class FakePool(object):
+
+    """Run the jobs in this process, each with its own statistics."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def __call__(self, workers, initializer=None):
+        return self
+
+    def imap(self, func, args):
+        args = list(args)
+        self.events.append(('batch', [arg[0]['001'][0][3] for arg in args]))
+        for arg in args:
+            # a worker process starts with a copy of the parent statistics
+            with patch.object(engine, 'stat', dict(engine.stat)):
+                result = func(arg)
+            yield result
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class ParallelUploadTest(InvenioTestCase):
+
+    """Test the upload of independent records by worker processes."""
+
+    def test_temporary_identifiers(self):
+        """bibupload - records tied to others by temporary identifiers"""
+        uses = engine.record_uses_temporary_identifiers
+        self.assertFalse(uses(make_numbered_record(1, """
+            <datafield tag="FFT" ind1=" " ind2=" ">
+              <subfield code="a">/tmp/a.pdf</subfield>
+              <subfield code="i">12</subfield>
+            </datafield>""")))
+        self.assertTrue(uses(make_numbered_record(1, """
+            <datafield tag="FFT" ind1=" " ind2=" ">
+              <subfield code="a">/tmp/a.pdf</subfield>
+              <subfield code="i">TMP:a</subfield>
+            </datafield>""")))
+        self.assertTrue(uses(make_numbered_record(1, """
+            <datafield tag="FFT" ind1=" " ind2=" ">
+              <subfield code="a">/tmp/a.pdf</subfield>
+              <subfield code="v">TMP:1</subfield>
+            </datafield>""")))
+        self.assertTrue(uses(make_numbered_record(1, """
+            <datafield tag="BDR" ind1=" " ind2=" ">
+              <subfield code="i">TMP:a</subfield>
+            </datafield>""")))
+        self.assertTrue(uses(make_numbered_record(1, """
+            <datafield tag="BDM" ind1=" " ind2=" ">
+              <subfield code="i">TMP:a</subfield>
+            </datafield>""")))
+
+    def test_record_identifiers(self):
+        """bibupload - identifiers matching a record with an existing one"""
+        record = make_numbered_record(7, """
+            <datafield tag="035" ind1=" " ind2=" ">
+              <subfield code="a">oai:example.org:7</subfield>
+            </datafield>
+            <datafield tag="970" ind1=" " ind2=" ">
+              <subfield code="a">SYS007</subfield>
+            </datafield>
+            <datafield tag="024" ind1="7" ind2=" ">
+              <subfield code="2">DOI</subfield>
+              <subfield code="a">10.1234/seven</subfield>
+            </datafield>""")
+        self.assertEqual(engine.get_record_identifiers(record),
+                         set([('001', '7'), ('oai', 'oai:example.org:7'),
+                              ('sysno', 'SYS007'),
+                              ('doi', '10.1234/seven')]))
+        self.assertEqual(engine.get_record_identifiers(make_record(
+            datafields="""
+            <datafield tag="245" ind1=" " ind2=" ">
+              <subfield code="a">No identifiers</subfield>
+            </datafield>""")), set())
+
+    def _upload(self, records, workers):
+        """Upload RECORDS with a fake bibupload, return the events."""
+        events = []
+
+        def bibupload(record, **kwargs):
+            recid = record['001'][0][3]
+            if 'tmp_ids' in kwargs:
+                events.append(('serial', recid))
+            if recid == '2':
+                return (1, int(recid), 'error')
+            engine.stat['nb_records_inserted'] += 1
+            return (0, int(recid), '')
+
+        stat = dict((key, 0) for key in engine.STAT_COUNTERS)
+        stat['nb_records_to_upload'] = len(records)
+        module = 'invenio.legacy.bibupload.engine.'
+        with patch(module + 'bibupload', bibupload), \
+                patch(module + 'multiprocessing.Pool', FakePool(events)), \
+                patch(module + '_close_sqlalchemy_connections'), \
+                patch(module + 'task_sleep_now_if_required'), \
+                patch(module + 'task_update_progress'), \
+                patch(module + 'write_message'), \
+                patch.object(engine, 'stat', stat):
+            results = engine.bibupload_records(records, opt_mode='replace',
+                                               workers=workers)
+        return events, results, stat
+
+    def test_batches(self):
+        """bibupload - batches are uploaded before conflicting records"""
+        records = [make_numbered_record(1), make_numbered_record(2),
+                   make_numbered_record(1),
+                   make_numbered_record(4, """
+                       <datafield tag="FFT" ind1=" " ind2=" ">
+                         <subfield code="a">/tmp/a.pdf</subfield>
+                         <subfield code="i">TMP:a</subfield>
+                       </datafield>"""),
+                   make_numbered_record(3)]
+        events, dummy, dummy = self._upload(records, workers=2)
+        self.assertEqual(events, [('batch', ['1', '2']), ('batch', ['1']),
+                                  ('serial', '4'), ('batch', ['3'])])
+
+    def test_worker_initializer(self):
+        """bibupload - workers do not use the connections of the parent"""
+        module = 'invenio.legacy.bibupload.engine.'
+        with patch(module + '_close_sqlalchemy_connections') as close, \
+                patch(module + 'signal.signal') as set_handler:
+            engine._init_bibupload_worker()
+        close.assert_called_once_with()
+        set_handler.assert_any_call(engine.signal.SIGINT,
+                                    engine.signal.SIG_IGN)
+
+    def test_same_statistics(self):
+        """bibupload - workers report the same statistics as serial run"""
+        records = [make_numbered_record(recid) for recid in range(1, 6)]
+        dummy, serial_results, serial_stat = self._upload(records, 1)
+        dummy, parallel_results, parallel_stat = self._upload(records, 2)
+        self.assertEqual(serial_results, parallel_results)
+        self.assertEqual(serial_stat, parallel_stat)
+        self.assertEqual(serial_stat['nb_records_inserted'], 4)
+        self.assertEqual(serial_stat['nb_errors'], 1)
+
+    def test_records_counted_while_read(self):
+        """bibupload - input records are counted as they are read"""
+        records = [make_numbered_record(recid) for recid in range(1, 4)]
+        stat = {'nb_records_to_upload': 0}
+        with patch.object(engine, 'stat', stat):
+            counted = engine.count_records_to_upload(iter(records))
+            self.assertEqual(next(counted), records[0])
+            self.assertEqual(stat['nb_records_to_upload'], 1)
+            self.assertEqual(list(counted), records[1:])
+        self.assertEqual(stat['nb_records_to_upload'], 3)
+
+
+TEST_SUITE = make_test_suite(BibxxxRowsTest, ParallelUploadTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
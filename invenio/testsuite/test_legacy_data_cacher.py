@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of Invenio.
+# Copyright (C) 2015 CERN.
+#
+# Invenio is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation; either version 2 of the
+# License, or (at your option) any later version.
+#
+# Invenio is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Invenio; if not, write to the Free Software Foundation, Inc.,
+# 59 Temple Place, Suite 330, Boston, MA 02111-1307, USA.
+
+
+"""Unit tests for the shared storage of data cacher."""
+
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy
+
+from intbitset import intbitset
+from mock import patch
+
+from invenio.base.wrappers import lazy_import
+from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
+
+data_cacher = lazy_import('invenio.legacy.miscutil.data_cacher')
+
+
+class ArrayHolder(object):
+
+    """Object holding numpy arrays, like the citation graph."""
+
+    def __init__(self, size):
+        self.pointers = numpy.arange(size + 1, dtype=numpy.int32)
+        self.weights = numpy.ones(size, dtype=numpy.float32)
+
+
+class SharedDataCacherTest(InvenioTestCase):
+
+    """Test memory-mapped shared caches."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_dict_roundtrip(self):
+        """data cacher - shared dictionary keeps all values"""
+        cache = {'Articles': intbitset([1, 2, 3]),
+                 'Books': {'en': 'Books', 'fr': 'Livres'},
+                 'Buckets': {'a': intbitset([5])},
+                 42: [(1, 2), (3, 4)]}
+        data_cacher.write_shared_cache(self.path, cache,
+                                       '2015-01-01 00:00:00')
+        shared, timestamp = data_cacher.map_shared_cache(self.path)
+        self.assertEqual(timestamp, '2015-01-01 00:00:00')
+        self.assertEqual(dict(shared), cache)
+
+    def test_local_changes(self):
+        """data cacher - shared dictionary can be altered locally"""
+        data_cacher.write_shared_cache(self.path, {'a': 1, 'b': 2},
+                                       '2015-01-01 00:00:00')
+        shared, dummy = data_cacher.map_shared_cache(self.path)
+        shared['a'] = 3
+        del shared['b']
+        shared['c'] = 4
+        self.assertEqual(dict(shared), {'a': 3, 'c': 4})
+        self.assertEqual(
+            dict(data_cacher.map_shared_cache(self.path)[0]),
+            {'a': 1, 'b': 2})
+
+    def test_loaded_values_bounded(self):
+        """data cacher - shared dictionary keeps few values deserialized"""
+        cache = dict(('c%d' % i, intbitset([i])) for i in range(5))
+        data_cacher.write_shared_cache(self.path, cache,
+                                       '2015-01-01 00:00:00')
+        shared, dummy = data_cacher.map_shared_cache(self.path)
+        shared = data_cacher.SharedCacheDict(shared._mapped, shared._offset,
+                                             max_loaded_values=2)
+        for dummy in range(2):
+            for key in sorted(cache):
+                self.assertEqual(shared[key], cache[key])
+                self.assertTrue(len(shared._loaded) <= 2)
+        self.assertEqual(list(shared._loaded), ['c3', 'c4'])
+        self.assertEqual(dict(shared), cache)
+
+    def test_arrays_mapped(self):
+        """data cacher - numpy arrays are mapped in place"""
+        cache = {'weights': numpy.arange(10, dtype=numpy.float64),
+                 'matrix': numpy.arange(6, dtype=numpy.int32).reshape(2, 3),
+                 'empty': numpy.array([], dtype=numpy.int64)}
+        data_cacher.write_shared_cache(self.path, cache,
+                                       '2015-01-01 00:00:00')
+        shared, dummy = data_cacher.map_shared_cache(self.path)
+        for key, value in cache.items():
+            self.assertEqual(shared[key].dtype, value.dtype)
+            self.assertEqual(shared[key].shape, value.shape)
+            self.assertTrue((shared[key] == value).all())
+        self.assertFalse(shared['weights'].flags.writeable)
+        self.assertFalse(shared['weights'].flags.owndata)
+        self.assertTrue(shared['weights'] is shared['weights'])
+
+    def test_nested_dicts_mapped(self):
+        """data cacher - nested dictionaries are searched in place"""
+        buckets = dict((i, intbitset([i])) for i in range(3))
+        weights = dict((i, i * 2) for i in range(2000))
+        cache = {'buckets': buckets, 'weights': weights,
+                 'small': {u'en': 'Books'}}
+        data_cacher.write_shared_cache(self.path, cache,
+                                       '2015-01-01 00:00:00')
+        shared, dummy = data_cacher.map_shared_cache(self.path)
+        self.assertTrue(isinstance(shared['buckets'],
+                                   data_cacher.SharedCacheDict))
+        self.assertTrue(isinstance(shared['weights'],
+                                   data_cacher.SharedCacheDict))
+        self.assertTrue(isinstance(shared['small'], dict))
+        self.assertEqual(shared['buckets'][1L], intbitset([1]))
+        self.assertEqual(shared['weights'][1999], 3998)
+        self.assertFalse(2000 in shared['weights'])
+        self.assertEqual(dict(shared['weights']), weights)
+        self.assertEqual(shared['small']['en'], 'Books')
+
+    def test_objects_and_tuples_mapped(self):
+        """data cacher - arrays of objects and tuples are mapped"""
+        cache = {'graph': ArrayHolder(5),
+                 'counts': (numpy.arange(3), numpy.arange(4), 'citations')}
+        data_cacher.write_shared_cache(self.path, cache,
+                                       '2015-01-01 00:00:00')
+        shared, dummy = data_cacher.map_shared_cache(self.path)
+        graph = shared['graph']
+        self.assertTrue(isinstance(graph, ArrayHolder))
+        self.assertEqual(list(graph.pointers), range(6))
+        self.assertFalse(graph.weights.flags.owndata)
+        counts = shared['counts']
+        self.assertEqual(len(counts), 3)
+        self.assertEqual(list(counts[1]), range(4))
+        self.assertEqual(counts[2], 'citations')
+
+    def test_list_roundtrip(self):
+        """data cacher - shared cache can hold other objects than dict"""
+        data_cacher.write_shared_cache(self.path, ['a', 'b'],
+                                       '2015-01-01 00:00:00')
+        self.assertEqual(data_cacher.map_shared_cache(self.path)[0],
+                         ['a', 'b'])
+
+    def test_missing_file(self):
+        """data cacher - missing shared cache file is detected"""
+        self.assertEqual(data_cacher.map_shared_cache(self.path),
+                         (None, None))
+
+    def test_refill_only_when_needed(self):
+        """data cacher - shared cache is filled only when outdated"""
+        calls = []
+
+        def cache_filler():
+            calls.append(1)
+            return {'a': intbitset([1])}
+
+        self.app.config['CFG_CACHEDIR'] = self.tmpdir
+        load = data_cacher.load_shared_cache
+        load('test', cache_filler, lambda: '2015-01-01 00:00:00')
+        load('test', cache_filler, lambda: '2015-01-01 00:00:00')
+        self.assertEqual(len(calls), 1)
+        load('test', cache_filler, lambda: '9999-01-01 00:00:00')
+        self.assertEqual(len(calls), 2)
+
+
+class TableVersionRegistryTest(InvenioTestCase):
+
+    """Test batched table update time checks."""
+
+    def test_single_query(self):
+        """data cacher - watched tables are checked in one query"""
+        registry = data_cacher.TableVersionRegistry(check_interval=3600)
+        update_times = {'collection': '2015-01-01 00:00:00',
+                        'fieldname': '2015-01-02 00:00:00'}
+        with patch('invenio.legacy.miscutil.data_cacher.'
+                   'get_table_update_times',
+                   return_value=update_times) as get_update_times:
+            registry.get_update_time('collection')
+            registry.get_update_time('fieldname')
+            self.assertEqual(registry.get_update_time('collection'),
+                             '2015-01-01 00:00:00')
+            self.assertEqual(registry.get_update_time('missing'),
+                             '0000-00-00 00:00:00')
+        self.assertEqual(get_update_times.call_count, 3)
+
+    def test_bump(self):
+        """data cacher - updated tables can be announced by signal"""
+        from invenio.base.signals import tables_updated
+        registry = data_cacher.table_version_registry
+        registry.update_times['collection'] = '2015-01-01 00:00:00'
+        tables_updated.send('test', tables=['collection'])
+        self.assertTrue(registry.update_times['collection'] >
+                        '2015-01-01 00:00:00')
+
+
+class BackgroundDataCacherTest(InvenioTestCase):
+
+    """Test recreation of caches in a background thread."""
+
+    def test_old_cache_served(self):
+        """data cacher - outdated cache is served while being refilled"""
+        filling = threading.Event()
+        filled = threading.Event()
+        timestamps = ['0000-00-00 00:00:00']
+        contents = [{'a': 1}, {'a': 2}]
+
+        def cache_filler():
+            if len(contents) == 1:
+                filling.set()
+                filled.wait(10)
+            return contents.pop(0)
+
+        self.app.config['CFG_DATACACHER_BACKGROUND_CACHES'] = ['test']
+        with patch.object(data_cacher.DataCacher, 'name', 'test'):
+            cacher = data_cacher.DataCacher(cache_filler,
+                                            lambda: timestamps[0])
+            self.assertEqual(cacher.cache, {'a': 1})
+            timestamps[0] = '9999-01-01 00:00:00'
+            with self.app.test_request_context():
+                cacher.recreate_cache_if_needed()
+                self.assertTrue(filling.wait(10))
+                cacher.recreate_cache_if_needed()
+                self.assertEqual(cacher.cache, {'a': 1})
+                filled.set()
+                cacher._refill_thread.join(10)
+        self.assertEqual(cacher.cache, {'a': 2})
+
+
+TEST_SUITE = make_test_suite(SharedDataCacherTest, TableVersionRegistryTest,
+                             BackgroundDataCacherTest)
+
+if __name__ == "__main__":
+    run_test_suite(TEST_SUITE)
@@ -21,6 +21,8 @@
 
 __revision__ = "$Id$"
 
+from mock import patch
+
 from invenio.base.wrappers import lazy_import
 from invenio.testsuite import make_test_suite, run_test_suite, InvenioTestCase
 
@@ -86,6 +88,26 @@ class TableUpdateTimesTest(InvenioTestCase):
                          ('\xce\xb2', '\xce\xb2', 'CEB2', 'CEB2', 2L, 2L, 1L, 2L))
         dbquery.run_sql("DROP TEMPORARY TABLE test__invenio__utf8")
 
+class TableUpdateTimesBatchTest(InvenioTestCase):
+    """Test reading update times of several tables at once."""
+
+    def test_mixed_case_table_names(self):
+        """dbquery - update times of mixed-case table names"""
+        def run_sql(query, params, run_on_slave=False):
+            self.assertTrue('idxINDEX' in params)
+            self.assertTrue('idxindex' in params)
+            # server with lower_case_table_names=1 reports lowercased names
+            return (('idxindex', '2015-01-01 00:00:00'),
+                    ('accROLE', '2015-01-02 00:00:00'))
+
+        with patch('invenio.legacy.dbquery.run_sql', run_sql):
+            self.assertEqual(
+                dbquery.get_table_update_times(['idxINDEX', 'accROLE',
+                                                'collection']),
+                {'idxINDEX': '2015-01-01 00:00:00',
+                 'accROLE': '2015-01-02 00:00:00'})
+
+
 class WashTableColumnNameTest(InvenioTestCase):
     """Test if wash_table_column_name and real_escape_string evaluates correctly."""
 
@@ -104,7 +126,8 @@ class WashTableColumnNameTest(InvenioTestCase):
         self.assertNotEqual(dbquery.real_escape_string(testcase_injection), testcase_injection)
 
 
-TEST_SUITE = make_test_suite(TableUpdateTimesTest, WashTableColumnNameTest)
+TEST_SUITE = make_test_suite(TableUpdateTimesTest, TableUpdateTimesBatchTest,
+                             WashTableColumnNameTest)
 
 if __name__ == "__main__":
     run_test_suite(TEST_SUITE)
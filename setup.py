@@ -200,6 +200,10 @@ extras_require = {
     "rabbitmq": [
         "amqp>=1.4.5",
     ],
+    # Faster sparse matrix products for the citerank methods
+    "scipy": [
+        "scipy>=0.12",
+    ],
     "github": [
         "github3.py>=0.9"
     ],